@@ -0,0 +1,109 @@
+"""Расчет бонуса к пачке начислений: прежняя цепочка условий, поиск ступени bisect и векторный вызов.
+
+Правила берутся из bonus_service/app/rules.py. Способы:
+    if_chain    - прежний calculate_bonus_multiplier: сравнения по ступеням и Decimal на каждую сумму
+    bisect      - RuleSet.apply для каждой суммы
+    vectorized  - RuleSet.apply_many для всей пачки
+
+С --tiers N правила собираются из N ступеней (по умолчанию - bonus_rules.json сервиса), цепочка условий
+тогда проходит ступени по очереди. Результаты способов сверяются между собой.
+
+Пример:
+    python benchmarks/bonus_rules.py --batch 1000 --tiers 2 20
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from common import ROOT, git_commit, save_results
+
+sys.path.insert(0, str(ROOT / "bonus_service"))
+from app import money, rules  # noqa: E402
+
+
+def tiered_config(tiers: int) -> dict:
+    step = Decimal(10000) / (tiers + 1)
+    return {
+        "version": f"benchmark-{tiers}",
+        "accrual": {"tiers": [
+            {"above": str(money.to_amount(step * (i + 1))), "multiplier": str(Decimal(1) + Decimal(i + 1) / 100)}
+            for i in range(tiers)
+        ]},
+        "events": {"delivery_completed": {"amount": "50.00", "reason": "benchmark"}},
+    }
+
+
+def if_chain(config: dict):
+    """Ступени по убыванию порога, как в прежнем коде: первая подошедшая задает множитель"""
+    tiers = sorted(
+        ((Decimal(tier["above"]), Decimal(tier["multiplier"])) for tier in config["accrual"]["tiers"]), reverse=True
+    )
+
+    def apply(amount: Decimal) -> Decimal:
+        multiplier = Decimal("1")
+        for above, tier_multiplier in tiers:
+            if amount > above:
+                multiplier = tier_multiplier
+                break
+        return money.to_amount(amount * multiplier)
+    return apply
+
+
+def timed(function, rounds: int) -> tuple[float, object]:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return (time.perf_counter() - started) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=1000, help="сумм в пачке")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--tiers", type=int, nargs="*", default=[], help="числа ступеней синтетических правил")
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    random.seed(1)
+    amounts = [money.from_minor_units(random.randint(1, 1_000_000)) for _ in range(args.batch)]
+    with open(rules.BONUS_RULES_FILE, encoding="utf-8") as file:
+        configs = {"service": json.load(file)}
+    configs.update({f"{tiers}_tiers": tiered_config(tiers) for tiers in args.tiers})
+
+    measured = {}
+    for name, config in configs.items():
+        ruleset = rules.compile_rules(config)
+        legacy = if_chain(config)
+        modes = {
+            "if_chain": lambda: [legacy(amount) for amount in amounts],
+            "bisect": lambda: [ruleset.apply(amount) for amount in amounts],
+            "vectorized": lambda: ruleset.apply_many(amounts),
+        }
+        results = {}
+        outputs = []
+        for mode, function in modes.items():
+            per_batch, output = timed(function, args.rounds)
+            outputs.append(output)
+            results[mode] = {"batch_us": round(per_batch * 1e6, 1), "per_amount_us": round(per_batch / args.batch * 1e6, 3)}
+        if any(output != outputs[0] for output in outputs):
+            raise SystemExit(f"{name}: modes disagree")
+        measured[name] = results
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "bonus_rules",
+        "config": {"batch": args.batch, "rounds": args.rounds, "tiers": args.tiers},
+        "rules": measured,
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
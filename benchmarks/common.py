@@ -0,0 +1,59 @@
+"""Общие помощники бенчмарков: статистика задержек, тестовые данные и сохранение результатов"""
+import json
+import subprocess
+import time
+from pathlib import Path
+from uuid import uuid4
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def delivery_payload(order_id: str | None = None) -> dict:
+    return {
+        "order_id": order_id or str(uuid4()),
+        "address_from": "ул. Ленина, 1",
+        "address_to": "ул. Пушкина, 10",
+        "recipient_name": "Иван Иванов",
+        "recipient_phone": "+79123456789"
+    }
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Сводка по задержкам в секундах: число запросов, ошибки, rps и перцентили в миллисекундах"""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results: dict, path: str | None = None) -> Path:
+    """Сохранение результатов в JSON; по умолчанию benchmarks/results/<коммит>-<время>.json"""
+    if path is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        target = RESULTS_DIR / f"{results['commit']}-{int(time.time())}.json"
+    else:
+        target = Path(path)
+    target.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    return target
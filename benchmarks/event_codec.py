@@ -0,0 +1,102 @@
+"""Микробенчмарк кодирования события delivery_completed: JSON против бинарного формата.
+
+Кодирование и разбор берутся из shared/service_common/codec.py, общего для публикатора
+(delivery_service) и потребителя (bonus_service). Для каждого формата считаются время кодирования и
+разбора одного сообщения, размер тела и доля ядра CPU, которую съест поток --rate сообщений в секунду.
+
+Пример:
+    python benchmarks/event_codec.py --messages 200000 --rate 100000
+"""
+import argparse
+import importlib.util
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from common import ROOT, git_commit, save_results
+
+
+def load_codec():
+    spec = importlib.util.spec_from_file_location("service_codec", ROOT / "shared" / "service_common" / "codec.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_events(count: int) -> list[dict]:
+    """События в том виде, в каком их кладет в outbox delivery_service"""
+    started = datetime.utcnow()
+    events = []
+    for number in range(count):
+        order_id = str(uuid4())
+        events.append({
+            "delivery_id": str(uuid4()),
+            "order_id": order_id,
+            "account_id": order_id,
+            "completed_at": (started + timedelta(milliseconds=number)).isoformat(),
+        })
+    return events
+
+
+def per_message_ns(function, items: list, repeats: int) -> float:
+    """Лучшее из repeats прогонов: время на одно сообщение без шума планировщика"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter_ns()
+        for item in items:
+            function(item)
+        timings.append((time.perf_counter_ns() - started) / len(items))
+    return min(timings)
+
+
+def measure(publisher, consumer, content_type: str, events: list[dict], repeats: int, rate: int) -> dict:
+    bodies = [publisher.encode(event, content_type) for event in events]
+    encode_ns = per_message_ns(lambda event: publisher.encode(event, content_type), events, repeats)
+    decode_ns = per_message_ns(lambda body: consumer.decode(body, content_type), bodies, repeats)
+    size = statistics.mean(len(body) for body in bodies)
+    return {
+        "encode_us": round(encode_ns / 1000, 3),
+        "decode_us": round(decode_ns / 1000, 3),
+        "size_bytes": round(size, 1),
+        # Сколько ядер уйдет на кодирование и разбор при заданном потоке сообщений
+        "encode_cores_at_rate": round(encode_ns * rate / 1e9, 3),
+        "decode_cores_at_rate": round(decode_ns * rate / 1e9, 3),
+        "bandwidth_mb_s_at_rate": round(size * rate / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--rate", type=int, default=100_000, help="поток сообщений в секунду для пересчета")
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    publisher = consumer = load_codec()
+    events = make_events(args.messages)
+
+    # Разбор бинарного сообщения должен вернуть то же, что и разбор JSON
+    sample = events[0]
+    assert consumer.decode(publisher.encode(sample, publisher.BINARY_CONTENT_TYPE), publisher.BINARY_CONTENT_TYPE) \
+        == consumer.decode(publisher.encode(sample, publisher.JSON_CONTENT_TYPE), publisher.JSON_CONTENT_TYPE)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "event_codec",
+        "config": {"messages": args.messages, "repeats": args.repeats, "rate": args.rate},
+        "formats": {
+            "json": measure(publisher, consumer, publisher.JSON_CONTENT_TYPE, events, args.repeats, args.rate),
+            "binary": measure(publisher, consumer, publisher.BINARY_CONTENT_TYPE, events, args.repeats, args.rate),
+        },
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Чтения нескольких горячих доставок или счетов множеством одновременных клиентов.
+
+Приложение сервиса запускается в процессе бенчмарка поверх Postgres (как pipeline.py --target
+inprocess), клиенты по кругу опрашивают --keys ресурсов. Кроме задержек считается число SQL-запросов
+на один HTTP-запрос. Способы:
+    direct             - каждый запрос читает БД сам (совмещение чтений отключено)
+    singleflight       - одновременные чтения одного ключа ждут одну загрузку
+    singleflight_etag  - то же, клиент присылает If-None-Match с последним ETag и получает 304
+
+Кеш ответов задается переменными сервиса (BALANCE_CACHE_TTL, DELIVERY_CACHE_TTL); для замера
+совмещения чтений без кеша их нужно обнулить.
+
+Пример:
+    BALANCE_CACHE_TTL=0 BONUS_DATABASE_URL=postgresql://... \\
+        python benchmarks/hot_reads.py --service bonus --clients 200 --keys 5
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+from sqlalchemy import event
+
+from common import ROOT, delivery_payload, git_commit, save_results, summarize
+from pipeline import BONUS_DATABASE_URL, DELIVERY_DATABASE_URL, load_service, migrate
+
+MODES = ["direct", "singleflight", "singleflight_etag"]
+
+
+async def prepare(client: httpx.AsyncClient, service: str, keys: int) -> list[str]:
+    paths = []
+    for _ in range(keys):
+        if service == "delivery":
+            response = await client.post("/api/deliveries", json=delivery_payload())
+            paths.append(f"/api/deliveries/{response.json()['id']}")
+        else:
+            account_id = str(uuid4())
+            await client.post(
+                f"/api/accounts/{account_id}/accrue",
+                json={"order_id": str(uuid4()), "amount": 100.0, "reason": "benchmark"}
+            )
+            paths.append(f"/api/accounts/{account_id}/balance")
+    return paths
+
+
+async def measure(client: httpx.AsyncClient, paths: list[str], clients: int, total: int, conditional: bool) -> dict:
+    latencies = []
+    errors = not_modified = 0
+    remaining = total
+    etags = {}
+
+    async def worker(offset: int):
+        nonlocal remaining, errors, not_modified
+        index = offset
+        while remaining > 0:
+            remaining -= 1
+            path = paths[index % len(paths)]
+            index += 1
+            headers = {"If-None-Match": etags[path]} if conditional and path in etags else None
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code == 304:
+                not_modified += 1
+            elif response.status_code == 200:
+                etags[path] = response.headers["ETag"]
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(clients)))
+    return {**summarize(latencies, time.perf_counter() - started, errors), "not_modified": not_modified}
+
+
+async def run(args) -> dict:
+    directory = ROOT / f"{args.service}_service"
+    url = DELIVERY_DATABASE_URL if args.service == "delivery" else BONUS_DATABASE_URL
+    main_module = load_service("service_app", directory / "app", url)
+    migrate(directory, url)
+    database = sys.modules["service_app.database"]
+    cache = sys.modules["service_app.cache"]
+    flights = cache.delivery_flights if args.service == "delivery" else cache.balance_flights
+
+    statements = 0
+
+    @event.listens_for(database.engine.sync_engine, "before_cursor_execute")
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    listener = None
+    if args.service == "bonus":
+        # Кеш балансов в памяти работает, только пока процесс слушает уведомления об изменениях
+        listener = asyncio.create_task(cache.run_invalidation_listener())
+        while not cache.balance_cache.local_enabled and not listener.done():
+            await asyncio.sleep(0.01)
+
+    do = flights.do
+    measured = {}
+    try:
+        async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main_module.app), base_url="http://service", timeout=60
+        ) as client:
+            paths = await prepare(client, args.service, args.keys)
+            for mode in args.modes:
+                # Без совмещения загрузка вызывается напрямую тем же кодом маршрута
+                flights.do = do if mode != "direct" else (lambda key, load: load())
+                statements = 0
+                result = await measure(client, paths, args.clients, args.requests, mode == "singleflight_etag")
+                measured[mode] = {**result, "statements_per_request": round(statements / args.requests, 4)}
+    finally:
+        if listener is not None:
+            listener.cancel()
+        await database.engine.dispose()
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--service", default="delivery", choices=["delivery", "bonus"])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--keys", type=int, default=5, help="горячих ресурсов, которые опрашивают клиенты")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "hot_reads",
+        "config": {"service": args.service, "clients": args.clients, "keys": args.keys, "requests": args.requests},
+        "modes": asyncio.run(run(args)),
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
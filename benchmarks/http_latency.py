@@ -0,0 +1,90 @@
+"""Замер задержек HTTP API сервисов при заданном числе одновременных клиентов.
+
+Пример:
+    python benchmarks/http_latency.py --scenario delivery-read --clients 500 --requests 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+import httpx
+
+from common import delivery_payload, summarize
+
+DELIVERY_URL = "http://localhost:8001/api"
+BONUS_URL = "http://localhost:8002/api"
+
+
+async def prepare(client: httpx.AsyncClient, scenario: str) -> dict:
+    """Подготовка данных, к которым обращается сценарий"""
+    if scenario == "delivery-read":
+        response = await client.post(f"{DELIVERY_URL}/deliveries", json=delivery_payload())
+        return {"delivery_id": response.json()["id"]}
+    if scenario in ("bonus-balance", "bonus-accrue"):
+        account_id = str(uuid4())
+        await client.post(
+            f"{BONUS_URL}/accounts/{account_id}/accrue",
+            json={"order_id": str(uuid4()), "amount": 100.0, "reason": "benchmark"}
+        )
+        return {"account_id": account_id}
+    return {}
+
+
+def build_request(client: httpx.AsyncClient, scenario: str, context: dict):
+    if scenario == "delivery-read":
+        return client.get(f"{DELIVERY_URL}/deliveries/{context['delivery_id']}")
+    if scenario == "delivery-create":
+        return client.post(f"{DELIVERY_URL}/deliveries", json=delivery_payload())
+    if scenario == "bonus-balance":
+        return client.get(f"{BONUS_URL}/accounts/{context['account_id']}/balance")
+    if scenario == "bonus-accrue":
+        return client.post(
+            f"{BONUS_URL}/accounts/{context['account_id']}/accrue",
+            json={"order_id": str(uuid4()), "amount": 10.0, "reason": "benchmark"}
+        )
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run(scenario: str, clients: int, total_requests: int) -> dict:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        context = await prepare(client, scenario)
+        latencies = []
+        errors = 0
+        remaining = total_requests
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await build_request(client, scenario, context)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {"scenario": scenario, "clients": clients, **summarize(latencies, elapsed, errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", default="delivery-read",
+                        choices=["delivery-read", "delivery-create", "bonus-balance", "bonus-accrue"])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.scenario, args.clients, args.requests)), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Цена заголовка Idempotency-Key для начисления баллов: задержка и SQL-запросы на один запрос.
+
+Приложение бонусного сервиса запускается в процессе бенчмарка поверх Postgres, как в pipeline.py
+--target inprocess. Способы:
+    no_key         - начисление без заголовка
+    new_key        - каждый запрос с новым ключом: чтение ключа, начисление и вставка ключа
+    replay_cached  - повтор того же запроса, ответ из кеша процесса
+    replay_db      - повтор при пустом кеше процесса (другой воркер gunicorn): одно чтение по ключу
+
+Пример:
+    BONUS_DATABASE_URL=postgresql://... python benchmarks/idempotency_overhead.py --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+from sqlalchemy import event
+
+from common import ROOT, git_commit, save_results, summarize
+from pipeline import BONUS_DATABASE_URL, load_service, migrate
+
+MODES = ["no_key", "new_key", "replay_cached", "replay_db"]
+
+
+async def measure(client: httpx.AsyncClient, idempotency, mode: str, clients: int, total: int) -> dict:
+    account_id = str(uuid4())
+    payload = {"order_id": str(uuid4()), "amount": 1.0, "reason": "benchmark"}
+    replay_key = str(uuid4())
+    if mode.startswith("replay"):
+        await client.post(f"/api/accounts/{account_id}/accrue", json=payload, headers={"Idempotency-Key": replay_key})
+
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            headers = None
+            if mode == "new_key":
+                headers = {"Idempotency-Key": str(uuid4())}
+            elif mode.startswith("replay"):
+                headers = {"Idempotency-Key": replay_key}
+                if mode == "replay_db":
+                    idempotency.responses.entries.clear()
+            started = time.perf_counter()
+            response = await client.post(f"/api/accounts/{account_id}/accrue", json=payload, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run(args) -> dict:
+    directory = ROOT / "bonus_service"
+    main_module = load_service("service_app", directory / "app", BONUS_DATABASE_URL)
+    migrate(directory, BONUS_DATABASE_URL)
+    database = sys.modules["service_app.database"]
+    idempotency = sys.modules["service_app.routes"].idempotency_keys
+
+    statements = 0
+
+    @event.listens_for(database.engine.sync_engine, "before_cursor_execute")
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    measured = {}
+    try:
+        async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main_module.app), base_url="http://bonus", timeout=60
+        ) as client:
+            for mode in args.modes:
+                statements = 0
+                result = await measure(client, idempotency, mode, args.clients, args.requests)
+                # Для повторов в счет попадает и первый, настоящий запрос
+                measured[mode] = {**result, "statements_per_request": round(statements / args.requests, 3)}
+    finally:
+        await database.engine.dispose()
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "idempotency_overhead",
+        "config": {"clients": args.clients, "requests": args.requests},
+        "modes": asyncio.run(run(args)),
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Цена записи в лог для вызывающего кода: print() против структурного лога через очередь.
+
+Каждый способ --records раз пишет строку об обработанной пачке сообщений, как потребитель бонусного
+сервиса, в канал, который читает отдельный процесс (как stdout контейнера читает Docker). Замеряется
+время вызова в потоке event loop, полное время вместе с дописыванием очереди потоком записи и сколько
+записей дошло до вывода. Доля ядра пересчитывается на поток --rate записей в секунду. С
+--reader-delay-us читатель не успевает за записью, как сборщик логов под нагрузкой: print() тогда
+ждет освобождения канала, а очередь отбрасывает лишнее.
+
+Способы: print - f-строка в stdout, sync_json - JSON-форматирование и запись в вызывающем потоке,
+queued_json - service_common/logs.py без ограничения частоты, queued_rate_limited - он же с --rate-limit.
+
+Пример:
+    python benchmarks/logging_overhead.py --records 200000 --rate 20000
+    python benchmarks/logging_overhead.py --reader-delay-us 50
+"""
+import argparse
+import importlib.util
+import io
+import json
+import logging
+import queue
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from common import ROOT, git_commit, save_results
+
+BATCH_SIZE = 100
+TEMPLATE = "Processed batch of %d messages, %d new accruals"
+
+
+def load_logs():
+    spec = importlib.util.spec_from_file_location("service_logs", ROOT / "shared" / "service_common" / "logs.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CountingHandler(logging.StreamHandler):
+    """Запись в поток с подсчетом дошедших до вывода записей"""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.written = 0
+
+    def emit(self, record):
+        super().emit(record)
+        self.written += 1
+
+
+def open_sink(reader_delay_us: float):
+    """Канал в отдельный процесс, который читает и выбрасывает вывод, тратя reader_delay_us на строку"""
+    command = ["cat"] if reader_delay_us <= 0 else [
+        sys.executable, "-c",
+        f"import sys, time\nfor line in sys.stdin.buffer: time.sleep({reader_delay_us / 1e6})",
+    ]
+    reader = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    return reader, io.TextIOWrapper(reader.stdin, encoding="utf-8", line_buffering=True)
+
+
+def measure_print(stream, records: int, correlation_ids: list[str]) -> dict:
+    started = time.perf_counter()
+    for _ in range(records):
+        print(f"✅ Processed batch of {BATCH_SIZE} messages, {BATCH_SIZE} new accruals: {correlation_ids}", file=stream)
+    elapsed = time.perf_counter() - started
+    return {"caller_s": elapsed, "total_s": elapsed, "written": records}
+
+
+def measure_logger(logs, mode: str, stream, records: int, correlation_ids: list[str], rate_limit: int) -> dict:
+    output = CountingHandler(stream)
+    output.setFormatter(logs.JsonFormatter("benchmark"))
+    listener = None
+    if mode == "sync_json":
+        handler = output
+    else:
+        records_queue = queue.Queue(logs.LOG_QUEUE_SIZE)
+        handler = logs.NonBlockingQueueHandler(records_queue, rate_limit if mode == "queued_rate_limited" else 0)
+        listener = logs.DrainingQueueListener(records_queue, output)
+        listener.start()
+
+    logger = logging.getLogger(f"benchmark.{mode}")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    extra = {"correlation_ids": correlation_ids}
+    started = time.perf_counter()
+    for _ in range(records):
+        logger.info(TEMPLATE, BATCH_SIZE, BATCH_SIZE, extra=extra)
+    caller = time.perf_counter() - started
+    if listener is not None:
+        listener.stop()
+    return {"caller_s": caller, "total_s": time.perf_counter() - started, "written": output.written}
+
+
+def summarize_mode(result: dict, records: int, rate: int) -> dict:
+    caller_us = result["caller_s"] / records * 1e6
+    total_us = result["total_s"] / records * 1e6
+    return {
+        "caller_us": round(caller_us, 3),
+        "total_us": round(total_us, 3),
+        "written": result["written"],
+        "dropped_or_suppressed": records - result["written"],
+        # Доля ядра event loop, которую съедят вызовы логгера при потоке rate записей в секунду
+        "caller_cores_at_rate": round(caller_us * rate / 1e6, 3),
+    }
+
+
+def main():
+    modes = ["print", "sync_json", "queued_json", "queued_rate_limited"]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--rate", type=int, default=20_000, help="записей в секунду для пересчета")
+    parser.add_argument("--rate-limit", type=int, default=20, help="LOG_RATE_LIMIT для queued_rate_limited")
+    parser.add_argument("--modes", nargs="+", choices=modes, default=modes)
+    parser.add_argument("--reader-delay-us", type=float, default=0, help="время читателя на одну строку, мкс")
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    logs = load_logs()
+    # Те же настройки, что делает logs.setup() в сервисах
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    # Как в пачке потребителя: у части сообщений есть идентификатор запроса
+    correlation_ids = [uuid4().hex for _ in range(10)]
+
+    measured = {}
+    for mode in args.modes:
+        reader, stream = open_sink(args.reader_delay_us)
+        try:
+            if mode == "print":
+                result = measure_print(stream, args.records, correlation_ids)
+            else:
+                result = measure_logger(logs, mode, stream, args.records, correlation_ids, args.rate_limit)
+        finally:
+            stream.close()
+            reader.wait()
+        measured[mode] = summarize_mode(result, args.records, args.rate)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "logging_overhead",
+        "config": {
+            "records": args.records, "rate": args.rate, "rate_limit": args.rate_limit,
+            "reader_delay_us": args.reader_delay_us,
+        },
+        "modes": measured,
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Разбивка сквозной задержки начисления по участкам трассы из спанов в формате OTLP/JSON.
+
+Читает файлы, которые пишут сервисы с TRACING_EXPORTER=file (или файловый экспортер коллектора),
+и для каждого завершения доставки, дошедшего до потребителя, считает участки: запрос PATCH и его
+запросы к базе, ожидание в outbox до публикации, публикацию до подтверждения брокером, ожидание в
+очереди и обработку пачки потребителем с ее запросами к базе. Печатает перцентили каждого участка.
+
+Пример:
+    TRACING_EXPORTER=file TRACING_FILE=/tmp/spans.jsonl TRACING_SAMPLE_RATIO=1 \\
+        python benchmarks/pipeline.py --target inprocess --duration 30
+    python benchmarks/trace_breakdown.py /tmp/spans.jsonl
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from common import git_commit, percentile, save_results
+
+REQUEST_SPAN = "PATCH /api/deliveries/{delivery_id}"
+PUBLISH_SPAN = "delivery_completed publish"
+PROCESS_SPAN = "delivery_completed process"
+CLIENT_KIND = 3
+
+
+def load_spans(paths: list[str]) -> dict:
+    """Спаны по (traceId, spanId) с именем сервиса"""
+    spans = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                for resource_spans in json.loads(line)["resourceSpans"]:
+                    service = next(
+                        attribute["value"]["stringValue"] for attribute in resource_spans["resource"]["attributes"]
+                        if attribute["key"] == "service.name"
+                    )
+                    for scope_spans in resource_spans["scopeSpans"]:
+                        for span in scope_spans["spans"]:
+                            span["service"] = service
+                            span["start"] = int(span["startTimeUnixNano"])
+                            span["end"] = int(span["endTimeUnixNano"])
+                            spans[(span["traceId"], span["spanId"])] = span
+    return spans
+
+
+def milliseconds(nanoseconds: int) -> float:
+    return nanoseconds / 1e6
+
+
+def breakdown(spans: dict) -> list[dict]:
+    children = defaultdict(list)
+    consumers = {}
+    for (trace_id, _), span in spans.items():
+        if "parentSpanId" in span:
+            children[(trace_id, span["parentSpanId"])].append(span)
+        if span["name"] == PROCESS_SPAN:
+            for link in span.get("links", []):
+                consumers[(link["traceId"], link["spanId"])] = span
+
+    def db_spans(span) -> list[dict]:
+        return [child for child in children[(span["traceId"], span["spanId"])] if child["kind"] == CLIENT_KIND]
+
+    def db_time(span) -> float:
+        return sum(milliseconds(child["end"] - child["start"]) for child in db_spans(span))
+
+    hops = []
+    for (trace_id, span_id), request in spans.items():
+        if request["name"] != REQUEST_SPAN:
+            continue
+        for publish in children[(trace_id, span_id)]:
+            consumer = consumers.get((trace_id, publish["spanId"])) if publish["name"] == PUBLISH_SPAN else None
+            if consumer is None:
+                continue
+            # Relay может опубликовать событие раньше, чем дописан ответ на запрос: ожидание в outbox
+            # считается от последнего запроса к базе (коммит транзакции входит в него)
+            last_statement_end = max((child["end"] for child in db_spans(request)), default=request["end"])
+            hops.append({
+                "request_ms": milliseconds(request["end"] - request["start"]),
+                "request_db_ms": db_time(request),
+                "outbox_wait_ms": milliseconds(publish["start"] - last_statement_end),
+                "publish_ms": milliseconds(publish["end"] - publish["start"]),
+                "queue_wait_ms": milliseconds(consumer["start"] - publish["end"]),
+                "consumer_ms": milliseconds(consumer["end"] - consumer["start"]),
+                "consumer_db_ms": db_time(consumer),
+                "total_ms": milliseconds(consumer["end"] - request["start"]),
+            })
+    return hops
+
+
+def summarize_hops(hops: list[dict]) -> dict:
+    if not hops:
+        return {}
+    return {
+        name: {
+            "p50_ms": round(percentile(sorted(hop[name] for hop in hops), 0.50), 2),
+            "p95_ms": round(percentile(sorted(hop[name] for hop in hops), 0.95), 2),
+            "p99_ms": round(percentile(sorted(hop[name] for hop in hops), 0.99), 2),
+        }
+        for name in hops[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="файлы спанов OTLP/JSON, по пачке на строку")
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    spans = load_spans(args.files)
+    hops = breakdown(spans)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "trace_breakdown",
+        "config": {"files": args.files, "spans": len(spans), "traces": len(hops)},
+        "hops": summarize_hops(hops),
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
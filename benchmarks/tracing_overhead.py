@@ -0,0 +1,85 @@
+"""Цена трассировки для обработки запроса: выключена, трасса не попала в выборку, трасса записывается.
+
+Единица работы - корневой спан и --children вложенных (серверный спан запроса и его запросы к базе).
+Модуль берется из shared/service_common/tracing.py, экспорт записываемых спанов идет в поток, который
+их выбрасывает, - замеряется только время вызывающего кода. Доля ядра пересчитывается на поток
+--rate запросов в секунду; при доле выборки --ratio ожидаемая цена - смесь unsampled и sampled.
+
+Пример:
+    python benchmarks/tracing_overhead.py --requests 200000 --ratio 0.01
+"""
+import argparse
+import importlib.util
+import json
+import time
+from datetime import datetime, timezone
+
+from common import ROOT, git_commit, save_results
+
+
+def load_tracing():
+    spec = importlib.util.spec_from_file_location("service_tracing", ROOT / "shared" / "service_common" / "tracing.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def configure(tracing, mode: str):
+    """Состояние модуля, как после tracing.setup() с нужной долей выборки, но без записи спанов"""
+    if tracing._processor is not None:
+        tracing._processor.shutdown()
+        tracing._processor = None
+    if mode == "disabled":
+        return
+    tracing._sample_bound = 0 if mode == "unsampled" else 1 << 64
+    tracing._processor = tracing.BatchSpanProcessor(lambda spans: None, 1 << 20, 512, 1.0)
+    tracing._processor.start()
+
+
+def per_request_us(tracing, requests: int, children: int) -> float:
+    span = tracing.span
+    started = time.perf_counter()
+    for _ in range(requests):
+        with span("GET /api/accounts/{account_id}/balance", tracing.SERVER):
+            for _ in range(children):
+                with span("SELECT", tracing.CLIENT, attributes={"db.system": "postgresql"}):
+                    pass
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--children", type=int, default=5, help="вложенных спанов на запрос")
+    parser.add_argument("--ratio", type=float, default=0.01, help="доля выборки для ожидаемой цены")
+    parser.add_argument("--rate", type=int, default=5000, help="запросов в секунду для пересчета")
+    parser.add_argument("--output", help="файл результатов, по умолчанию benchmarks/results/<коммит>-<время>.json")
+    args = parser.parse_args()
+
+    tracing = load_tracing()
+    modes = {}
+    for mode in ("disabled", "unsampled", "sampled"):
+        configure(tracing, mode)
+        modes[mode] = {"per_request_us": round(per_request_us(tracing, args.requests, args.children), 3)}
+    configure(tracing, "disabled")
+
+    expected = (1 - args.ratio) * modes["unsampled"]["per_request_us"] + args.ratio * modes["sampled"]["per_request_us"]
+    for result in modes.values():
+        result["cores_at_rate"] = round(result["per_request_us"] * args.rate / 1e6, 4)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "benchmark": "tracing_overhead",
+        "config": {"requests": args.requests, "children": args.children, "ratio": args.ratio, "rate": args.rate},
+        "modes": modes,
+        "expected_per_request_us": round(expected, 3),
+        "expected_cores_at_rate": round(expected * args.rate / 1e6, 4),
+    }
+    path = save_results(results, args.output)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
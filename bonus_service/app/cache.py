@@ -0,0 +1,262 @@
+"""Кеш ответов GET /accounts/{id}/balance: память процесса и необязательный общий кеш реплик.
+
+Баланс меняют все процессы сервиса - воркеры gunicorn и app.worker, - поэтому сброс записи только в
+своем процессе недостаточен. Триггер на accounts (миграция 0003) шлет при коммите NOTIFY
+bonus_balance_changed с id счета, и каждый процесс API слушает его (run_invalidation_listener),
+сбрасывая свою запись; слушатель держит одно соединение с БД вне пула. Пока он не подключен, кеш в
+памяти процесса не используется: без уведомлений он отдавал бы чужие изменения с опозданием до
+BALANCE_CACHE_TTL.
+
+Общий кеш сбрасывает сам пишущий процесс, до ответа клиенту. Запись в него условная: invalidate
+увеличивает номер версии счета, и значение, прочитанное из БД до сброса, с устаревшей версией не
+записывается.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from uuid import UUID
+
+import asyncpg
+
+from service_common import singleflight
+from . import database
+
+logger = logging.getLogger(__name__)
+
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "10000"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "5"))
+# local - только память процесса; memory - общий кеш-заглушка в памяти для тестов; redis - общий кеш реплик
+BALANCE_CACHE_BACKEND = os.getenv("BALANCE_CACHE_BACKEND", "local")
+BALANCE_CACHE_URL = os.getenv("BALANCE_CACHE_URL", "redis://redis:6379/0")
+# Канал NOTIFY триггера accounts_balance_changed
+BALANCE_CHANGED_CHANNEL = "bonus_balance_changed"
+# Проверка соединения слушателя: обрыв без закрытия сокета иначе не заметен
+LISTENER_PING_INTERVAL = float(os.getenv("BALANCE_LISTENER_PING_INTERVAL", "10"))
+LISTENER_RETRY_DELAY = float(os.getenv("BALANCE_LISTENER_RETRY_DELAY", "1"))
+# Версия счета в общем кеше живет много дольше значения: иначе сброс версии разрешил бы устаревшую запись
+VERSION_TTL = max(3600.0, BALANCE_CACHE_TTL * 100)
+
+
+class LocalTTLCache:
+    """LRU-кеш в памяти процесса с ограничением размера и временем жизни записей.
+
+    Каждый ключ хранит номер поколения, который растет при инвалидации: значение,
+    прочитанное из БД до инвалидации, не попадет в кеш после нее. clear сбрасывает все ключи
+    сразу: поколения, выданные до него, больше не принимаются.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # Поколения растут по всему кешу; отсутствующий ключ принимает значения не старше floor
+        self.next_generation = 1
+        self.floor = 0
+
+    def get(self, key) -> tuple[object | None, int]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, self.floor
+        generation, expires_at, value = entry
+        if value is None or expires_at < time.monotonic():
+            return None, generation
+        self.entries.move_to_end(key)
+        return value, generation
+
+    def set(self, key, value, generation: int):
+        entry = self.entries.get(key)
+        if (entry is not None and entry[0] != generation) or generation < self.floor:
+            return
+        self._store(key, (generation, time.monotonic() + self.ttl, value))
+
+    def invalidate(self, key):
+        self._store(key, (self._new_generation(), 0.0, None))
+
+    def clear(self):
+        self.entries.clear()
+        self.floor = self._new_generation()
+
+    def _new_generation(self) -> int:
+        generation = self.next_generation
+        self.next_generation += 1
+        return generation
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class InMemorySharedCache:
+    """Заглушка общего кеша в памяти с интерфейсом RedisSharedCache"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.values = {}
+        self.versions = {}
+
+    async def get(self, key: str) -> tuple[bytes | None, object]:
+        value, expires_at = self.values.get(key, (None, 0.0))
+        return (value if expires_at >= time.monotonic() else None), self.versions.get(key)
+
+    async def set(self, key: str, value: bytes, version) -> bool:
+        if self.versions.get(key) != version:
+            return False
+        self.values[key] = (value, time.monotonic() + self.ttl)
+        return True
+
+    async def invalidate(self, keys: list[str]):
+        for key in keys:
+            self.versions[key] = self.versions.get(key, 0) + 1
+            self.values.pop(key, None)
+
+
+class RedisSharedCache:
+    """Общий кеш нескольких реплик в Redis; пакет redis нужен только при этом бэкенде.
+
+    Рядом со значением key хранится счетчик версии key:version, который увеличивает invalidate.
+    Запись значения - скрипт, проверяющий, что версия не изменилась с момента чтения.
+    """
+
+    SET_IF_VERSION = """
+        if (redis.call('GET', KEYS[2]) or '') ~= ARGV[2] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio
+
+        self.ttl = ttl
+        self.client = redis.asyncio.from_url(url)
+        self.set_if_version = self.client.register_script(self.SET_IF_VERSION)
+
+    @staticmethod
+    def version_key(key: str) -> str:
+        return f"{key}:version"
+
+    async def get(self, key: str) -> tuple[bytes | None, bytes]:
+        value, version = await self.client.mget(key, self.version_key(key))
+        return value, version or b""
+
+    async def set(self, key: str, value: bytes, version: bytes) -> bool:
+        return bool(await self.set_if_version(
+            keys=[key, self.version_key(key)], args=[value, version, int(self.ttl * 1000)]
+        ))
+
+    async def invalidate(self, keys: list[str]):
+        async with self.client.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.incr(self.version_key(key))
+                pipe.pexpire(self.version_key(key), int(VERSION_TTL * 1000))
+            pipe.delete(*keys)
+            await pipe.execute()
+
+
+class CacheToken(NamedTuple):
+    """Версии записи на момент промаха: поколение кеша процесса и версия в общем кеше"""
+    generation: int
+    shared_version: object = None
+
+
+class BalanceCache:
+    """Read-through кеш ответов GET /accounts/{id}/balance в сериализованном виде вместе с ETag.
+
+    Кеш процесса работает, только пока local_enabled: его включает и выключает слушатель уведомлений.
+    """
+
+    def __init__(self, local: LocalTTLCache, shared=None):
+        self.local = local
+        self.shared = shared
+        self.local_enabled = False
+
+    @staticmethod
+    def shared_key(account_id: UUID) -> str:
+        return f"balance:{account_id}"
+
+    async def get(self, account_id: UUID) -> tuple[singleflight.Representation | None, CacheToken]:
+        value, generation = self.local.get(account_id)
+        if not self.local_enabled:
+            value = None
+        if value is not None or self.shared is None:
+            return value, CacheToken(generation)
+        raw, version = await self.shared.get(self.shared_key(account_id))
+        if raw is not None:
+            value = singleflight.from_body(raw)
+            if self.local_enabled:
+                self.local.set(account_id, value, generation)
+        return value, CacheToken(generation, version)
+
+    async def set(self, account_id: UUID, value: singleflight.Representation, token: CacheToken):
+        if self.local_enabled:
+            self.local.set(account_id, value, token.generation)
+        # Сброс в этом процессе во время загрузки - значение уже устарело, версию можно не спрашивать
+        if self.shared is not None and self.local.get(account_id)[1] <= token.generation:
+            await self.shared.set(self.shared_key(account_id), value.body, token.shared_version)
+
+    def invalidate_local(self, account_ids):
+        for account_id in account_ids:
+            self.local.invalidate(account_id)
+            balance_flights.forget(account_id)
+
+    async def invalidate(self, account_ids):
+        """Вызывается после коммита изменения балансов; другие процессы сбросят кеш по NOTIFY"""
+        account_ids = list(account_ids)
+        self.invalidate_local(account_ids)
+        if self.shared is not None and account_ids:
+            await self.shared.invalidate([self.shared_key(account_id) for account_id in account_ids])
+
+    def listening(self, connected: bool):
+        """Слушатель подключен или потерян: уведомления могли быть пропущены, кеш процесса сбрасывается"""
+        self.local.clear()
+        self.local_enabled = connected
+
+
+def build_balance_cache() -> BalanceCache:
+    shared = None
+    if BALANCE_CACHE_BACKEND == "memory":
+        shared = InMemorySharedCache(BALANCE_CACHE_TTL)
+    elif BALANCE_CACHE_BACKEND == "redis":
+        shared = RedisSharedCache(BALANCE_CACHE_URL, BALANCE_CACHE_TTL)
+    return BalanceCache(LocalTTLCache(BALANCE_CACHE_SIZE, BALANCE_CACHE_TTL), shared)
+
+
+def on_balance_changed(connection, pid, channel, payload: str):
+    try:
+        account_id = UUID(payload)
+    except ValueError:
+        logger.warning("Malformed %s notification: %r", channel, payload)
+        return
+    balance_cache.invalidate_local([account_id])
+
+
+async def run_invalidation_listener():
+    """Слушатель NOTIFY изменений баланса на отдельном соединении, вне пула SQLAlchemy"""
+    dsn = database.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(dsn)
+            await connection.add_listener(BALANCE_CHANGED_CHANNEL, on_balance_changed)
+            balance_cache.listening(True)
+            logger.info("Listening for %s notifications", BALANCE_CHANGED_CHANNEL)
+            while True:
+                await asyncio.sleep(LISTENER_PING_INTERVAL)
+                await connection.execute("SELECT 1")
+        except Exception as e:
+            logger.error("Balance change listener lost, local balance cache disabled: %s", e)
+        finally:
+            balance_cache.listening(False)
+            if connection is not None:
+                connection.terminate()
+        await asyncio.sleep(LISTENER_RETRY_DELAY)
+
+
+balance_flights = singleflight.SingleFlight("balance")
+balance_cache = build_balance_cache()
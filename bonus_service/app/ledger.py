@@ -0,0 +1,193 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from uuid import UUID
+from sqlalchemy import select, update, literal, case
+from sqlalchemy.dialects.postgresql import insert
+from . import models, money
+
+
+def transaction_columns():
+    table = models.Transaction.__table__
+    return [
+        table.c.id, table.c.account_id, table.c.type, table.c.amount,
+        table.c.order_id, table.c.delivery_id, table.c.reason, table.c.created_date
+    ]
+
+
+def signed_amount(transactions=None):
+    """Сумма транзакции со знаком: списания уменьшают баланс; transactions - журнал или его отдельная секция"""
+    columns = (transactions if transactions is not None else models.Transaction.__table__).c
+    return case(
+        (columns.type == models.TransactionType.WRITE_OFF, -columns.amount),
+        else_=columns.amount
+    )
+
+
+def transaction_values(transaction_id: UUID, account_column, type: models.TransactionType, amount: Decimal,
+                       order_id: UUID, delivery_id: UUID | None, reason: str, now: datetime):
+    """SELECT-список новой транзакции, счет берется из строки, возвращенной изменением баланса"""
+    table = models.Transaction.__table__
+    return select(
+        literal(transaction_id, table.c.id.type),
+        account_column,
+        literal(type, table.c.type.type),
+        literal(amount, table.c.amount.type),
+        literal(order_id, table.c.order_id.type),
+        literal(delivery_id, table.c.delivery_id.type),
+        literal(reason, table.c.reason.type),
+        literal(now, table.c.created_date.type),
+    )
+
+
+async def accrue(db, account_id: UUID, amount: Decimal, order_id: UUID,
+                 delivery_id: UUID | None, reason: str) -> models.Transaction:
+    """Начисление одним запросом: upsert баланса и вставка транзакции в одном CTE.
+
+    С delivery_id в тот же запрос добавляется запись в delivery_accruals; повтор доставки
+    падает на ее первичном ключе с IntegrityError.
+    """
+    now = datetime.utcnow()
+    transaction_id = uuid.uuid4()
+    upsert = insert(models.Account).values(id=account_id, current_balance=amount, as_of_date=now)
+    account = upsert.on_conflict_do_update(
+        index_elements=[models.Account.id],
+        set_={
+            "current_balance": models.Account.current_balance + upsert.excluded.current_balance,
+            "as_of_date": upsert.excluded.as_of_date,
+        }
+    ).returning(models.Account.id).cte("account")
+
+    stmt = insert(models.Transaction).from_select(
+        transaction_columns(),
+        transaction_values(transaction_id, account.c.id, models.TransactionType.ACCRUAL, amount,
+                           order_id, delivery_id, reason, now)
+    ).returning(models.Transaction)
+    if delivery_id is not None:
+        stmt = stmt.add_cte(
+            insert(models.DeliveryAccrual)
+            .values(delivery_id=delivery_id, transaction_id=transaction_id, created_date=now)
+            .cte("delivery_accrual")
+        )
+    return (await db.scalars(stmt)).one()
+
+
+async def write_off(db, account_id: UUID, amount: Decimal, order_id: UUID,
+                    reason: str) -> models.Transaction | None:
+    """Списание одним запросом; None, если счета нет или на нем недостаточно средств.
+
+    Условие current_balance >= amount проверяется под блокировкой строки, поэтому
+    параллельные списания не могут увести баланс в минус.
+    """
+    now = datetime.utcnow()
+    account = (
+        update(models.Account)
+        .where(models.Account.id == account_id, models.Account.current_balance >= amount)
+        .values(current_balance=models.Account.current_balance - amount, as_of_date=now)
+        .returning(models.Account.id)
+        .cte("account")
+    )
+
+    stmt = insert(models.Transaction).from_select(
+        transaction_columns(),
+        transaction_values(uuid.uuid4(), account.c.id, models.TransactionType.WRITE_OFF, amount,
+                           order_id, None, reason, now)
+    ).returning(models.Transaction)
+    return (await db.scalars(stmt)).one_or_none()
+
+
+async def get_current_balance(db, account_id: UUID) -> Decimal:
+    balance = await db.scalar(
+        select(models.Account.current_balance).where(models.Account.id == account_id)
+    )
+    return balance if balance is not None else money.ZERO
+
+
+async def apply_batch(db, entries: list[dict], stop_on_error: bool) -> dict[int, str]:
+    """Пакетное применение операций; возвращает ошибки по индексам операций.
+
+    Счета пачки блокируются одним SELECT ... FOR UPDATE, порядок операций проигрывается
+    в памяти по заблокированным балансам, затем все транзакции вставляются одной пачкой,
+    а балансы меняются одним upsert на счет. При stop_on_error и любой ошибке ничего не пишется.
+    Применённым записям проставляются id и created_date.
+    """
+    account_ids = sorted({entry["account_id"] for entry in entries})
+    balances = defaultdict(Decimal, (await db.execute(
+        select(models.Account.id, models.Account.current_balance)
+        .where(models.Account.id.in_(account_ids))
+        .order_by(models.Account.id)
+        .with_for_update()
+    )).all())
+
+    delivery_ids = [entry["delivery_id"] for entry in entries if entry["delivery_id"] is not None]
+    seen_deliveries = set()
+    if delivery_ids:
+        seen_deliveries = set(await db.scalars(
+            select(models.DeliveryAccrual.delivery_id).where(models.DeliveryAccrual.delivery_id.in_(delivery_ids))
+        ))
+
+    errors = {}
+    applied = []
+    deltas = defaultdict(Decimal)
+    for entry in entries:
+        account_id, amount, delivery_id = entry["account_id"], entry["amount"], entry["delivery_id"]
+        if delivery_id is not None and delivery_id in seen_deliveries:
+            errors[entry["index"]] = "Accrual for this delivery already exists"
+            continue
+        if entry["type"] == models.TransactionType.WRITE_OFF:
+            if amount > balances[account_id]:
+                errors[entry["index"]] = f"Insufficient funds. Available: {balances[account_id]}, requested: {amount}"
+                continue
+            amount = -amount
+        balances[account_id] += amount
+        deltas[account_id] += amount
+        if delivery_id is not None:
+            seen_deliveries.add(delivery_id)
+        applied.append(entry)
+
+    if not applied or (errors and stop_on_error):
+        return errors
+
+    now = datetime.utcnow()
+    for entry in applied:
+        entry["id"] = uuid.uuid4()
+        entry["created_date"] = now
+
+    await db.execute(insert(models.Transaction.__table__), [
+        {
+            "id": entry["id"],
+            "account_id": entry["account_id"],
+            "type": entry["type"],
+            "amount": entry["amount"],
+            "order_id": entry["order_id"],
+            "delivery_id": entry["delivery_id"],
+            "reason": entry["reason"],
+            "created_date": now,
+        }
+        for entry in applied
+    ])
+
+    accruals = [
+        {"delivery_id": entry["delivery_id"], "transaction_id": entry["id"], "created_date": now}
+        for entry in applied if entry["delivery_id"] is not None
+    ]
+    if accruals:
+        await db.execute(insert(models.DeliveryAccrual.__table__), accruals)
+
+    table = models.Account.__table__
+    upsert = insert(table)
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={
+                "current_balance": table.c.current_balance + upsert.excluded.current_balance,
+                "as_of_date": upsert.excluded.as_of_date,
+            }
+        ),
+        [
+            {"id": account_id, "current_balance": delta, "as_of_date": now}
+            for account_id, delta in sorted(deltas.items())
+        ]
+    )
+    return errors
@@ -1,19 +1,63 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 import asyncio
-from . import models, database
-from .routes import router
-from .rabbitmq import consume_delivery_completed_messages
+from pathlib import Path
+from service_common import logs, metrics, readiness, tracing
+from . import cache, database, rules
+from .routes import router, idempotency_keys
+from .rabbitmq import CONSUMER_IN_APP, DRAIN_TIMEOUT, consume_delivery_completed_messages
+from .reconciler import run_reconciler
+from .partitions import run_partition_maintenance
 
-models.Base.metadata.create_all(bind=database.engine)
+logs.setup("bonus_service")
+tracing.setup("bonus_service")
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
 
 app = FastAPI(title="Bonus Service", version="1.0.0")
 
+app.add_middleware(metrics.PrometheusMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(logs.CorrelationMiddleware)
 app.include_router(router, prefix="/api")
 
+background_tasks = set()
+# Сигнал потребителю очереди в приложении: дообработать полученные сообщения и закрыться, как app.worker
+consumer_stopping = asyncio.Event()
+
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(consume_delivery_completed_messages())
+    # Схема и секции журнала создаются миграциями (alembic upgrade head), старт не ждет базу
+    # Ошибка в файле правил начисления не дает запуститься воркеру
+    rules.load_current()
+    metrics.start_metrics_server(9102)
+    # При отдельном процессе app.worker очередь читает только он, а API не делит с ним event loop
+    if CONSUMER_IN_APP:
+        background_tasks.add(asyncio.create_task(
+            consume_delivery_completed_messages(stopping=consumer_stopping), name="consumer"
+        ))
+    background_tasks.add(asyncio.create_task(run_reconciler()))
+    background_tasks.add(asyncio.create_task(run_partition_maintenance()))
+    background_tasks.add(asyncio.create_task(idempotency_keys.run_purger()))
+    background_tasks.add(asyncio.create_task(rules.run_reloader()))
+    background_tasks.add(asyncio.create_task(cache.run_invalidation_listener()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    consumer_stopping.set()
+    consumers = [task for task in background_tasks if task.get_name() == "consumer"]
+    if consumers:
+        # Потребитель сам ограничивает дообработку CONSUMER_DRAIN_TIMEOUT; запас - на закрытие соединения
+        await asyncio.wait(consumers, timeout=DRAIN_TIMEOUT + 5)
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
 
 @app.get("/")
 def read_root():
-    return {"message": "Bonus Service is running"}
\ No newline at end of file
+    return {"message": "Bonus Service is running"}
+
+@app.get("/ready")
+async def read_ready():
+    ready, details = await readiness.check(database.engine, database.MIGRATIONS_VERSION_TABLE, MIGRATIONS_DIR)
+    return JSONResponse(details, status_code=200 if ready else 503)
\ No newline at end of file
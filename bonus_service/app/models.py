@@ -1,28 +1,84 @@
-from sqlalchemy import Column, String, DateTime, Float, Enum
+from sqlalchemy import Column, String, Integer, LargeBinary, DateTime, Enum, Index
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 import enum
 from .database import Base
+from .money import AMOUNT_TYPE, ZERO
 
 class TransactionType(str, enum.Enum):
     ACCRUAL = "ACCRUAL"
     WRITE_OFF = "WRITE_OFF"
 
 class Transaction(Base):
+    """Журнал операций; таблица секционирована по месяцам created_date (см. partitions.py)"""
     __tablename__ = "transactions"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     account_id = Column(UUID(as_uuid=True), nullable=False)
     type = Column(Enum(TransactionType), nullable=False)
-    amount = Column(Float, nullable=False)
+    amount = Column(AMOUNT_TYPE, nullable=False)
     order_id = Column(UUID(as_uuid=True), nullable=False)
     delivery_id = Column(UUID(as_uuid=True), nullable=True)
     reason = Column(String, nullable=False)
+    # Ключ секционирования обязан входить в первичный ключ секционированной таблицы
+    created_date = Column(DateTime, primary_key=True)
+
+    __table_args__ = (
+        # История счета: keyset-пагинация по (created_date, id) внутри account_id
+        Index("ix_transactions_account_id_created_date_id", "account_id", "created_date", "id"),
+        {"postgresql_partition_by": "RANGE (created_date)"},
+    )
+
+class DeliveryAccrual(Base):
+    """Не более одного начисления на доставку: повторная доставка сообщения не начисляет баллы дважды.
+
+    Уникальность вынесена из transactions: в секционированной таблице уникальный индекс
+    обязан включать created_date и глобально delivery_id уже не ограничивает.
+    """
+    __tablename__ = "delivery_accruals"
+
+    delivery_id = Column(UUID(as_uuid=True), primary_key=True)
+    transaction_id = Column(UUID(as_uuid=True), nullable=False)
     created_date = Column(DateTime, nullable=False)
 
 class Account(Base):
     __tablename__ = "accounts"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    current_balance = Column(Float, default=0.0, nullable=False)
-    as_of_date = Column(DateTime, nullable=False)
\ No newline at end of file
+    current_balance = Column(AMOUNT_TYPE, default=ZERO, nullable=False)
+    as_of_date = Column(DateTime, nullable=False)
+
+class BalanceSnapshot(Base):
+    """Баланс счета по всем транзакциям с created_date не позже high_water_mark"""
+    __tablename__ = "balance_snapshots"
+
+    account_id = Column(UUID(as_uuid=True), primary_key=True)
+    balance = Column(AMOUNT_TYPE, nullable=False)
+    high_water_mark = Column(DateTime, nullable=False)
+    created_date = Column(DateTime, nullable=False)
+
+
+class ArchivedBalance(Base):
+    """Сумма по счету транзакций из выгруженных в архив секций, все они с created_date не позже high_water_mark"""
+    __tablename__ = "archived_balances"
+
+    account_id = Column(UUID(as_uuid=True), primary_key=True)
+    balance = Column(AMOUNT_TYPE, nullable=False)
+    high_water_mark = Column(DateTime, nullable=False)
+
+
+class IdempotencyKey(Base):
+    """Ответ на запрос с заголовком Idempotency-Key, сохраненный вместе с изменением (см. service_common/idempotency.py)"""
+    __tablename__ = "bonus_idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    # Хеш метода, пути и тела: тот же ключ с другим запросом - ошибка клиента, а не повтор
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(LargeBinary, nullable=False)
+    created_date = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_bonus_idempotency_keys_expires_at", "expires_at"),
+    )
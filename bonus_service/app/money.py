@@ -0,0 +1,43 @@
+"""Денежные суммы: фиксированная точка вместо float.
+
+В БД суммы хранятся как NUMERIC(18, 2), в коде - Decimal, округленный до копеек
+по правилу ROUND_HALF_UP. Для векторных расчетов суммы переводятся в целые копейки.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import Numeric
+
+AMOUNT_PRECISION = 18
+AMOUNT_SCALE = 2
+MINOR_UNITS = 10 ** AMOUNT_SCALE
+
+CENT = Decimal(1).scaleb(-AMOUNT_SCALE)
+ZERO = Decimal("0.00")
+# Наименьшая по модулю сумма, которая уже не помещается в NUMERIC(18, 2)
+MAX_AMOUNT = Decimal(10) ** (AMOUNT_PRECISION - AMOUNT_SCALE)
+
+
+AMOUNT_TYPE = Numeric(AMOUNT_PRECISION, AMOUNT_SCALE)
+
+
+def to_amount(value) -> Decimal:
+    """Приведение числа к сумме с копейками; float переводится через str, чтобы не тащить двоичный хвост.
+
+    ValueError, если сумма не помещается в столбец: иначе ошибка всплыла бы только при записи в БД.
+    """
+    if isinstance(value, float):
+        value = str(value)
+    try:
+        amount = Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+    except ArithmeticError:
+        raise ValueError(f"Amount out of range: {value}")
+    if abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f"Amount out of range: {value}")
+    return amount
+
+
+def to_minor_units(value: Decimal) -> int:
+    return int(value * MINOR_UNITS)
+
+
+def from_minor_units(value: int) -> Decimal:
+    return Decimal(int(value)).scaleb(-AMOUNT_SCALE)
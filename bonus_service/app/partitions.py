@@ -0,0 +1,377 @@
+"""Секционирование журнала transactions по месяцам created_date и архивирование старых секций.
+
+Секции создаются заранее на TRANSACTIONS_PARTITIONS_AHEAD месяцев вперед: миграцией, при старте
+app.worker и обслуживанием в процессах API. Строки месяца без секции попадают в секцию DEFAULT, а не
+падают с ошибкой; обслуживание создает для них секцию и переносит их туда. Конец последней секции
+и число таких строк видны в метриках ledger_partitions_end_timestamp_seconds и
+ledger_default_partition_rows.
+
+Секции старше TRANSACTIONS_RETENTION_MONTHS отсоединяются от журнала, выгружаются в Parquet (zstd)
+в TRANSACTIONS_ARCHIVE_DIR и удаляются, а их суммы по счетам переносятся в archived_balances,
+чтобы сверка балансов не зависела от архива.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sqlalchemy import MetaData, select, func, text, literal
+from sqlalchemy.dialects.postgresql import insert
+from service_common import metrics
+from . import models, database, ledger, money
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS_AHEAD = int(os.getenv("TRANSACTIONS_PARTITIONS_AHEAD", "3"))
+# 0 - архивирование выключено
+RETENTION_MONTHS = int(os.getenv("TRANSACTIONS_RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = Path(os.getenv("TRANSACTIONS_ARCHIVE_DIR", "/var/lib/bonus/archive"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("TRANSACTIONS_ARCHIVE_CHUNK_SIZE", "100000"))
+MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+# Отсоединение ждет блокировку журнала не дольше этого, чтобы не копить за собой очередь вставок
+DETACH_LOCK_TIMEOUT = os.getenv("PARTITION_DETACH_LOCK_TIMEOUT", "5s")
+
+MAINTENANCE_LOCK = "partition_maintenance"
+PARENT_TABLE = models.Transaction.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_p(\d{{4}})(\d{{2}})$")
+# Суммы вне журнала, которые create_all ранних версий создавал double precision
+AMOUNT_COLUMNS = [
+    (models.Account.__tablename__, "current_balance"),
+    (models.BalanceSnapshot.__tablename__, "balance"),
+    (models.ArchivedBalance.__tablename__, "balance"),
+]
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> datetime | None:
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match[1]), int(match[2]), 1) if match else None
+
+
+def partition_table(name: str):
+    """Отдельная секция как таблица с колонками и типами журнала"""
+    return models.Transaction.__table__.to_metadata(MetaData(), name=name)
+
+
+async def is_partitioned(conn) -> bool:
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"
+    ), {"name": PARENT_TABLE}))
+
+
+async def attached_partitions(conn) -> list[str]:
+    names = await conn.scalars(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:name) ORDER BY child.relname"
+    ), {"name": PARENT_TABLE})
+    return [name for name in names if partition_month(name)]
+
+
+async def detached_partitions(conn) -> list[str]:
+    """Отсоединенные, но еще не выгруженные секции - остаток прерванного архивирования"""
+    names = await conn.scalars(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE :pattern "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = pg_class.oid) ORDER BY relname"
+    ), {"pattern": f"{PARENT_TABLE}\\_p%"})
+    return [name for name in names if partition_month(name)]
+
+
+async def has_default_partition(conn) -> bool:
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name) AND partdefid <> 0)"
+    ), {"name": PARENT_TABLE}))
+
+
+async def default_partition_months(conn) -> list[datetime]:
+    """Месяцы строк, попавших в DEFAULT: для них не было секции на момент вставки"""
+    return list(await conn.scalars(text(
+        f"SELECT DISTINCT date_trunc('month', created_date) FROM \"{DEFAULT_PARTITION}\""
+    )))
+
+
+async def create_partition(conn, month: datetime) -> int:
+    """Секция месяца; строки месяца из DEFAULT переносятся в нее, возвращается их число"""
+    name = partition_name(month)
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    if not await has_default_partition(conn):
+        await conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" {bounds}'))
+        return 0
+    # Вставки в DEFAULT ждут конца транзакции, иначе строка месяца появилась бы там снова до ATTACH.
+    # ATTACH, в отличие от CREATE TABLE ... PARTITION OF, не блокирует вставки в другие секции
+    await conn.execute(text(f'LOCK TABLE "{DEFAULT_PARTITION}" IN ACCESS EXCLUSIVE MODE'))
+    await conn.execute(text(f'CREATE TABLE "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    moved = (await conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE created_date >= :start AND created_date < :end '
+        f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'
+    ), {"start": month, "end": add_months(month, 1)})).rowcount
+    await conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{name}" {bounds}'))
+    return moved
+
+
+async def ensure_partitions(conn, now: datetime | None = None) -> int:
+    """Секции с текущего месяца на PARTITIONS_AHEAD вперед и для строк из DEFAULT; возвращает число созданных"""
+    current = month_start(now or datetime.utcnow())
+    existing = set(await attached_partitions(conn))
+    months = [add_months(current, offset) for offset in range(PARTITIONS_AHEAD + 1)]
+    if await has_default_partition(conn):
+        months += await default_partition_months(conn)
+    created = moved = 0
+    for month in sorted(set(months)):
+        if partition_name(month) not in existing:
+            rows = await create_partition(conn, month)
+            if rows:
+                logger.warning("Moved %d rows from %s to new partition %s", rows, DEFAULT_PARTITION, partition_name(month))
+            moved += rows
+            created += 1
+    metrics.LEDGER_DEFAULT_PARTITION_ROWS.set(moved)
+    # Запас считается по секциям подряд от текущего месяца: дальняя секция из DEFAULT не закрывает пропуск
+    attached = set(await attached_partitions(conn))
+    end = current
+    while partition_name(end) in attached:
+        end = add_months(end, 1)
+    metrics.LEDGER_PARTITIONS_END.set(end.replace(tzinfo=timezone.utc).timestamp())
+    return created
+
+
+async def detach_partition(name: str):
+    """Перенос сумм секции в archived_balances и отсоединение секции в одной транзакции"""
+    partition = partition_table(name)
+    high_water_mark = add_months(partition_month(name), 1) - timedelta(microseconds=1)
+
+    async with database.engine.begin() as conn:
+        await conn.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+        archived = insert(models.ArchivedBalance).from_select(
+            ["account_id", "balance", "high_water_mark"],
+            select(
+                partition.c.account_id,
+                func.sum(ledger.signed_amount(partition)),
+                literal(high_water_mark, models.ArchivedBalance.high_water_mark.type),
+            ).group_by(partition.c.account_id)
+        )
+        await conn.execute(archived.on_conflict_do_update(
+            index_elements=[models.ArchivedBalance.account_id],
+            set_={
+                "balance": models.ArchivedBalance.balance + archived.excluded.balance,
+                "high_water_mark": func.greatest(
+                    models.ArchivedBalance.high_water_mark, archived.excluded.high_water_mark
+                ),
+            }
+        ))
+        await conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"'))
+
+
+def archive_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.binary(16)),
+        ("account_id", pa.binary(16)),
+        ("type", pa.dictionary(pa.int8(), pa.string())),
+        ("amount", pa.decimal128(18, 2)),
+        ("order_id", pa.binary(16)),
+        ("delivery_id", pa.binary(16)),
+        ("reason", pa.string()),
+        ("created_date", pa.timestamp("us")),
+    ])
+
+
+def archive_batch(schema, rows):
+    import pyarrow as pa
+
+    return pa.RecordBatch.from_pydict({
+        "id": [row.id.bytes for row in rows],
+        "account_id": [row.account_id.bytes for row in rows],
+        "type": [row.type.value for row in rows],
+        "amount": [row.amount for row in rows],
+        "order_id": [row.order_id.bytes for row in rows],
+        "delivery_id": [row.delivery_id.bytes if row.delivery_id else None for row in rows],
+        "reason": [row.reason for row in rows],
+        "created_date": [row.created_date for row in rows],
+    }, schema=schema)
+
+
+async def export_partition(name: str) -> Path:
+    """Выгрузка отсоединенной секции в Parquet; файл появляется под итоговым именем только целиком"""
+    import pyarrow.parquet as pq
+
+    partition = partition_table(name)
+    schema = archive_schema()
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    target = ARCHIVE_DIR / f"{name}.parquet"
+    temporary = target.with_suffix(".parquet.tmp")
+
+    written = 0
+    writer = pq.ParquetWriter(temporary, schema, compression="zstd")
+    try:
+        async with database.engine.connect() as conn:
+            result = await conn.stream(
+                select(partition).execution_options(yield_per=ARCHIVE_CHUNK_SIZE)
+            )
+            async for rows in result.partitions():
+                batch = archive_batch(schema, rows)
+                await asyncio.to_thread(writer.write_batch, batch)
+                written += len(rows)
+            expected = await conn.scalar(select(func.count()).select_from(partition))
+    finally:
+        await asyncio.to_thread(writer.close)
+
+    if written != expected:
+        temporary.unlink()
+        raise RuntimeError(f"Archive of {name} has {written} rows, table has {expected}")
+    os.replace(temporary, target)
+    return target
+
+
+async def archive_partition(name: str) -> Path:
+    """Отсоединение (если еще не сделано), выгрузка и удаление секции"""
+    async with database.engine.connect() as conn:
+        attached = name in await attached_partitions(conn)
+    if attached:
+        await detach_partition(name)
+    path = await export_partition(name)
+    async with database.engine.begin() as conn:
+        await conn.execute(text(f'DROP TABLE "{name}"'))
+    return path
+
+
+async def expired_partitions(now: datetime | None = None) -> list[str]:
+    """Секции целиком старше срока хранения и недовыгруженные секции прошлых запусков"""
+    if RETENTION_MONTHS <= 0:
+        return []
+    boundary = add_months(month_start(now or datetime.utcnow()), -RETENTION_MONTHS)
+    async with database.engine.connect() as conn:
+        attached = await attached_partitions(conn)
+        detached = await detached_partitions(conn)
+    return detached + [name for name in attached if add_months(partition_month(name), 1) <= boundary]
+
+
+async def prepare_partitions() -> bool:
+    """Создание недостающих секций наперед; False, если журнал еще не секционирован"""
+    async with database.engine.begin() as conn:
+        if not await is_partitioned(conn):
+            logger.warning("Table %s is not partitioned, run: python -m app.partitions convert", PARENT_TABLE)
+            return False
+        created = await ensure_partitions(conn)
+    if created:
+        logger.info("Created %d %s partitions ahead", created, PARENT_TABLE)
+    return True
+
+
+async def maintain_partitions():
+    if not await prepare_partitions():
+        return
+    for name in await expired_partitions():
+        path = await archive_partition(name)
+        logger.info("Archived partition %s to %s", name, path)
+
+
+async def run_locked(job):
+    """DDL секций выполняет один процесс из всех, иначе они создают и архивируют одно и то же"""
+    try:
+        async with database.advisory_lock(MAINTENANCE_LOCK) as acquired:
+            if acquired:
+                await job()
+    except Exception as e:
+        logger.error("Partition maintenance error: %s", e)
+
+
+async def run_partition_maintenance():
+    # Сервис мог простаивать дольше запаса секций, созданных миграцией, - досоздаем их сразу
+    job = prepare_partitions
+    while True:
+        await run_locked(job)
+        job = maintain_partitions
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+async def convert_amount_columns(conn) -> list[str]:
+    """Перевод сумм счетов и снимков в NUMERIC(18, 2) с округлением до копеек; возвращает измененные столбцы"""
+    converted = []
+    for table, column in AMOUNT_COLUMNS:
+        data_type = await conn.scalar(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+        ), {"table": table, "column": column})
+        if data_type is None or data_type == "numeric":
+            continue
+        await conn.execute(text(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" '
+            f"TYPE NUMERIC({money.AMOUNT_PRECISION}, {money.AMOUNT_SCALE}) "
+            f'USING round("{column}"::numeric, {money.AMOUNT_SCALE})'
+        ))
+        converted.append(f"{table}.{column}")
+    return converted
+
+
+async def convert_to_partitioned():
+    """Однократный перевод базы из create_all на схему миграции 0001_initial в одной транзакции.
+
+    Суммы счетов и снимков переводятся в NUMERIC(18, 2), журнал - в секционированный (его суммы
+    становятся NUMERIC при копировании). Повторный запуск доводит только то, что еще не переведено.
+    Требует окна обслуживания: таблицы переписываются целиком, записи в них на это время блокируются.
+    """
+    legacy = f"{PARENT_TABLE}_unpartitioned"
+    async with database.engine.begin() as conn:
+        for column in await convert_amount_columns(conn):
+            logger.info("Column %s converted to NUMERIC(%d, %d)", column, money.AMOUNT_PRECISION, money.AMOUNT_SCALE)
+        if await is_partitioned(conn):
+            logger.info("Table %s is already partitioned", PARENT_TABLE)
+            return
+
+        await conn.execute(text(f'LOCK TABLE "{PARENT_TABLE}" IN EXCLUSIVE MODE'))
+        await conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" RENAME TO "{legacy}"'))
+        await conn.execute(text(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{PARENT_TABLE}_pkey" TO "{legacy}_pkey"'))
+        for index in models.Transaction.__table__.indexes:
+            await conn.execute(text(f'ALTER INDEX IF EXISTS "{index.name}" RENAME TO "{legacy}_{index.name}"'))
+        await conn.execute(text(f'ALTER INDEX IF EXISTS "uq_transactions_delivery_id" RENAME TO "{legacy}_uq_delivery_id"'))
+
+        # Только таблицы схемы 0001_initial: остальные создадут миграции после alembic stamp
+        await conn.run_sync(models.Base.metadata.create_all, tables=[
+            model.__table__ for model in (
+                models.Transaction, models.DeliveryAccrual, models.Account, models.BalanceSnapshot, models.ArchivedBalance
+            )
+        ])
+        first, last = (await conn.execute(text(
+            f'SELECT min(created_date), max(created_date) FROM "{legacy}"'
+        ))).one()
+        month = month_start(first or datetime.utcnow())
+        while last is not None and month <= last:
+            await create_partition(conn, month)
+            month = add_months(month, 1)
+        await ensure_partitions(conn)
+
+        columns = ", ".join(column.name for column in models.Transaction.__table__.columns)
+        await conn.execute(text(f'INSERT INTO "{PARENT_TABLE}" ({columns}) SELECT {columns} FROM "{legacy}"'))
+        await conn.execute(text(
+            f"INSERT INTO delivery_accruals (delivery_id, transaction_id, created_date) "
+            f'SELECT delivery_id, id, created_date FROM "{legacy}" WHERE delivery_id IS NOT NULL '
+            f"ON CONFLICT (delivery_id) DO NOTHING"
+        ))
+        await conn.execute(text(f'DROP TABLE "{legacy}"'))
+    logger.info("Table %s converted to monthly partitions", PARENT_TABLE)
+
+
+if __name__ == "__main__":
+    import argparse
+    from service_common import logs
+
+    logs.setup("bonus_service")
+    parser = argparse.ArgumentParser(description="Обслуживание секций журнала транзакций")
+    parser.add_argument("command", choices=["maintain", "convert"])
+    args = parser.parse_args()
+    asyncio.run(convert_to_partitioned() if args.command == "convert" else maintain_partitions())
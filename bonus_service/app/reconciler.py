@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from uuid import UUID
+from sqlalchemy import select, func, case, true
+from sqlalchemy.dialects.postgresql import insert
+from service_common import metrics
+from . import models, database, ledger, money
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "500"))
+RECONCILE_BATCH_INTERVAL = float(os.getenv("RECONCILE_BATCH_INTERVAL", "0.1"))
+RECONCILE_PASS_INTERVAL = float(os.getenv("RECONCILE_PASS_INTERVAL", "60"))
+# Транзакции моложе этого порога в снимок не попадают: created_date проставляется до коммита,
+# и незакоммиченная запись с меньшей датой иначе оказалась бы ниже high_water_mark
+SNAPSHOT_SAFETY_LAG = timedelta(seconds=float(os.getenv("SNAPSHOT_SAFETY_LAG", "60")))
+
+LEDGER_START = datetime(1970, 1, 1)
+# Проход сверки выполняет один воркер из всех, остальные его пропускают
+RECONCILER_LOCK = "ledger_reconciler"
+
+
+def replay_query(after_id: UUID | None, limit: int, cutoff: datetime):
+    """Пачка счетов по id с балансом из снимка и только более новых транзакций.
+
+    Для каждого счета считаются полный баланс по журналу и баланс на cutoff для следующего снимка.
+    Все читается одним запросом, то есть из одного MVCC-снимка, без блокировок таблиц.
+    """
+    account, snapshot, archived, transaction = (
+        models.Account, models.BalanceSnapshot, models.ArchivedBalance, models.Transaction
+    )
+    accounts = select(account.id, account.current_balance).order_by(account.id).limit(limit)
+    if after_id is not None:
+        accounts = accounts.where(account.id > after_id)
+    accounts = accounts.subquery("batch")
+
+    # Снимок старше границы архива уже не продолжить по журналу - тогда база берется из archived_balances
+    archived_high_water_mark = func.coalesce(archived.high_water_mark, LEDGER_START)
+    snapshot_usable = func.coalesce(snapshot.high_water_mark >= archived_high_water_mark, False)
+    base = case((snapshot_usable, snapshot.balance), else_=func.coalesce(archived.balance, 0))
+    high_water_mark = case((snapshot_usable, snapshot.high_water_mark), else_=archived_high_water_mark)
+
+    delta = (
+        select(
+            func.coalesce(func.sum(ledger.signed_amount()), 0).label("total"),
+            func.coalesce(
+                func.sum(ledger.signed_amount()).filter(transaction.created_date <= cutoff), 0
+            ).label("until_cutoff"),
+            func.count().filter(transaction.created_date <= cutoff).label("new_transactions"),
+        )
+        .where(transaction.account_id == accounts.c.id, transaction.created_date > high_water_mark)
+        .lateral("delta")
+    )
+
+    return (
+        select(
+            accounts.c.id,
+            accounts.c.current_balance,
+            (base + delta.c.total).label("ledger_balance"),
+            (base + delta.c.until_cutoff).label("snapshot_balance"),
+            (~snapshot_usable | (delta.c.new_transactions > 0)).label("snapshot_stale"),
+        )
+        .select_from(accounts)
+        .outerjoin(snapshot, snapshot.account_id == accounts.c.id)
+        .outerjoin(archived, archived.account_id == accounts.c.id)
+        .join(delta, true())
+        .order_by(accounts.c.id)
+    )
+
+
+async def reconcile_batch(after_id: UUID | None) -> tuple[UUID | None, int, int]:
+    """Сверка одной пачки счетов и продвижение их снимков; возвращает (последний id, проверено, расхождений)"""
+    now = datetime.utcnow()
+    cutoff = now - SNAPSHOT_SAFETY_LAG
+
+    async with database.SessionLocal() as db, db.begin():
+        rows = (await db.execute(replay_query(after_id, RECONCILE_BATCH_SIZE, cutoff))).all()
+        if not rows:
+            return None, 0, 0
+
+        drifted = 0
+        for row in rows:
+            if row.current_balance != row.ledger_balance:
+                drifted += 1
+                logger.warning(
+                    "Balance drift for account %s: stored %s, ledger %s", row.id, row.current_balance, row.ledger_balance
+                )
+
+        stale = [row for row in rows if row.snapshot_stale]
+        if stale:
+            stmt = insert(models.BalanceSnapshot)
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[models.BalanceSnapshot.account_id],
+                    set_={
+                        "balance": stmt.excluded.balance,
+                        "high_water_mark": stmt.excluded.high_water_mark,
+                        "created_date": stmt.excluded.created_date,
+                    }
+                ),
+                [
+                    {"account_id": row.id, "balance": row.snapshot_balance,
+                     "high_water_mark": cutoff, "created_date": now}
+                    for row in stale
+                ]
+            )
+
+    metrics.RECONCILED_ACCOUNTS.inc(len(rows))
+    metrics.LEDGER_DRIFT_DETECTED.inc(drifted)
+    return rows[-1].id, len(rows), drifted
+
+
+async def reconcile_all() -> tuple[int, int]:
+    """Полный проход по счетам короткими транзакциями; возвращает (проверено, расхождений)"""
+    after_id, checked, drifted = None, 0, 0
+    while True:
+        after_id, batch_checked, batch_drifted = await reconcile_batch(after_id)
+        checked += batch_checked
+        drifted += batch_drifted
+        if batch_checked < RECONCILE_BATCH_SIZE:
+            return checked, drifted
+        await asyncio.sleep(RECONCILE_BATCH_INTERVAL)
+
+
+async def audit_all() -> tuple[int, int]:
+    """Полная сверка всех счетов одним векторным проходом по журналу и архивным суммам, без снимков.
+
+    Журнал и счета читаются в одной транзакции REPEATABLE READ, то есть из одного MVCC-снимка.
+    """
+    # numpy нужен только полной сверке и не должен удлинять импорт приложения
+    from . import aggregation
+
+    async with database.SessionLocal() as db:
+        await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        ledger_balances = aggregation.merge_balances(
+            await aggregation.ledger_balances(db), await aggregation.archived_balances(db)
+        )
+        stored_balances = await aggregation.stored_balances(db)
+        await db.commit()
+
+    account_ids, stored, replayed = aggregation.compare_balances(stored_balances, ledger_balances)
+    for account_id, stored_amount, ledger_amount in zip(account_ids, stored, replayed):
+        logger.warning(
+            "Balance drift for account %s: stored %s, ledger %s", aggregation.to_uuid(account_id),
+            money.from_minor_units(stored_amount), money.from_minor_units(ledger_amount)
+        )
+
+    checked = len(stored_balances[0])
+    metrics.RECONCILED_ACCOUNTS.inc(checked)
+    metrics.LEDGER_DRIFT_DETECTED.inc(len(account_ids))
+    return checked, len(account_ids)
+
+
+async def run_reconciler():
+    while True:
+        try:
+            async with database.advisory_lock(RECONCILER_LOCK) as acquired:
+                if acquired:
+                    checked, drifted = await reconcile_all()
+                    metrics.LEDGER_DRIFT_ACCOUNTS.set(drifted)
+                    logger.info("Reconciled %d accounts, %d with drift", checked, drifted)
+        except Exception as e:
+            logger.error("Reconciler error: %s", e)
+        await asyncio.sleep(RECONCILE_PASS_INTERVAL)
+
+
+if __name__ == "__main__":
+    import argparse
+    from service_common import logs
+
+    logs.setup("bonus_service")
+    parser = argparse.ArgumentParser(description="Сверка балансов счетов с журналом транзакций")
+    parser.add_argument("--full", action="store_true", help="полный векторный пересчет журнала вместо снимков")
+    args = parser.parse_args()
+
+    checked, drifted = asyncio.run(audit_all() if args.full else reconcile_all())
+    print(f"Checked {checked} accounts, {drifted} with drift")
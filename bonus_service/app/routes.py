@@ -1,184 +1,313 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 from datetime import datetime
+from decimal import Decimal
 import asyncio
+import logging
 
-from . import models, schemas, database
+from service_common import singleflight, idempotency
+from . import models, schemas, database, ledger, cache, pagination, money, rules
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
+# Ответы на запросы с Idempotency-Key; очистку просроченных ключей запускает main
+idempotency_keys = idempotency.IdempotencyKeys(models.IdempotencyKey, database.SessionLocal, cache.LocalTTLCache)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def validate_accrual_amount(amount: Decimal):
+    """Валидация суммы для начисления"""
+    if amount <= 0:
+        raise ValueError("Amount for accrual must be positive")
+    if amount > 10000:
+        raise ValueError("Amount too large for single accrual")
+    return amount
+
+def accrual_reason(reason: str, base_amount: Decimal, final_amount: Decimal) -> str:
+    return f"{reason} (с бонусом)" if final_amount > base_amount else reason
+
+def validate_write_off_amount(amount: Decimal):
+    """Валидация суммы для списания, достаточность средств проверяется в самом UPDATE"""
+    if amount <= 0:
+        raise ValueError("Amount for write-off must be positive")
+    return amount
 
 @router.post("/accounts/{account_id}/accrue", response_model=schemas.TransactionResponse)
-def accrue_points(
+async def accrue_points(
         account_id: UUID,
         accrue_request: schemas.AccruePointsRequest,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(database.get_db),
+        idempotent: idempotency.IdempotentRequest = Depends(idempotency_keys.request)
 ):
-    """Начислить баллы на счет"""
-
-    def validate_accrual_amount(amount: float):
-        """Валидация суммы для начисления"""
-        if amount <= 0:
-            raise ValueError("Amount for accrual must be positive")
-        if amount > 10000:
-            raise ValueError("Amount too large for single accrual")
-        return amount
-
-    def calculate_bonus_multiplier(amount: float) -> float:
-        """Расчет бонусного множителя"""
-        if amount > 1000:
-            return 1.1
-        elif amount > 500:
-            return 1.05
-        else:
-            return 1.0
-
-    def apply_bonus(base_amount: float) -> float:
-        """Применение бонуса к сумме"""
-        multiplier = calculate_bonus_multiplier(base_amount)
-        return base_amount * multiplier
-
-    def create_accrual_transaction(final_amount: float):
-        """Создание транзакции начисления"""
-        transaction = models.Transaction(
-            account_id=account_id,
-            type="ACCRUAL",
-            amount=final_amount,
-            order_id=accrue_request.order_id,
-            delivery_id=accrue_request.delivery_id,
-            reason=f"{accrue_request.reason} (с бонусом)" if final_amount > accrue_request.amount else accrue_request.reason,
-            created_date=datetime.utcnow()
-        )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
-
+    """Начислить баллы на счет; повтор с тем же Idempotency-Key получает сохраненный ответ"""
+    replayed = await idempotent.replay(db)
+    if replayed is not None:
+        return replayed
     try:
         validated_amount = validate_accrual_amount(accrue_request.amount)
-        final_amount = apply_bonus(validated_amount)
-
-        account = db.query(models.Account).filter(models.Account.id == account_id).first()
-        if not account:
-            account = models.Account(
-                id=account_id,
-                current_balance=final_amount,
-                as_of_date=datetime.utcnow()
-            )
-            db.add(account)
-        else:
-            account.current_balance += final_amount
-            account.as_of_date = datetime.utcnow()
-
-        db.commit()
+        final_amount = rules.current().apply(validated_amount)
+        reason = accrual_reason(accrue_request.reason, validated_amount, final_amount)
 
-        transaction = create_accrual_transaction(final_amount)
+        transaction = await ledger.accrue(
+            db, account_id, final_amount, accrue_request.order_id, accrue_request.delivery_id, reason
+        )
+        await idempotent.save(db, schemas.TransactionResponse.model_validate(transaction))
+        await db.commit()
+        idempotent.committed()
+        await cache.balance_cache.invalidate([account_id])
 
         return transaction
 
+    except idempotency.KeyConflict:
+        await db.rollback()
+        return await idempotent.replay(db)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Accrual for this delivery already exists")
     except ValueError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+# as_of_date счета, которого еще нет: нулевой баланс не менялся никогда
+MISSING_ACCOUNT_AS_OF = datetime(1970, 1, 1)
+
+
+async def load_balance(account_id: UUID) -> singleflight.Representation:
+    """Баланс из БД в своей сессии: загрузку разделяют все одновременные запросы счета"""
+    async with database.SessionLocal() as db:
+        account = (await db.execute(
+            select(models.Account).where(models.Account.id == account_id)
+        )).scalars().first()
+
+    # Отсутствующий счет отдаем с нулевым балансом без записи в БД: он появится при первом начислении.
+    # Время у такого ответа постоянное, иначе ETag менялся бы с каждой загрузкой, и опрос пустого
+    # счета никогда не получал бы 304
+    return singleflight.from_model(schemas.BalanceResponse(
+        id=account_id,
+        current_balance=account.current_balance if account else money.ZERO,
+        as_of_date=account.as_of_date if account else MISSING_ACCOUNT_AS_OF
+    ))
+
+
 @router.get("/accounts/{account_id}/balance", response_model=schemas.BalanceResponse)
-def get_balance(account_id: UUID, db: Session = Depends(get_db)):
-    """Получить текущий баланс счета"""
+async def get_balance(account_id: UUID, request: Request):
+    """Получить текущий баланс счета; с If-None-Match неизменившийся баланс отдается как 304"""
     try:
-        account = db.query(models.Account).filter(models.Account.id == account_id).first()
-
-        if not account:
-            account = models.Account(
-                id=account_id,
-                current_balance=0.0,
-                as_of_date=datetime.utcnow()
-            )
-            db.add(account)
-            db.commit()
-            db.refresh(account)
-            print(f"Created new account with zero balance: {account_id}")
-
-        return {
-            "id": account.id,
-            "current_balance": account.current_balance,
-            "as_of_date": account.as_of_date
-        }
+        balance, generation = await cache.balance_cache.get(account_id)
+        if balance is None:
+            balance = await cache.balance_flights.do(account_id, lambda: load_balance(account_id))
+            await cache.balance_cache.set(account_id, balance, generation)
+        return singleflight.respond(request, balance)
 
     except Exception as e:
-        print(f"Error in get_balance for account {account_id}: {str(e)}")
-        db.rollback()
+        logger.exception("Error in get_balance for account %s", account_id)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+def build_transactions_query(
+        account_id: UUID,
+        type: schemas.TransactionType | None,
+        created_from: datetime | None,
+        created_to: datetime | None,
+        cursor: str | None
+):
+    """Запрос истории счета, упорядоченный по (created_date, id) от новых к старым"""
+    stmt = select(models.Transaction).where(models.Transaction.account_id == account_id)
+    if type is not None:
+        stmt = stmt.where(models.Transaction.type == type.value)
+    if created_from is not None:
+        stmt = stmt.where(models.Transaction.created_date >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(models.Transaction.created_date < created_to)
+    if cursor:
+        try:
+            created_date, last_id = pagination.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(
+            tuple_(models.Transaction.created_date, models.Transaction.id) < tuple_(created_date, last_id),
+            # Следует из условия выше, но в отличие от него позволяет отбросить более новые секции журнала
+            models.Transaction.created_date <= created_date
+        )
+    return stmt.order_by(models.Transaction.created_date.desc(), models.Transaction.id.desc())
+
+
+async def stream_transactions(stmt):
+    """Выгрузка транзакций в NDJSON порциями из серверного курсора"""
+    async with database.SessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=pagination.STREAM_CHUNK_SIZE))
+        async for transaction in result.scalars():
+            yield schemas.TransactionResponse.model_validate(transaction).model_dump_json() + "\n"
+
+
+@router.get("/accounts/{account_id}/transactions", response_model=schemas.TransactionPage)
+async def get_transactions(
+        account_id: UUID,
+        type: schemas.TransactionType | None = None,
+        created_from: datetime | None = None,
+        created_to: datetime | None = None,
+        cursor: str | None = None,
+        limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+        stream: bool = False,
+        db: AsyncSession = Depends(database.get_db)
+):
+    """Получить историю операций по счету"""
+    stmt = build_transactions_query(account_id, type, created_from, created_to, cursor)
+
+    if stream:
+        return StreamingResponse(stream_transactions(stmt), media_type="application/x-ndjson")
+
+    try:
+        transactions = (await db.execute(stmt.limit(limit + 1))).scalars().all()
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            last = transactions[-1]
+            next_cursor = pagination.encode_cursor(last.created_date, last.id)
+        return {"items": transactions, "next_cursor": next_cursor}
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
 @router.post("/accounts/{account_id}/write-off", response_model=schemas.TransactionResponse)
-def write_off_points(
+async def write_off_points(
         account_id: UUID,
         write_off_request: schemas.WriteOffPointsRequest,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(database.get_db),
+        idempotent: idempotency.IdempotentRequest = Depends(idempotency_keys.request)
 ):
-    """Списать баллы со счета"""
-
-    def validate_write_off_amount(amount: float, current_balance: float):
-        """Валидация суммы для списания"""
-        if amount <= 0:
-            raise ValueError("Amount for write-off must be positive")
-        if amount > current_balance:
-            raise ValueError(f"Insufficient funds. Available: {current_balance}, requested: {amount}")
-        return amount
-
-    def create_write_off_transaction():
-        """Создание транзакции списания"""
-        transaction = models.Transaction(
-            account_id=account_id,
-            type="WRITE_OFF",
-            amount=write_off_request.amount,
-            order_id=write_off_request.order_id,
-            reason=write_off_request.reason,
-            created_date=datetime.utcnow()
+    """Списать баллы со счета; повтор с тем же Idempotency-Key получает сохраненный ответ"""
+    replayed = await idempotent.replay(db)
+    if replayed is not None:
+        return replayed
+    try:
+        validated_amount = validate_write_off_amount(write_off_request.amount)
+
+        transaction = await ledger.write_off(
+            db, account_id, validated_amount, write_off_request.order_id, write_off_request.reason
         )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
+        if transaction is None:
+            # Списание не прошло условие по балансу - дочитываем баланс только ради текста ошибки
+            current_balance = await ledger.get_current_balance(db, account_id)
+            raise ValueError(f"Insufficient funds. Available: {current_balance}, requested: {validated_amount}")
 
-    try:
-        account = db.query(models.Account).filter(models.Account.id == account_id).first()
-        if not account:
-            # Создаем счет с нулевым балансом вместо ошибки
-            account = models.Account(
-                id=account_id,
-                current_balance=0.0,
-                as_of_date=datetime.utcnow()
-            )
-            db.add(account)
-            db.commit()
-            db.refresh(account)
-            print(f"Created new account with zero balance: {account_id}")
-
-        # Теперь проверяем достаточно ли средств
-        validated_amount = validate_write_off_amount(write_off_request.amount, account.current_balance)
-
-        account.current_balance -= validated_amount
-        account.as_of_date = datetime.utcnow()
-        db.commit()
-
-        transaction = create_write_off_transaction()
+        await idempotent.save(db, schemas.TransactionResponse.model_validate(transaction))
+        await db.commit()
+        idempotent.committed()
+        await cache.balance_cache.invalidate([account_id])
 
         return transaction
 
+    except idempotency.KeyConflict:
+        await db.rollback()
+        return await idempotent.replay(db)
     except ValueError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@router.post("/transactions:batch", response_model=schemas.TransactionBatchResponse)
+async def apply_transactions_batch(
+        batch: schemas.TransactionBatchRequest,
+        response: Response,
+        db: AsyncSession = Depends(database.get_db)
+):
+    """Пакетно начислить и списать баллы по нескольким счетам"""
+    atomic = batch.mode == schemas.BatchMode.ATOMIC
+    valid = []
+    errors = {}
+
+    for index, operation in enumerate(batch.operations):
+        try:
+            if operation.type == schemas.TransactionType.ACCRUAL:
+                validate_accrual_amount(operation.amount)
+            else:
+                validate_write_off_amount(operation.amount)
+        except ValueError as e:
+            errors[index] = str(e)
+            continue
+        valid.append((index, operation))
+
+    # Бонусы ко всем начислениям пачки - одним векторным вызовом
+    final_amounts = iter(rules.current().apply_many([
+        operation.amount for _, operation in valid if operation.type == schemas.TransactionType.ACCRUAL
+    ]))
+    entries = []
+    for index, operation in valid:
+        if operation.type == schemas.TransactionType.ACCRUAL:
+            final_amount = next(final_amounts)
+            reason = accrual_reason(operation.reason, operation.amount, final_amount)
+        else:
+            final_amount = operation.amount
+            reason = operation.reason
+
+        entries.append({
+            "index": index,
+            "account_id": operation.account_id,
+            "type": models.TransactionType(operation.type.value),
+            "amount": final_amount,
+            "order_id": operation.order_id,
+            "delivery_id": operation.delivery_id,
+            "reason": reason,
+        })
+
+    applied = []
+    if entries and not (atomic and errors):
+        # Повтор нужен, только если параллельный запрос успел вставить ту же доставку после нашей проверки
+        for attempt in range(2):
+            try:
+                errors.update(await ledger.apply_batch(db, entries, stop_on_error=atomic))
+                if atomic and errors:
+                    await db.rollback()
+                    break
+                await db.commit()
+                applied = [entry for entry in entries if entry["index"] not in errors]
+                break
+            except IntegrityError:
+                await db.rollback()
+                if atomic or attempt:
+                    raise HTTPException(status_code=409, detail="Accrual for this delivery already exists")
+            except Exception as e:
+                await db.rollback()
+                raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    if applied:
+        await cache.balance_cache.invalidate({entry["account_id"] for entry in applied})
+
+    applied_by_index = {entry["index"]: entry for entry in applied}
+    results = []
+    for index in range(len(batch.operations)):
+        entry = applied_by_index.get(index)
+        if entry is not None:
+            results.append(schemas.BatchOperationResult(
+                index=index,
+                success=True,
+                transaction=schemas.TransactionResponse(
+                    **{key: value for key, value in entry.items() if key != "index"}
+                )
+            ))
+        else:
+            results.append(schemas.BatchOperationResult(
+                index=index,
+                success=False,
+                error=errors.get(index, "Not applied: batch rolled back")
+            ))
+
+    if atomic and errors:
+        response.status_code = 400
+
+    return schemas.TransactionBatchResponse(
+        mode=batch.mode,
+        applied=len(applied),
+        failed=len(batch.operations) - len(applied),
+        results=results
+    )
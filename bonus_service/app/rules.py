@@ -0,0 +1,218 @@
+"""Правила начисления бонусов из файла конфигурации (BONUS_RULES_FILE, по умолчанию bonus_rules.json).
+
+Конфигурация задает множитель суммы начисления по ступеням (ступени перечисляются по возрастанию
+порога above и действуют для сумм строго больше него), ограничение бонуса max_bonus - общее и для
+отдельной ступени - и фиксированные начисления за события. При загрузке она компилируется в RuleSet:
+пороги в копейках, множители в целых долях MULTIPLIER_SCALE и ограничения. Одна сумма считается
+поиском ступени через bisect, пачка сумм - одним векторным вызовом NumPy (searchsorted по тем же
+порогам). Расчет целочисленный, округление до копеек ROUND_HALF_UP, как в money.to_amount. NumPy
+импортируется только при первом расчете пачки: он не нужен на старте процесса и на пути одиночного
+начисления.
+
+Правила загружаются при старте процесса (load_current в startup и app.worker): ошибка в файле не дает
+процессу запуститься. Затем файл перечитывается при изменении (run_reloader в каждом процессе -
+воркерах gunicorn и app.worker), без перезапуска. Ошибочная конфигурация при перечитывании не
+применяется: остаются прежние правила, ошибка пишется в лог.
+"""
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_left
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import NamedTuple, Sequence
+
+from . import money
+
+logger = logging.getLogger(__name__)
+
+BONUS_RULES_FILE = Path(os.getenv("BONUS_RULES_FILE", Path(__file__).with_name("bonus_rules.json")))
+BONUS_RULES_RELOAD_INTERVAL = float(os.getenv("BONUS_RULES_RELOAD_INTERVAL", "10"))
+
+# Множители хранятся целыми долями 1/10000: точность до четырех знаков после запятой
+MULTIPLIER_SCALE = 10_000
+# Максимум int64: ограничения сравниваются с бонусом и в массивах NumPy
+NO_CAP = 2 ** 63 - 1
+# Пачка считается через float и int64: копейки сумм от 10^15 уже не восстанавливаются из float точно
+FLOAT_EXACT_MINOR_UNITS = 10 ** 15
+# События, начисление за которые должно быть в любой конфигурации
+REQUIRED_EVENTS = ("delivery_completed",)
+
+
+class EventBonus(NamedTuple):
+    amount: Decimal
+    reason: str
+
+
+class RuleSet:
+    """Скомпилированные правила: ступень i действует для сумм из (thresholds[i-1], thresholds[i]]"""
+
+    def __init__(self, version: str, thresholds: list[int], multipliers: list[int], caps: list[int],
+                 events: dict[str, EventBonus]):
+        self.version = version
+        self.thresholds = thresholds
+        self.multipliers = multipliers
+        self.caps = caps
+        self.events = events
+        # Массивы для apply_many: порогов, множителей и ограничений; строятся при первом вызове
+        self.arrays = None
+        # Копеек в сумме, начиная с которых пачка считается через apply: без потери точности float
+        # и без переполнения int64 в произведении на множитель
+        self.batch_limit = min(FLOAT_EXACT_MINOR_UNITS, (NO_CAP - MULTIPLIER_SCALE // 2) // max(multipliers))
+
+    def apply(self, amount: Decimal) -> Decimal:
+        """Сумма начисления с бонусом"""
+        base = money.to_minor_units(amount)
+        tier = bisect_left(self.thresholds, base)
+        bonus = (base * self.multipliers[tier] + MULTIPLIER_SCALE // 2) // MULTIPLIER_SCALE - base
+        return money.from_minor_units(base + min(bonus, self.caps[tier]))
+
+    def apply_many(self, amounts: Sequence[Decimal]) -> list[Decimal]:
+        """То же для пачки сумм одним проходом по массивам"""
+        if not amounts:
+            return []
+        import numpy as np
+
+        if self.arrays is None:
+            self.arrays = tuple(np.array(values, dtype=np.int64)
+                                for values in (self.thresholds, self.multipliers, self.caps))
+        threshold_array, multiplier_array, cap_array = self.arrays
+        # Суммы уже округлены до копеек: через float копейки восстанавливаются точно, пока их меньше batch_limit
+        scaled = np.rint(np.array(amounts, dtype=np.float64) * money.MINOR_UNITS)
+        if np.abs(scaled).max() >= self.batch_limit:
+            return [self.apply(amount) for amount in amounts]
+        base = scaled.astype(np.int64)
+        tiers = np.searchsorted(threshold_array, base, side="left")
+        bonus = (base * multiplier_array[tiers] + MULTIPLIER_SCALE // 2) // MULTIPLIER_SCALE - base
+        final = base + np.minimum(bonus, cap_array[tiers])
+        return [money.from_minor_units(value) for value in final.tolist()]
+
+    def event(self, name: str) -> EventBonus:
+        return self.events[name]
+
+
+def parse_decimal(value, field: str) -> Decimal:
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{field}: not a number: {value!r}")
+
+
+def parse_multiplier(value, field: str) -> int:
+    multiplier = parse_decimal(value, field) * MULTIPLIER_SCALE
+    if multiplier != multiplier.to_integral_value():
+        raise ValueError(f"{field}: at most 4 decimal places allowed")
+    if multiplier < MULTIPLIER_SCALE:
+        raise ValueError(f"{field}: multiplier must be at least 1")
+    return int(multiplier)
+
+
+def parse_cap(value, field: str) -> int | None:
+    if value is None:
+        return None
+    cap = money.to_minor_units(money.to_amount(parse_decimal(value, field)))
+    if cap < 0:
+        raise ValueError(f"{field}: must not be negative")
+    return cap
+
+
+def compile_rules(config: dict) -> RuleSet:
+    """Проверка конфигурации и сборка таблиц; ValueError с указанием поля, если она некорректна"""
+    accrual = config.get("accrual", {})
+    default_cap = parse_cap(accrual.get("max_bonus"), "accrual.max_bonus")
+
+    tiers = []
+    for position, tier in enumerate(accrual.get("tiers", [])):
+        field = f"accrual.tiers[{position}]"
+        if "above" not in tier or "multiplier" not in tier:
+            raise ValueError(f"{field}: 'above' and 'multiplier' are required")
+        cap = parse_cap(tier.get("max_bonus"), f"{field}.max_bonus")
+        tiers.append((
+            money.to_minor_units(money.to_amount(parse_decimal(tier["above"], f"{field}.above"))),
+            parse_multiplier(tier["multiplier"], f"{field}.multiplier"),
+            default_cap if cap is None else cap,
+        ))
+    # Порядок в файле должен совпадать с порядком ступеней: перепутанные ступени - скорее опечатка
+    for position in range(1, len(tiers)):
+        if tiers[position][0] <= tiers[position - 1][0]:
+            raise ValueError(f"accrual.tiers[{position}].above: thresholds must be strictly increasing")
+
+    events = {}
+    for name, event in config.get("events", {}).items():
+        amount = money.to_amount(parse_decimal(event.get("amount"), f"events.{name}.amount"))
+        if amount <= 0:
+            raise ValueError(f"events.{name}.amount: must be positive")
+        if not event.get("reason"):
+            raise ValueError(f"events.{name}.reason: required")
+        events[name] = EventBonus(amount, event["reason"])
+    missing = [name for name in REQUIRED_EVENTS if name not in events]
+    if missing:
+        raise ValueError(f"events: missing {', '.join(missing)}")
+
+    base_multiplier = parse_multiplier(accrual.get("base_multiplier", "1"), "accrual.base_multiplier")
+    caps = [default_cap] + [cap for _, _, cap in tiers]
+    return RuleSet(
+        version=str(config.get("version", "")),
+        thresholds=[threshold for threshold, _, _ in tiers],
+        multipliers=[base_multiplier] + [multiplier for _, multiplier, _ in tiers],
+        caps=[NO_CAP if cap is None else cap for cap in caps],
+        events=events,
+    )
+
+
+def load(path: Path) -> RuleSet:
+    with open(path, encoding="utf-8") as file:
+        return compile_rules(json.load(file))
+
+
+_current: RuleSet | None = None
+_loaded_mtime: float | None = None
+
+
+def load_current() -> RuleSet:
+    """Первая загрузка правил процесса; ошибка в файле - исключение, прежних правил еще нет"""
+    global _current, _loaded_mtime
+    mtime = BONUS_RULES_FILE.stat().st_mtime
+    _current = load(BONUS_RULES_FILE)
+    _loaded_mtime = mtime
+    logger.info("Bonus rules version %r loaded from %s", _current.version, BONUS_RULES_FILE)
+    return _current
+
+
+def current() -> RuleSet:
+    """Действующие правила; вызывающий код берет их один раз на запрос или пачку"""
+    if _current is None:
+        return load_current()
+    return _current
+
+
+def reload() -> bool:
+    """Перечитать файл, если он изменился; True, если применены новые правила"""
+    global _current, _loaded_mtime
+    if _current is None:
+        # Первая загрузка - в current(), где ошибка не подменяется прежними правилами
+        return False
+    try:
+        mtime = BONUS_RULES_FILE.stat().st_mtime
+    except OSError as e:
+        logger.error("Bonus rules file %s unavailable, keeping version %r: %s", BONUS_RULES_FILE, _current.version, e)
+        return False
+    if mtime == _loaded_mtime:
+        return False
+    # Ошибочный файл не перечитывается до следующего изменения
+    _loaded_mtime = mtime
+    try:
+        ruleset = load(BONUS_RULES_FILE)
+    except Exception as e:
+        logger.error("Bonus rules in %s not applied, keeping version %r: %s", BONUS_RULES_FILE, _current.version, e)
+        return False
+    _current = ruleset
+    logger.info("Bonus rules version %r loaded from %s", ruleset.version, BONUS_RULES_FILE)
+    return True
+
+
+async def run_reloader():
+    while True:
+        await asyncio.sleep(BONUS_RULES_RELOAD_INTERVAL)
+        reload()
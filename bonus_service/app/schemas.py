@@ -1,7 +1,17 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field, PlainSerializer, model_validator
+from typing import Annotated
 from uuid import UUID
 from datetime import datetime
+from decimal import Decimal
 from enum import Enum
+from .money import to_amount
+
+# Сумма с копейками; в JSON отдается числом, как и раньше с float
+Amount = Annotated[
+    Decimal,
+    AfterValidator(to_amount),
+    PlainSerializer(float, return_type=float, when_used="json"),
+]
 
 class TransactionType(str, Enum):
     ACCRUAL = "ACCRUAL"
@@ -10,19 +20,19 @@ class TransactionType(str, Enum):
 class AccruePointsRequest(BaseModel):
     order_id: UUID
     delivery_id: UUID | None = None
-    amount: float
+    amount: Amount
     reason: str
 
 class WriteOffPointsRequest(BaseModel):
     order_id: UUID
-    amount: float
+    amount: Amount
     reason: str
 
 class TransactionResponse(BaseModel):
     id: UUID
     account_id: UUID
     type: TransactionType
-    amount: float
+    amount: Amount
     order_id: UUID
     delivery_id: UUID | None = None
     reason: str
@@ -30,9 +40,47 @@ class TransactionResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class TransactionPage(BaseModel):
+    items: list[TransactionResponse]
+    next_cursor: str | None = None
+
 class BalanceResponse(BaseModel):
     id: UUID
-    current_balance: float
+    current_balance: Amount
     as_of_date: datetime
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+class BatchMode(str, Enum):
+    ATOMIC = "atomic"
+    BEST_EFFORT = "best_effort"
+
+class BatchOperation(BaseModel):
+    account_id: UUID
+    type: TransactionType
+    order_id: UUID
+    delivery_id: UUID | None = None
+    amount: Amount
+    reason: str
+
+    @model_validator(mode="after")
+    def check_delivery_id(self):
+        # Доставка привязывается только к начислению: у списания ее некуда сохранить
+        if self.type == TransactionType.WRITE_OFF and self.delivery_id is not None:
+            raise ValueError("delivery_id is allowed only for ACCRUAL operations")
+        return self
+
+class TransactionBatchRequest(BaseModel):
+    mode: BatchMode = BatchMode.ATOMIC
+    operations: list[BatchOperation] = Field(min_length=1, max_length=10000)
+
+class BatchOperationResult(BaseModel):
+    index: int
+    success: bool
+    transaction: TransactionResponse | None = None
+    error: str | None = None
+
+class TransactionBatchResponse(BaseModel):
+    mode: BatchMode
+    applied: int
+    failed: int
+    results: list[BatchOperationResult]
@@ -0,0 +1,41 @@
+"""Отдельный процесс обработки очереди delivery_completed, масштабируется независимо от HTTP API.
+
+    python -m app.worker --concurrency 4
+
+Каждый потребитель держит не больше CONSUMER_PREFETCH сообщений и одну транзакцию с базой, поэтому
+пул соединений процесса должен быть не меньше --concurrency. По SIGTERM/SIGINT потребители
+отписываются от очереди, дообрабатывают уже полученные сообщения (не дольше CONSUMER_DRAIN_TIMEOUT)
+и закрывают соединение. HTTP-приложению при этом задают CONSUMER_IN_APP=false.
+"""
+import argparse
+import asyncio
+import signal
+from service_common import logs, metrics, tracing
+from . import database, partitions, rabbitmq, rules
+
+
+async def run_worker(concurrency: int):
+    rules.load_current()
+    metrics.start_metrics_server(9102)
+    # Секции наперед на случай, если процессы API не запущены или их обслуживание давно не работало
+    await partitions.run_locked(partitions.prepare_partitions)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    reloader = asyncio.create_task(rules.run_reloader())
+    try:
+        await rabbitmq.consume_delivery_completed_messages(concurrency, stopping)
+    finally:
+        reloader.cancel()
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обработчик очереди завершенных доставок")
+    parser.add_argument("--concurrency", type=int, default=rabbitmq.CONSUMER_CONCURRENCY,
+                        help="число потребителей очереди, по умолчанию CONSUMER_CONCURRENCY")
+    args = parser.parse_args()
+    logs.setup("bonus_worker")
+    tracing.setup("bonus_worker")
+    asyncio.run(run_worker(args.concurrency))
@@ -0,0 +1,92 @@
+"""Начальная схема: секционированный журнал транзакций, счета, снимки и архивные суммы
+
+Базы, созданные раньше через create_all, приводятся к этой схеме командой
+`python -m app.partitions convert`: она секционирует журнал и переводит суммы счетов и снимков
+(accounts.current_balance, balance_snapshots.balance) из double precision в NUMERIC(18, 2). После нее
+базу достаточно пометить командой `alembic stamp 0001_initial`. Базу, секционированную более ранней
+версией convert, нужно прогнать через convert еще раз: журнал она не тронет, а суммы переведет.
+
+Revision ID: 0001_initial
+Revises:
+Create Date: 2026-10-18
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001_initial"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Секции наперед на момент миграции; дальше их продлевает обслуживание секций сервиса
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def upgrade():
+    op.create_table(
+        "transactions",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("account_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("type", sa.Enum("ACCRUAL", "WRITE_OFF", name="transactiontype"), nullable=False),
+        sa.Column("amount", sa.Numeric(18, 2), nullable=False),
+        sa.Column("order_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("delivery_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("reason", sa.String(), nullable=False),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", "created_date"),
+        postgresql_partition_by="RANGE (created_date)",
+    )
+    op.create_index(
+        "ix_transactions_account_id_created_date_id", "transactions", ["account_id", "created_date", "id"]
+    )
+
+    current = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(PARTITIONS_AHEAD + 1):
+        month = add_months(current, offset)
+        op.execute(
+            f'CREATE TABLE IF NOT EXISTS "transactions_p{month:%Y%m}" PARTITION OF "transactions" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+
+    op.create_table(
+        "delivery_accruals",
+        sa.Column("delivery_id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("transaction_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "accounts",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("current_balance", sa.Numeric(18, 2), nullable=False),
+        sa.Column("as_of_date", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "balance_snapshots",
+        sa.Column("account_id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("balance", sa.Numeric(18, 2), nullable=False),
+        sa.Column("high_water_mark", sa.DateTime(), nullable=False),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "archived_balances",
+        sa.Column("account_id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("balance", sa.Numeric(18, 2), nullable=False),
+        sa.Column("high_water_mark", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("archived_balances")
+    op.drop_table("balance_snapshots")
+    op.drop_table("accounts")
+    op.drop_table("delivery_accruals")
+    # Секции удаляются вместе с родительской таблицей
+    op.drop_table("transactions")
+    sa.Enum(name="transactiontype").drop(op.get_bind())
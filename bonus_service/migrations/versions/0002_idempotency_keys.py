@@ -0,0 +1,36 @@
+"""Сохраненные ответы на запросы с заголовком Idempotency-Key
+
+Ключ вставляется в транзакции изменения; просроченные записи удаляет idempotency.run_purger
+по индексу expires_at.
+Имя таблицы с префиксом сервиса: delivery_service и bonus_service могут работать в одной БД.
+
+Revision ID: 0002_idempotency_keys
+Revises: 0001_initial
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_idempotency_keys"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "bonus_idempotency_keys",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("fingerprint", sa.String(), nullable=False),
+        sa.Column("status_code", sa.Integer(), nullable=False),
+        sa.Column("response_body", sa.LargeBinary(), nullable=False),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index("ix_bonus_idempotency_keys_expires_at", "bonus_idempotency_keys", ["expires_at"])
+
+
+def downgrade():
+    op.drop_index("ix_bonus_idempotency_keys_expires_at", table_name="bonus_idempotency_keys")
+    op.drop_table("bonus_idempotency_keys")
@@ -0,0 +1,41 @@
+"""Уведомление об изменении баланса: по нему процессы сервиса сбрасывают свой кеш балансов
+
+Триггер на accounts шлет NOTIFY bonus_balance_changed с id счета при любой вставке, изменении и
+удалении строки. Postgres доставляет уведомления слушателям при коммите, а повторы одного счета в
+транзакции схлопывает, поэтому сброс получают все изменения баланса: API, обработчик очереди, ручные правки.
+
+Revision ID: 0003_balance_changed_notify
+Revises: 0002_idempotency_keys
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003_balance_changed_notify"
+down_revision = "0002_idempotency_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE FUNCTION notify_bonus_balance_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('bonus_balance_changed', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('bonus_balance_changed', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER accounts_balance_changed
+        AFTER INSERT OR UPDATE OR DELETE ON accounts
+        FOR EACH ROW EXECUTE FUNCTION notify_bonus_balance_changed()
+    """)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER accounts_balance_changed ON accounts")
+    op.execute("DROP FUNCTION notify_bonus_balance_changed()")
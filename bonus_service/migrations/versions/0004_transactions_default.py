@@ -0,0 +1,47 @@
+"""Секция DEFAULT журнала transactions и секции наперед на момент миграции
+
+Без секции DEFAULT вставка в месяц, для которого обслуживание не успело создать секцию, падает с
+ошибкой "no partition of relation found for row". Теперь такая строка попадает в DEFAULT, а
+обслуживание секций (app.partitions) создает секцию месяца и переносит строку в нее.
+
+Revision ID: 0004_transactions_default
+Revises: 0003_balance_changed_notify
+Create Date: 2026-10-18
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_transactions_default"
+down_revision = "0003_balance_changed_notify"
+branch_labels = None
+depends_on = None
+
+# Как в 0001_initial: база могла простоять без обслуживания секций дольше их запаса
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def upgrade():
+    # Секции наперед создаются до DEFAULT: после нее CREATE TABLE ... PARTITION OF проверяет и ее строки
+    current = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(PARTITIONS_AHEAD + 1):
+        month = add_months(current, offset)
+        op.execute(
+            f'CREATE TABLE IF NOT EXISTS "transactions_p{month:%Y%m}" PARTITION OF "transactions" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+    op.execute('CREATE TABLE "transactions_default" PARTITION OF "transactions" DEFAULT')
+
+
+def downgrade():
+    rows = op.get_bind().scalar(sa.text('SELECT count(*) FROM "transactions_default"'))
+    if rows:
+        raise RuntimeError(
+            f"transactions_default has {rows} rows: run python -m app.partitions maintain to move them first"
+        )
+    op.execute('DROP TABLE "transactions_default"')
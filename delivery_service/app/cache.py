@@ -0,0 +1,62 @@
+import os
+import time
+from collections import OrderedDict
+
+from service_common import singleflight
+
+DELIVERY_CACHE_SIZE = int(os.getenv("DELIVERY_CACHE_SIZE", "10000"))
+# Секунды; 0 - без кеша. Инвалидация действует только в своем процессе: другие воркеры gunicorn
+# отдают прежнее состояние доставки, пока не истечет срок записи
+DELIVERY_CACHE_TTL = float(os.getenv("DELIVERY_CACHE_TTL", "0"))
+
+
+class LocalTTLCache:
+    """LRU-кеш в памяти процесса с ограничением размера и временем жизни записей.
+
+    Каждый ключ хранит номер поколения, который растет при инвалидации: значение,
+    прочитанное из БД до инвалидации, не попадет в кеш после нее.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key) -> tuple[object | None, int]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, 0
+        generation, expires_at, value = entry
+        if value is None or expires_at < time.monotonic():
+            return None, generation
+        self.entries.move_to_end(key)
+        return value, generation
+
+    def set(self, key, value, generation: int):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] != generation:
+            return
+        self._store(key, (generation, time.monotonic() + self.ttl, value))
+
+    def invalidate(self, key):
+        entry = self.entries.get(key)
+        generation = entry[0] + 1 if entry is not None else 1
+        self._store(key, (generation, 0.0, None))
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+def invalidate_deliveries(delivery_ids):
+    """Вызывается после коммита изменения доставок"""
+    for delivery_id in delivery_ids:
+        delivery_cache.invalidate(delivery_id)
+        delivery_flights.forget(delivery_id)
+
+
+delivery_flights = singleflight.SingleFlight("delivery")
+# Без срока жизни кеш нулевого размера: записи вытесняются сразу, остаются совмещение чтений и ETag
+delivery_cache = LocalTTLCache(DELIVERY_CACHE_SIZE if DELIVERY_CACHE_TTL > 0 else 0, DELIVERY_CACHE_TTL)
@@ -1,17 +1,50 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import os
+from service_common import metrics, tracing
 
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/delivery_db")
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://user:password@db:5432/delivery_db")
+# Старые конфигурации задают URL без драйвера - переводим их на asyncpg
+if DATABASE_URL.startswith("postgresql://"):
+    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сервисы могут делить одну базу, поэтому у каждого своя таблица версий миграций
+MIGRATIONS_VERSION_TABLE = "alembic_version_delivery"
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Соединения Postgres, отведенные сервису на все его процессы (часть max_connections); 0 - без ограничения
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+# Процессы сервиса со своим пулом: воркеры gunicorn (WEB_CONCURRENCY) и отдельные обработчики очереди
+DB_POOL_PROCESSES = int(os.getenv("DB_POOL_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+
+
+def pool_limits(pool_size: int, max_overflow: int, processes: int, budget: int) -> tuple[int, int]:
+    """pool_size и max_overflow одного процесса, при которых все процессы вместе укладываются в бюджет"""
+    if budget <= 0:
+        return pool_size, max_overflow
+    per_process = max(1, budget // max(1, processes))
+    pool_size = min(pool_size, per_process)
+    return pool_size, min(max_overflow, per_process - pool_size)
+
+
+POOL_SIZE, MAX_OVERFLOW = pool_limits(DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PROCESSES, DB_CONNECTION_BUDGET)
+
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_timeout=DB_POOL_TIMEOUT,
+    poolclass=metrics.InstrumentedQueuePool,
+)
+metrics.instrument_engine(engine)
+tracing.instrument_engine(engine)
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
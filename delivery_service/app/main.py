@@ -1,13 +1,56 @@
 from fastapi import FastAPI
-from . import models, database
-from .routes import router
+from fastapi.responses import JSONResponse
+import asyncio
+import logging
+from pathlib import Path
+from service_common import logs, metrics, readiness, tracing
+from . import database
+from .routes import router, idempotency_keys
+from .rabbitmq import publisher
+from .outbox import run_relay
 
-models.Base.metadata.create_all(bind=database.engine)
+logs.setup("delivery_service")
+tracing.setup("delivery_service")
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
 
 app = FastAPI(title="Delivery Service", version="1.0.0")
 
+app.add_middleware(metrics.PrometheusMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(logs.CorrelationMiddleware)
 app.include_router(router, prefix="/api")
 
+background_tasks = set()
+
+@app.on_event("startup")
+async def startup_event():
+    # Схема создается миграциями (alembic upgrade head), старт не ждет ни базу, ни брокер
+    metrics.start_metrics_server(9101)
+    background_tasks.add(asyncio.create_task(connect_publisher()))
+    background_tasks.add(asyncio.create_task(run_relay()))
+    background_tasks.add(asyncio.create_task(idempotency_keys.run_purger()))
+
+async def connect_publisher():
+    try:
+        await publisher.connect()
+    except Exception as e:
+        # Сервис работает и без брокера, подключение повторится при первой публикации
+        logger.error("RabbitMQ connection error: %s", e)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await publisher.close()
+
 @app.get("/")
 def read_root():
-    return {"message": "Delivery Service is running"}
\ No newline at end of file
+    return {"message": "Delivery Service is running"}
+
+@app.get("/ready")
+async def read_ready():
+    ready, details = await readiness.check(database.engine, database.MIGRATIONS_VERSION_TABLE, MIGRATIONS_DIR)
+    return JSONResponse(details, status_code=200 if ready else 503)
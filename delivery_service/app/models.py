@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, DateTime, Enum
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, LargeBinary, DateTime, Enum, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
 import enum
 from .database import Base
@@ -22,4 +22,55 @@ class Delivery(Base):
     courier_id = Column(UUID(as_uuid=True), nullable=True)
     created_date = Column(DateTime, nullable=False)
     assigned_date = Column(DateTime, nullable=True)
-    delivered_date = Column(DateTime, nullable=True)
\ No newline at end of file
+    delivered_date = Column(DateTime, nullable=True)
+
+    # Индексы под keyset-пагинацию по (created_date, id) и фильтры списка доставок
+    __table_args__ = (
+        Index("ix_deliveries_created_date_id", "created_date", "id"),
+        Index("ix_deliveries_status_created_date_id", "status", "created_date", "id"),
+        Index("ix_deliveries_courier_id_created_date_id", "courier_id", "created_date", "id"),
+        Index("ix_deliveries_order_id_created_date_id", "order_id", "created_date", "id"),
+        # Частичные индексы под диспетчерские запросы: в них только активные доставки, а не вся история
+        Index(
+            "ix_deliveries_created_pending", "created_date", "id",
+            postgresql_where=text("status = 'CREATED'")
+        ),
+        Index(
+            "ix_deliveries_courier_id_assigned", "courier_id", "created_date", "id",
+            postgresql_where=text("status = 'ASSIGNED'")
+        ),
+        Index(
+            "ix_deliveries_delivered_date_courier_id", "delivered_date", "courier_id",
+            postgresql_where=text("status = 'DELIVERED'")
+        ),
+    )
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    routing_key = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    correlation_id = Column(String, nullable=True)
+    traceparent = Column(String, nullable=True)
+    created_date = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_outbox_created_date", "created_date"),
+    )
+
+class IdempotencyKey(Base):
+    """Ответ на запрос с заголовком Idempotency-Key, сохраненный вместе с изменением (см. service_common/idempotency.py)"""
+    __tablename__ = "delivery_idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    # Хеш метода, пути и тела: тот же ключ с другим запросом - ошибка клиента, а не повтор
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(LargeBinary, nullable=False)
+    created_date = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_delivery_idempotency_keys_expires_at", "expires_at"),
+    )
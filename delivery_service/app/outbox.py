@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select, delete
+from service_common import logs, tracing
+from . import models, database, rabbitmq
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+
+_wakeup = asyncio.Event()
+
+
+def add_delivery_completed_event(db, delivery: models.Delivery):
+    """Запись события о завершении доставки в outbox в текущей транзакции"""
+    completed_at = delivery.delivered_date or datetime.utcnow()
+    db.add(models.OutboxEvent(
+        routing_key=rabbitmq.DELIVERY_COMPLETED_QUEUE,
+        payload={
+            "delivery_id": str(delivery.id),
+            "order_id": str(delivery.order_id),
+            "account_id": str(delivery.order_id),
+            "completed_at": completed_at.isoformat()
+        },
+        correlation_id=logs.correlation_id.get(),
+        traceparent=tracing.current_traceparent(),
+        created_date=datetime.utcnow()
+    ))
+
+
+def add_delivery_completed_events(db, deliveries: list[models.Delivery]):
+    for delivery in deliveries:
+        add_delivery_completed_event(db, delivery)
+
+
+def notify():
+    """Будит relay сразу после коммита, не дожидаясь очередного опроса"""
+    _wakeup.set()
+
+
+async def fetch_pending_events(db, limit: int) -> list[models.OutboxEvent]:
+    # SKIP LOCKED: реплики забирают непересекающиеся пачки и не отправляют события дважды
+    return (await db.execute(
+        select(models.OutboxEvent)
+        .order_by(models.OutboxEvent.created_date)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+
+
+async def relay_batch() -> int:
+    """Публикация одной пачки событий; строки удаляются только после подтверждения брокером"""
+    with tracing.span("outbox relay"):
+        return await publish_pending_events()
+
+
+async def publish_pending_events() -> int:
+    async with database.SessionLocal() as db, db.begin():
+        events = await fetch_pending_events(db, OUTBOX_BATCH_SIZE)
+        if not events:
+            return 0
+
+        by_routing_key = defaultdict(list)
+        for event in events:
+            by_routing_key[event.routing_key].append(event)
+        for routing_key, grouped in by_routing_key.items():
+            await rabbitmq.publisher.publish_many(
+                [event.payload for event in grouped], routing_key,
+                [event.correlation_id for event in grouped], [event.traceparent for event in grouped]
+            )
+
+        await db.execute(
+            delete(models.OutboxEvent).where(models.OutboxEvent.id.in_([event.id for event in events]))
+        )
+        return len(events)
+
+
+async def run_relay():
+    while True:
+        _wakeup.clear()
+        try:
+            while await relay_batch() == OUTBOX_BATCH_SIZE:
+                pass
+        except Exception as e:
+            logger.error("Outbox relay error: %s", e)
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,24 @@
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+
+
+def encode_cursor(created_date: datetime, item_id: UUID) -> str:
+    """Кодирование ключа (created_date, id) последней строки страницы в непрозрачный курсор"""
+    raw = json.dumps([created_date.isoformat(), str(item_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Декодирование курсора; ValueError, если курсор поврежден"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_date, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_date), UUID(item_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
@@ -1,68 +1,85 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, tuple_, literal, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
-from datetime import datetime
-import asyncio
+from datetime import datetime, timedelta
 
-from . import models, schemas, database, rabbitmq
+from service_common import singleflight, idempotency
+from . import models, schemas, database, pagination, outbox, cache
 
 router = APIRouter()
+# Ответы на запросы с Idempotency-Key; очистку просроченных ключей запускает main
+idempotency_keys = idempotency.IdempotencyKeys(models.IdempotencyKey, database.SessionLocal, cache.LocalTTLCache)
 
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def validate_status_transition(current_status, new_status):
+    valid_transitions = {
+        "CREATED": ["ASSIGNED"],
+        "ASSIGNED": ["DELIVERED"],
+        "DELIVERED": []
+    }
+    if current_status in valid_transitions and new_status in valid_transitions[current_status]:
+        return True
+    return False
+
+
+def update_delivery_dates(delivery_obj, status):
+    if status == "ASSIGNED" and not delivery_obj.assigned_date:
+        delivery_obj.assigned_date = datetime.utcnow()
+    elif status == "DELIVERED" and not delivery_obj.delivered_date:
+        delivery_obj.delivered_date = datetime.utcnow()
+
+
+def status_value(status) -> str:
+    return status.value if hasattr(status, 'value') else str(status)
 
 
 @router.post("/deliveries", response_model=schemas.DeliveryResponse)
-async def create_delivery(delivery: schemas.DeliveryCreate, db: Session = Depends(get_db)):
+async def create_delivery(
+        delivery: schemas.DeliveryCreate,
+        db: AsyncSession = Depends(database.get_db),
+        idempotent: idempotency.IdempotentRequest = Depends(idempotency_keys.request)
+):
+    replayed = await idempotent.replay(db)
+    if replayed is not None:
+        return replayed
     try:
         new_delivery = models.Delivery(
             **delivery.dict(),
             created_date=datetime.utcnow()
         )
         db.add(new_delivery)
-        db.commit()
-        db.refresh(new_delivery)
+        await db.flush()
+        await idempotent.save(db, schemas.DeliveryResponse.model_validate(new_delivery))
+        await db.commit()
+        idempotent.committed()
+        await db.refresh(new_delivery)
         return new_delivery
+    except idempotency.KeyConflict:
+        await db.rollback()
+        return await idempotent.replay(db)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
 @router.patch("/deliveries/{delivery_id}", response_model=schemas.DeliveryResponse)
-async def update_delivery(delivery_id: UUID, delivery_update: schemas.DeliveryUpdate, db: Session = Depends(get_db)):
-    delivery = db.query(models.Delivery).filter(models.Delivery.id == delivery_id).first()
+async def update_delivery(delivery_id: UUID, delivery_update: schemas.DeliveryUpdate, db: AsyncSession = Depends(database.get_db)):
+    delivery = (await db.execute(
+        select(models.Delivery).where(models.Delivery.id == delivery_id).with_for_update()
+    )).scalars().first()
     if not delivery:
         raise HTTPException(status_code=404, detail="Delivery not found")
 
-    def validate_status_transition(current_status, new_status):
-        valid_transitions = {
-            "CREATED": ["ASSIGNED"],
-            "ASSIGNED": ["DELIVERED"],
-            "DELIVERED": []
-        }
-        if current_status in valid_transitions and new_status in valid_transitions[current_status]:
-            return True
-        return False
-
-    def update_delivery_dates(delivery_obj, status):
-        if status == "ASSIGNED" and not delivery_obj.assigned_date:
-            delivery_obj.assigned_date = datetime.utcnow()
-        elif status == "DELIVERED" and not delivery_obj.delivered_date:
-            delivery_obj.delivered_date = datetime.utcnow()
-
     try:
+        event_added = False
         if delivery_update.courier_id is not None:
             delivery.courier_id = delivery_update.courier_id
 
         if delivery_update.status:
-            current_status = delivery.status.value if hasattr(delivery.status, 'value') else str(delivery.status)
-            new_status = delivery_update.status.value if hasattr(delivery_update.status, 'value') else str(
-                delivery_update.status)
+            current_status = status_value(delivery.status)
+            new_status = status_value(delivery_update.status)
 
             if not validate_status_transition(current_status, new_status):
                 raise HTTPException(
@@ -74,42 +91,290 @@ async def update_delivery(delivery_id: UUID, delivery_update: schemas.DeliveryUp
             delivery.status = new_status
 
             if new_status == "DELIVERED":
-                account_id = str(delivery.order_id)
+                outbox.add_delivery_completed_event(db, delivery)
+                event_added = True
 
-                asyncio.create_task(rabbitmq.send_delivery_completed_message({
-                    "delivery_id": str(delivery.id),
-                    "order_id": str(delivery.order_id),
-                    "account_id": account_id,
-                    "completed_at": delivery.delivered_date.isoformat() if delivery.delivered_date else datetime.utcnow().isoformat()
-                }))
-
-        db.commit()
-        db.refresh(delivery)
+        await db.commit()
+        cache.invalidate_deliveries([delivery_id])
+        if event_added:
+            outbox.notify()
+        await db.refresh(delivery)
         return delivery
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@router.get("/deliveries/{delivery_id}", response_model=schemas.DeliveryResponse)
-def get_delivery(delivery_id: UUID, db: Session = Depends(get_db)):
+@router.post("/deliveries:batch", response_model=list[schemas.DeliveryResponse])
+async def create_deliveries_batch(batch: schemas.DeliveryBatchCreate, db: AsyncSession = Depends(database.get_db)):
+    try:
+        created_date = datetime.utcnow()
+        deliveries = (await db.scalars(
+            insert(models.Delivery).returning(models.Delivery),
+            [
+                {**delivery.model_dump(), "status": models.DeliveryStatus.CREATED, "created_date": created_date}
+                for delivery in batch.deliveries
+            ]
+        )).all()
+        await db.commit()
+        return deliveries
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.patch("/deliveries:batch", response_model=schemas.DeliveryBatchUpdateResponse)
+async def update_deliveries_batch(
+        batch: schemas.DeliveryBatchUpdate,
+        response: Response,
+        db: AsyncSession = Depends(database.get_db)
+):
+    atomic = batch.mode == schemas.BatchMode.ATOMIC
     try:
-        delivery = db.query(models.Delivery).filter(models.Delivery.id == delivery_id).first()
+        # Одним запросом блокируем все затронутые доставки и получаем их текущие статусы
+        deliveries = {
+            delivery.id: delivery
+            for delivery in (await db.scalars(
+                select(models.Delivery)
+                .where(models.Delivery.id.in_({update.id for update in batch.updates}))
+                .order_by(models.Delivery.id)
+                .with_for_update()
+            )).all()
+        }
+
+        errors = {}
+        changed = {}
+        completed = []
+        for index, update in enumerate(batch.updates):
+            delivery = deliveries.get(update.id)
+            if delivery is None:
+                errors[index] = "Delivery not found"
+                continue
+
+            if update.status:
+                current_status = status_value(delivery.status)
+                new_status = status_value(update.status)
+                if not validate_status_transition(current_status, new_status):
+                    errors[index] = f"Invalid status transition from {current_status} to {new_status}"
+                    continue
+
+            if update.courier_id is not None:
+                delivery.courier_id = update.courier_id
+            if update.status:
+                update_delivery_dates(delivery, new_status)
+                delivery.status = models.DeliveryStatus(new_status)
+                if new_status == "DELIVERED":
+                    completed.append(delivery)
+            changed[index] = delivery
+
+        if atomic and errors:
+            await db.rollback()
+            changed = {}
+        else:
+            outbox.add_delivery_completed_events(db, completed)
+            # Изменения сбрасываются пакетным UPDATE по первичному ключу при коммите
+            await db.commit()
+            cache.invalidate_deliveries({delivery.id for delivery in changed.values()})
+            if completed:
+                outbox.notify()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    results = []
+    for index in range(len(batch.updates)):
+        if index in changed:
+            results.append(schemas.DeliveryBatchUpdateResult(
+                index=index,
+                success=True,
+                delivery=schemas.DeliveryResponse.model_validate(changed[index])
+            ))
+        else:
+            results.append(schemas.DeliveryBatchUpdateResult(
+                index=index,
+                success=False,
+                error=errors.get(index, "Not applied: batch rolled back")
+            ))
+
+    if atomic and errors:
+        response.status_code = 400
+
+    return schemas.DeliveryBatchUpdateResponse(
+        mode=batch.mode,
+        applied=len(changed),
+        failed=len(batch.updates) - len(changed),
+        results=results
+    )
+
+
+async def load_delivery(delivery_id: UUID) -> singleflight.Representation | None:
+    """Доставка из БД в своей сессии: загрузку разделяют все одновременные запросы этой доставки"""
+    async with database.SessionLocal() as db:
+        delivery = (await db.execute(
+            select(models.Delivery).where(models.Delivery.id == delivery_id)
+        )).scalars().first()
         if not delivery:
-            raise HTTPException(status_code=404, detail="Delivery not found")
-        return delivery
+            return None
+        return singleflight.from_model(schemas.DeliveryResponse.model_validate(delivery))
+
+
+@router.get("/deliveries/{delivery_id}", response_model=schemas.DeliveryResponse)
+async def get_delivery(delivery_id: UUID, request: Request):
+    try:
+        delivery, generation = cache.delivery_cache.get(delivery_id)
+        if delivery is None:
+            delivery = await cache.delivery_flights.do(delivery_id, lambda: load_delivery(delivery_id))
+            if delivery is None:
+                raise HTTPException(status_code=404, detail="Delivery not found")
+            cache.delivery_cache.set(delivery_id, delivery, generation)
+        return singleflight.respond(request, delivery)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@router.get("/deliveries", response_model=list[schemas.DeliveryResponse])
-def get_deliveries(db: Session = Depends(get_db)):
+def status_literal(status: models.DeliveryStatus):
+    """Статус, подставленный в SQL константой, а не параметром.
+
+    Частичный индекс с условием по статусу применим только если планировщик видит значение:
+    обобщенный план подготовленного запроса с параметром $1 его бы не использовал.
+    """
+    return literal(status, models.Delivery.status.type, literal_execute=True)
+
+
+def build_deliveries_query(
+        status: schemas.DeliveryStatus | None,
+        courier_id: UUID | None,
+        order_id: UUID | None,
+        cursor: str | None
+):
+    """Запрос списка доставок с фильтрами, упорядоченный по (created_date, id) от новых к старым"""
+    stmt = select(models.Delivery)
+    if status is not None:
+        stmt = stmt.where(models.Delivery.status == status_literal(models.DeliveryStatus(status.value)))
+    if courier_id is not None:
+        stmt = stmt.where(models.Delivery.courier_id == courier_id)
+    if order_id is not None:
+        stmt = stmt.where(models.Delivery.order_id == order_id)
+    if cursor:
+        try:
+            created_date, last_id = pagination.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(
+            tuple_(models.Delivery.created_date, models.Delivery.id) < tuple_(created_date, last_id)
+        )
+    return stmt.order_by(models.Delivery.created_date.desc(), models.Delivery.id.desc())
+
+
+async def stream_deliveries(stmt):
+    """Выгрузка доставок в NDJSON порциями из серверного курсора"""
+    async with database.SessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=pagination.STREAM_CHUNK_SIZE))
+        async for delivery in result.scalars():
+            yield schemas.DeliveryResponse.model_validate(delivery).model_dump_json() + "\n"
+
+
+@router.get("/deliveries", response_model=schemas.DeliveryPage)
+async def get_deliveries(
+        status: schemas.DeliveryStatus | None = None,
+        courier_id: UUID | None = None,
+        order_id: UUID | None = None,
+        cursor: str | None = None,
+        limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+        stream: bool = False,
+        db: AsyncSession = Depends(database.get_db)
+):
+    stmt = build_deliveries_query(status, courier_id, order_id, cursor)
+
+    if stream:
+        return StreamingResponse(stream_deliveries(stmt), media_type="application/x-ndjson")
+
     try:
-        return db.query(models.Delivery).all()
+        deliveries = (await db.execute(stmt.limit(limit + 1))).scalars().all()
+        next_cursor = None
+        if len(deliveries) > limit:
+            deliveries = deliveries[:limit]
+            last = deliveries[-1]
+            next_cursor = pagination.encode_cursor(last.created_date, last.id)
+        return {"items": deliveries, "next_cursor": next_cursor}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/deliveries:unassigned", response_model=schemas.DeliveryPage)
+async def get_unassigned_deliveries(
+        older_than_minutes: float = Query(0, ge=0),
+        cursor: str | None = None,
+        limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(database.get_db)
+):
+    """Доставки в статусе CREATED старше older_than_minutes, от самых старых; частичный индекс ix_deliveries_created_pending"""
+    stmt = select(models.Delivery).where(
+        models.Delivery.status == status_literal(models.DeliveryStatus.CREATED),
+        models.Delivery.created_date < datetime.utcnow() - timedelta(minutes=older_than_minutes)
+    )
+    if cursor:
+        try:
+            created_date, last_id = pagination.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(
+            tuple_(models.Delivery.created_date, models.Delivery.id) > tuple_(created_date, last_id)
+        )
+    stmt = stmt.order_by(models.Delivery.created_date, models.Delivery.id)
+
+    try:
+        deliveries = (await db.execute(stmt.limit(limit + 1))).scalars().all()
+        next_cursor = None
+        if len(deliveries) > limit:
+            deliveries = deliveries[:limit]
+            last = deliveries[-1]
+            next_cursor = pagination.encode_cursor(last.created_date, last.id)
+        return {"items": deliveries, "next_cursor": next_cursor}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/couriers/workload", response_model=schemas.CourierWorkloadResponse)
+async def get_courier_workload(
+        since: datetime | None = None,
+        courier_id: UUID | None = None,
+        limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(database.get_db)
+):
+    """Счетчики по курьерам, посчитанные в SQL: активные доставки и завершенные с момента since.
+
+    Читаются только частичные индексы ASSIGNED и DELIVERED по delivered_date, а не вся история.
+    По умолчанию since - сутки назад; курьеры упорядочены по числу активных доставок.
+    """
+    since = since or datetime.utcnow() - timedelta(days=1)
+    delivery = models.Delivery
+    assigned = delivery.status == status_literal(models.DeliveryStatus.ASSIGNED)
+    delivered = delivery.status == status_literal(models.DeliveryStatus.DELIVERED)
+
+    assigned_count = func.count().filter(assigned).label("assigned")
+    stmt = (
+        select(
+            delivery.courier_id,
+            assigned_count,
+            func.min(delivery.assigned_date).filter(assigned).label("oldest_assigned_date"),
+            func.count().filter(delivered).label("delivered_since"),
+        )
+        .where(delivery.courier_id.is_not(None), assigned | (delivered & (delivery.delivered_date >= since)))
+        .group_by(delivery.courier_id)
+        .order_by(assigned_count.desc(), delivery.courier_id)
+        .limit(limit)
+    )
+    if courier_id is not None:
+        stmt = stmt.where(delivery.courier_id == courier_id)
+
+    try:
+        rows = (await db.execute(stmt)).all()
+        return {"since": since, "couriers": [row._asdict() for row in rows]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
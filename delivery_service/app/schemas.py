@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
 from enum import Enum
@@ -33,4 +33,44 @@ class DeliveryResponse(BaseModel):
     delivered_date: datetime | None = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class DeliveryPage(BaseModel):
+    items: list[DeliveryResponse]
+    next_cursor: str | None = None
+
+class CourierWorkload(BaseModel):
+    courier_id: UUID
+    assigned: int
+    oldest_assigned_date: datetime | None = None
+    delivered_since: int
+
+class CourierWorkloadResponse(BaseModel):
+    since: datetime
+    couriers: list[CourierWorkload]
+
+class BatchMode(str, Enum):
+    ATOMIC = "atomic"
+    BEST_EFFORT = "best_effort"
+
+class DeliveryBatchCreate(BaseModel):
+    deliveries: list[DeliveryCreate] = Field(min_length=1, max_length=10000)
+
+class DeliveryBatchUpdateItem(DeliveryUpdate):
+    id: UUID
+
+class DeliveryBatchUpdate(BaseModel):
+    mode: BatchMode = BatchMode.ATOMIC
+    updates: list[DeliveryBatchUpdateItem] = Field(min_length=1, max_length=10000)
+
+class DeliveryBatchUpdateResult(BaseModel):
+    index: int
+    success: bool
+    delivery: DeliveryResponse | None = None
+    error: str | None = None
+
+class DeliveryBatchUpdateResponse(BaseModel):
+    mode: BatchMode
+    applied: int
+    failed: int
+    results: list[DeliveryBatchUpdateResult]
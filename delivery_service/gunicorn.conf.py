@@ -0,0 +1,45 @@
+"""Многопроцессный запуск сервиса: gunicorn с воркерами uvicorn.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+WEB_CONCURRENCY - число воркеров, по умолчанию 1. У каждого воркера свой пул соединений с базой;
+app/database.py делит между ними DB_CONNECTION_BUDGET, чтобы все воркеры вместе не вышли
+за max_connections Postgres. При нескольких воркерах метрики Prometheus пишутся в
+PROMETHEUS_MULTIPROC_DIR, а порт METRICS_PORT слушает мастер-процесс.
+"""
+import os
+from pathlib import Path
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Воркеры наследуют окружение мастера, поэтому каталог задается до их запуска
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    if MULTIPROCESS_DIR:
+        directory = Path(MULTIPROCESS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Файлы прошлого запуска иначе попали бы в счетчики нового
+        for path in directory.glob("*.db"):
+            path.unlink()
+
+
+def when_ready(server):
+    if MULTIPROCESS_DIR:
+        from service_common import metrics
+
+        metrics.start_multiprocess_metrics_server(9101)
+
+
+def child_exit(server, worker):
+    if MULTIPROCESS_DIR:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,57 @@
+import asyncio
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import database, models
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def include_name(name, type_, parent_names):
+    # Сервисы могут делить одну базу - таблицы другого сервиса миграциям не принадлежат
+    if type_ == "table":
+        return name in target_metadata.tables
+    return True
+
+
+def run_migrations_offline():
+    context.configure(
+        url=database.DATABASE_URL,
+        target_metadata=target_metadata,
+        version_table=database.MIGRATIONS_VERSION_TABLE,
+        include_name=include_name,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        version_table=database.MIGRATIONS_VERSION_TABLE,
+        include_name=include_name,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    # Отдельный движок без пула: миграции запускаются один раз и не должны держать соединения
+    engine = create_async_engine(database.DATABASE_URL, poolclass=pool.NullPool)
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
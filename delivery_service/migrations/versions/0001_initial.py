@@ -0,0 +1,53 @@
+"""Начальная схема: доставки и outbox событий
+
+Базы, созданные раньше через create_all, уже содержат эту схему - их достаточно
+пометить командой `alembic stamp 0001_initial`.
+
+Revision ID: 0001_initial
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001_initial"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "deliveries",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("order_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("address_from", sa.String(), nullable=False),
+        sa.Column("address_to", sa.String(), nullable=False),
+        sa.Column("recipient_name", sa.String(), nullable=False),
+        sa.Column("recipient_phone", sa.String(), nullable=False),
+        sa.Column("status", sa.Enum("CREATED", "ASSIGNED", "DELIVERED", name="deliverystatus"), nullable=True),
+        sa.Column("courier_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+        sa.Column("assigned_date", sa.DateTime(), nullable=True),
+        sa.Column("delivered_date", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_deliveries_created_date_id", "deliveries", ["created_date", "id"])
+    op.create_index("ix_deliveries_status_created_date_id", "deliveries", ["status", "created_date", "id"])
+    op.create_index("ix_deliveries_courier_id_created_date_id", "deliveries", ["courier_id", "created_date", "id"])
+    op.create_index("ix_deliveries_order_id_created_date_id", "deliveries", ["order_id", "created_date", "id"])
+
+    op.create_table(
+        "outbox",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("routing_key", sa.String(), nullable=False),
+        sa.Column("payload", postgresql.JSONB(), nullable=False),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_outbox_created_date", "outbox", ["created_date"])
+
+
+def downgrade():
+    op.drop_table("outbox")
+    op.drop_table("deliveries")
+    sa.Enum(name="deliverystatus").drop(op.get_bind())
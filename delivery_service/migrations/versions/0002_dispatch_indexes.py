@@ -0,0 +1,36 @@
+"""Частичные индексы под диспетчерские запросы
+
+Индексы строятся CONCURRENTLY, без блокировки записи в deliveries, поэтому вне транзакции миграции.
+
+Revision ID: 0002_dispatch_indexes
+Revises: 0001_initial
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_dispatch_indexes"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_deliveries_created_pending", ["created_date", "id"], "status = 'CREATED'"),
+    ("ix_deliveries_courier_id_assigned", ["courier_id", "created_date", "id"], "status = 'ASSIGNED'"),
+    ("ix_deliveries_delivered_date_courier_id", ["delivered_date", "courier_id"], "status = 'DELIVERED'"),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, columns, where in INDEXES:
+            op.create_index(
+                name, "deliveries", columns,
+                postgresql_where=sa.text(where), postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.drop_index(name, "deliveries", postgresql_concurrently=True, if_exists=True)
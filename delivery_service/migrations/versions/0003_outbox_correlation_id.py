@@ -0,0 +1,24 @@
+"""Идентификатор корреляции события outbox
+
+Relay передает его в свойство correlation_id сообщения AMQP, чтобы логи потребителя связывались
+с запросом, завершившим доставку. Колонка без значения по умолчанию: добавление не переписывает таблицу.
+
+Revision ID: 0003_outbox_correlation_id
+Revises: 0002_dispatch_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_outbox_correlation_id"
+down_revision = "0002_dispatch_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("outbox", sa.Column("correlation_id", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbox", "correlation_id")
@@ -0,0 +1,24 @@
+"""Контекст трассы события outbox
+
+Relay передает его заголовком traceparent сообщения AMQP, чтобы публикация и обработка события
+попадали в трассу запроса, завершившего доставку. Заполняется только для записываемых трасс.
+
+Revision ID: 0004_outbox_traceparent
+Revises: 0003_outbox_correlation_id
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_outbox_traceparent"
+down_revision = "0003_outbox_correlation_id"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("outbox", sa.Column("traceparent", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbox", "traceparent")
@@ -0,0 +1,6 @@
+"""Общий код delivery_service и bonus_service: логи, трассировка, метрики, кодек событий,
+совмещение чтений, идемпотентность запросов и проверка готовности.
+
+Пакет ставится в образ каждого сервиса (pip install ./shared), локально - pip install -e shared.
+То, что у сервисов свое (модели, движок базы, кеш, порт метрик), сервис передает сам.
+"""
@@ -0,0 +1,107 @@
+"""Кодирование события delivery_completed.
+
+Бинарный формат (content_type BINARY_CONTENT_TYPE) - 57 байт, big-endian:
+    версия (1 байт) | delivery_id | order_id | account_id (UUID по 16 байт) | completed_at (int64, мкс UTC от эпохи)
+JSON (content_type application/json или не задан) принимается для совместимости со старыми публикаторами.
+"""
+import json
+import struct
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+try:
+    # C-реализация из asyncpg: подкласс uuid.UUID, из 16 байт создается на порядок быстрее
+    from asyncpg.pgproto.pgproto import UUID as uuid_from_bytes
+except ImportError:
+    def uuid_from_bytes(raw: bytes) -> UUID:
+        return UUID(bytes=raw)
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-delivery-completed"
+BINARY_VERSION = 1
+BINARY_FORMAT = struct.Struct(">B16s16s16sq")
+
+REQUIRED_FIELDS = ("delivery_id", "order_id", "account_id", "completed_at")
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def uuid_bytes(value) -> bytes:
+    # bytes.fromhex в разы быстрее разбора строки конструктором UUID
+    if isinstance(value, UUID):
+        return value.bytes
+    raw = bytes.fromhex(value.replace("-", ""))
+    if len(raw) != 16:
+        raise ValueError(f"Invalid UUID {value}")
+    return raw
+
+
+def encode_binary(event: dict) -> bytes:
+    """Событие с UUID и completed_at строками или объектами; ValueError, если не хватает полей"""
+    try:
+        delivery_id, order_id = event["delivery_id"], event["order_id"]
+        account_id, completed_at = event["account_id"], event["completed_at"]
+    except KeyError as e:
+        raise ValueError(f"Missing required field {e.args[0]}") from None
+    if isinstance(completed_at, str):
+        completed_at = datetime.fromisoformat(completed_at)
+    return BINARY_FORMAT.pack(
+        BINARY_VERSION,
+        uuid_bytes(delivery_id),
+        uuid_bytes(order_id),
+        uuid_bytes(account_id),
+        (to_naive_utc(completed_at) - EPOCH) // MICROSECOND,
+    )
+
+
+def decode_binary(body: bytes) -> dict:
+    if len(body) != BINARY_FORMAT.size:
+        raise ValueError(f"Binary event must be {BINARY_FORMAT.size} bytes, got {len(body)}")
+    version, delivery_id, order_id, account_id, completed_at = BINARY_FORMAT.unpack(body)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary event version {version}")
+    return {
+        "delivery_id": uuid_from_bytes(delivery_id),
+        "order_id": uuid_from_bytes(order_id),
+        "account_id": uuid_from_bytes(account_id),
+        "completed_at": EPOCH + completed_at * MICROSECOND,
+    }
+
+
+def decode_json(body: bytes) -> dict:
+    data = json.loads(body)
+    for field in ("delivery_id", "order_id"):
+        if not data.get(field):
+            raise ValueError(f"Missing required field {field}")
+    # Старые публикаторы не передавали account_id - счетом был order_id
+    account_id = data.get("account_id", data.get("order_id"))
+    if not account_id:
+        raise ValueError("No account_id found in message")
+    completed_at = data.get("completed_at")
+    return {
+        "delivery_id": UUID(str(data["delivery_id"])),
+        "order_id": UUID(str(data["order_id"])),
+        "account_id": UUID(str(account_id)),
+        "completed_at": to_naive_utc(datetime.fromisoformat(completed_at)) if completed_at else None,
+    }
+
+
+def encode(event: dict, content_type: str) -> bytes:
+    if content_type == BINARY_CONTENT_TYPE:
+        return encode_binary(event)
+    if content_type == JSON_CONTENT_TYPE:
+        return json.dumps(event).encode()
+    raise ValueError(f"Unsupported content type {content_type}")
+
+
+def decode(body: bytes, content_type: str | None) -> dict:
+    """Разбор события по content_type; ValueError, если формат неизвестен или событие некорректно"""
+    if content_type == BINARY_CONTENT_TYPE:
+        return decode_binary(body)
+    if content_type in (None, "", JSON_CONTENT_TYPE):
+        return decode_json(body)
+    raise ValueError(f"Unsupported content type {content_type}")
@@ -0,0 +1,162 @@
+"""Повтор запроса с заголовком Idempotency-Key получает сохраненный ответ без повторного выполнения.
+
+Ответ сохраняется в таблицу ключей сервиса (<сервис>_idempotency_keys, ее модель передается в
+IdempotencyKeys) в той же транзакции, что и изменение, которое он
+описывает: ключ есть в таблице тогда и только тогда, когда изменение закоммичено. Сохраняются только
+успешные ответы - после ошибки ничего не закоммичено, и повтор выполняется заново.
+
+Путь запроса: кеш в памяти процесса, затем одно чтение по первичному ключу, затем сама операция и
+вставка ключа. Одновременные запросы с одним ключом оба доходят до вставки; вторая ждет коммита
+первой на уникальном индексе, не вставляет ничего (KeyConflict), и ее транзакция откатывается.
+Записи старше IDEMPOTENCY_TTL удаляет IdempotencyKeys.run_purger; до удаления просроченный ключ можно занять заново.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from fastapi import Header, HTTPException, Request, Response
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "300"))
+PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "60"))
+PURGE_BATCH_SIZE = int(os.getenv("IDEMPOTENCY_PURGE_BATCH_SIZE", "1000"))
+MAX_KEY_LENGTH = 255
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+
+
+class KeyConflict(Exception):
+    """Ключ занял одновременный запрос, закоммитивший раньше; транзакцию нужно откатить"""
+
+
+class IdempotentRequest:
+    """Ключ и отпечаток запроса; без заголовка все методы ничего не делают"""
+
+    def __init__(self, keys: "IdempotencyKeys", key: str | None, fingerprint: str | None):
+        self.keys = keys
+        self.key = key
+        self.fingerprint = fingerprint
+        self.stored: StoredResponse | None = None
+
+    async def replay(self, db) -> Response | None:
+        """Сохраненный ответ на этот ключ или None, если операцию нужно выполнить"""
+        if self.key is None:
+            return None
+        model = self.keys.model
+        stored, _ = self.keys.responses.get(self.key)
+        if stored is None:
+            row = (await db.execute(
+                select(model.fingerprint, model.status_code, model.response_body)
+                .where(model.key == self.key, model.expires_at > datetime.utcnow())
+            )).first()
+            if row is None:
+                return None
+            stored = StoredResponse(*row)
+            self.keys.responses.set(self.key, stored, 0)
+        if stored.fingerprint != self.fingerprint:
+            raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used with a different request")
+        return Response(
+            stored.body, status_code=stored.status_code, media_type="application/json",
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    async def save(self, db, model: BaseModel, status_code: int = 200):
+        """Ответ в транзакции операции, до коммита; KeyConflict - ключ уже занят"""
+        if self.key is None:
+            return
+        table = self.keys.model
+        now = datetime.utcnow()
+        stored = StoredResponse(self.fingerprint, status_code, model.model_dump_json().encode())
+        stmt = insert(table).values(
+            key=self.key,
+            fingerprint=stored.fingerprint,
+            status_code=stored.status_code,
+            response_body=stored.body,
+            created_date=now,
+            expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL)
+        )
+        # Просроченный, но еще не удаленный ключ занимается заново
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.key],
+            set_={column: stmt.excluded[column] for column in
+                  ("fingerprint", "status_code", "response_body", "created_date", "expires_at")},
+            where=table.expires_at <= now
+        ).returning(table.key)
+        if (await db.execute(stmt)).first() is None:
+            raise KeyConflict(self.key)
+        self.stored = stored
+
+    def committed(self):
+        """После коммита повтор в этом процессе отвечается из памяти"""
+        if self.stored is not None:
+            self.keys.responses.set(self.key, self.stored, 0)
+
+
+class IdempotencyKeys:
+    """Ключи одного сервиса: модель таблицы ключей, фабрика сессий для очистки и кеш ответов процесса.
+
+    cache_class - LocalTTLCache сервиса: get(key) -> (value, generation), set(key, value, generation).
+    """
+
+    def __init__(self, model, session_factory, cache_class):
+        self.model = model
+        self.session_factory = session_factory
+        # Сохраненный ответ не меняется, поэтому кеш не инвалидируется, а только ограничен сроком
+        self.responses = cache_class(IDEMPOTENCY_CACHE_SIZE, min(IDEMPOTENCY_CACHE_TTL, IDEMPOTENCY_TTL))
+
+    async def request(
+            self,
+            request: Request,
+            idempotency_key: str | None = Header(None, alias=IDEMPOTENCY_HEADER)
+    ) -> IdempotentRequest:
+        """Зависимость маршрута: отпечаток - метод, путь и тело запроса как есть"""
+        if idempotency_key is None:
+            return IdempotentRequest(self, None, None)
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH or not idempotency_key.isascii():
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} ASCII characters")
+        digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode())
+        digest.update(await request.body())
+        return IdempotentRequest(self, idempotency_key, digest.hexdigest())
+
+    async def purge_expired(self) -> int:
+        """Удаление просроченных ключей порциями, чтобы не держать долгих блокировок"""
+        purged = 0
+        while True:
+            async with self.session_factory() as db:
+                expired = (
+                    select(self.model.key)
+                    .where(self.model.expires_at <= datetime.utcnow())
+                    .limit(PURGE_BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+                deleted = (await db.execute(
+                    delete(self.model).where(self.model.key.in_(expired))
+                )).rowcount
+                await db.commit()
+            purged += deleted
+            if deleted < PURGE_BATCH_SIZE:
+                return purged
+
+    async def run_purger(self):
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("Purged %d expired idempotency keys", purged)
+            except Exception as e:
+                logger.error("Idempotency key purge error: %s", e)
+            await asyncio.sleep(PURGE_INTERVAL)
@@ -0,0 +1,204 @@
+"""Структурные логи сервиса: JSON-строка на запись в stdout, запись - в отдельном потоке.
+
+Вызов логгера в event loop только кладет запись в ограниченную очередь: форматирование в JSON и
+запись в stdout делает поток QueueListener, а при переполнении очереди записи отбрасываются, а не
+блокируют обработку. Частые записи ограничиваются по шаблону сообщения: не больше LOG_RATE_LIMIT
+в секунду, число пропущенных попадает в поле suppressed следующей записи с тем же шаблоном.
+Поэтому сообщения пишутся %-шаблоном с аргументами, а не f-строкой. Ограничиваются только записи
+ниже LOG_RATE_LIMIT_LEVEL: предупреждения и ошибки (DLQ, сбои публикации, расхождения сверки) пишутся все.
+
+Каждая запись несет correlation_id: его задает CorrelationMiddleware из заголовка X-Correlation-ID
+запроса, а потребитель очереди - из свойства correlation_id сообщения AMQP.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from uuid import uuid4
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json - для promtail/Loki; text - для чтения глазами при локальном запуске
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Записей в секунду с одним шаблоном сообщения; 0 - без ограничения
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+# Записи этого уровня и выше не ограничиваются
+LOG_RATE_LIMIT_LEVEL = logging.getLevelName(os.getenv("LOG_RATE_LIMIT_LEVEL", "WARNING").upper())
+
+CORRELATION_HEADER = "X-Correlation-ID"
+MAX_CORRELATION_ID_LENGTH = 128
+
+correlation_id: ContextVar[str | None] = ContextVar("correlation_id", default=None)
+
+# Атрибуты, которые есть у любой записи; остальные пришли через extra и попадают в JSON полями
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def new_correlation_id() -> str:
+    return uuid4().hex
+
+
+def clean_correlation_id(value: str | None) -> str | None:
+    """Чужой идентификатор принимается, только если он короткий и печатный: он попадает в логи и заголовки"""
+    if value and len(value) <= MAX_CORRELATION_ID_LENGTH and value.isascii() and value.isprintable():
+        return value
+    return None
+
+
+@contextmanager
+def correlation(value: str | None):
+    """Идентификатор корреляции для записей внутри блока"""
+    token = correlation_id.set(value)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись одной JSON-строкой: время, уровень, сервис, логгер, сообщение и поля из extra"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Постановка записи в очередь без ожидания, с ограничением частоты по шаблону сообщения"""
+
+    def __init__(self, records: queue.Queue, rate_limit: int = LOG_RATE_LIMIT,
+                 rate_limit_level: int = LOG_RATE_LIMIT_LEVEL):
+        super().__init__(records)
+        self.rate_limit = rate_limit
+        self.rate_limit_level = rate_limit_level
+        # Шаблон сообщения -> [начало секундного окна, записей в окне, пропущено в окне]
+        self.windows: dict[str, list] = {}
+        self.dropped = 0
+
+    def allow(self, record: logging.LogRecord) -> bool:
+        if self.rate_limit <= 0 or record.levelno >= self.rate_limit_level:
+            return True
+        now = time.monotonic()
+        window = self.windows.get(record.msg)
+        if window is None or now - window[0] >= 1.0:
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            elif len(self.windows) >= 1000:
+                # Шаблонов столько, сколько мест вызова; иначе кто-то пишет f-строками
+                self.windows.clear()
+            self.windows[record.msg] = [now, 1, 0]
+            return True
+        if window[1] < self.rate_limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+    def emit(self, record: logging.LogRecord):
+        # Вызывается под блокировкой обработчика, поэтому окна и счетчик не требуют своей
+        if not self.allow(record):
+            return
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = correlation_id.get()
+        # Аргументы подставляются сразу: поток записи не должен видеть их изменившимися
+        record.msg, record.args = record.getMessage(), None
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """При остановке дописывает всю очередь: маркер конца ставится с ожиданием места, а не put_nowait"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_listener: DrainingQueueListener | None = None
+
+
+def setup(service: str):
+    """Корневой логгер процесса пишет через очередь; повторный вызов ничего не меняет.
+
+    Место вызова (findCaller) logging по-прежнему ищет для каждой записи - публичного способа это
+    отключить нет, хотя поля funcName и lineno в запись не попадают. Это заметная часть цены вызова
+    логгера в event loop; ее не платят только сообщения ниже LOG_LEVEL, отсекаемые до создания записи.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    # Не собирать сведения о потоке и процессе для каждой записи (раздел Optimization документации logging)
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter(service))
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [NonBlockingQueueHandler(records)]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = DrainingQueueListener(records, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class CorrelationMiddleware:
+    """ASGI-middleware: идентификатор корреляции из заголовка запроса или новый, возвращается в ответе"""
+
+    header = CORRELATION_HEADER.lower().encode("latin-1")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        value = None
+        for name, header_value in scope["headers"]:
+            if name == self.header:
+                value = clean_correlation_id(header_value.decode("latin-1"))
+                break
+        value = value or new_correlation_id()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (self.header, value.encode("latin-1"))]
+            await send(message)
+
+        with correlation(value):
+            await self.app(scope, receive, send_wrapper)
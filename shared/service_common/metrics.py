@@ -0,0 +1,158 @@
+"""Метрики Prometheus сервиса.
+
+Порт по умолчанию у каждого сервиса свой, чтобы они не занимали один порт на одном хосте:
+его передает сервис, а METRICS_PORT переопределяет.
+"""
+import os
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Задан при нескольких воркерах gunicorn: воркеры пишут метрики в файлы, отдает их мастер (gunicorn.conf.py)
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the SQLAlchemy pool"
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Database statement execution time", ["operation"]
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Connections currently checked out of the pool",
+    multiprocess_mode="livesum"
+)
+
+PUBLISH_DURATION = Histogram(
+    "amqp_publish_duration_seconds", "Time from publish to broker confirm for one batch"
+)
+PUBLISH_FAILURES = Counter("amqp_publish_failures_total", "Events whose publish batch failed")
+PUBLISHED_EVENTS = Counter("amqp_published_events_total", "Events confirmed by the broker")
+PUBLISH_OUTSTANDING = Gauge(
+    "amqp_publish_outstanding_messages", "Messages published but not yet confirmed by the broker",
+    multiprocess_mode="livesum"
+)
+
+CONSUMER_LAG = Histogram(
+    "amqp_consumer_lag_seconds", "Delay between event publication and its processing",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+CONSUMER_BATCH_SIZE = Histogram(
+    "amqp_consumer_batch_size", "Messages per processed consumer batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+CONSUMED_MESSAGES = Counter("amqp_consumed_messages_total", "Consumed messages by outcome", ["result"])
+
+COALESCED_READS = Counter(
+    "coalesced_reads_total", "Reads served by joining an identical in-flight load", ["resource"]
+)
+
+RECONCILED_ACCOUNTS = Counter("ledger_reconciled_accounts_total", "Accounts checked against the ledger")
+LEDGER_DRIFT_DETECTED = Counter(
+    "ledger_drift_detected_total", "Checks where the stored balance differed from the replayed ledger"
+)
+LEDGER_DRIFT_ACCOUNTS = Gauge(
+    "ledger_drift_accounts", "Accounts with balance drift found by the last full reconciliation pass",
+    multiprocess_mode="mostrecent"
+)
+# Запас секций журнала: алерт, когда до конца последней секции остается меньше месяца
+LEDGER_PARTITIONS_END = Gauge(
+    "ledger_partitions_end_timestamp_seconds",
+    "End of the transactions partitions following each other from the current month",
+    multiprocess_mode="mostrecent"
+)
+LEDGER_DEFAULT_PARTITION_ROWS = Gauge(
+    "ledger_default_partition_rows", "Transactions found in the DEFAULT partition by the last maintenance run",
+    multiprocess_mode="mostrecent"
+)
+
+_server_started = False
+
+
+def metrics_port(default_port: int) -> int:
+    return int(METRICS_PORT or default_port)
+
+
+def start_metrics_server(default_port: int):
+    global _server_started
+    # В многопроцессном режиме порт метрик один на всех, его слушает мастер-процесс
+    if not _server_started and not MULTIPROCESS_DIR:
+        start_http_server(metrics_port(default_port))
+        _server_started = True
+
+
+def start_multiprocess_metrics_server(default_port: int):
+    """Сервер метрик мастер-процесса gunicorn, суммирующий файлы метрик всех воркеров"""
+    from prometheus_client import CollectorRegistry, multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(metrics_port(default_port), registry=registry)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, замеряющий ожидание свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_DURATION.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """Подписка на события движка: время запросов и число занятых соединений"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is not None:
+            operation = statement.lstrip().split(None, 1)[0].upper()
+            DB_QUERY_DURATION.labels(operation).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(sync_engine.pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+
+class PrometheusMiddleware:
+    """ASGI-middleware с гистограммой задержек по шаблону маршрута, а не по сырому пути"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status)
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,29 @@
+"""Проверка готовности: база доступна и ее схема на последней миграции.
+
+`/` отвечает, как только процесс поднялся, `/ready` - когда сервис может обслуживать запросы.
+Движок, таблицу версий и каталог миграций передает сервис: у каждого сервиса они свои.
+"""
+from functools import lru_cache
+from pathlib import Path
+from sqlalchemy import text
+
+
+@lru_cache(maxsize=None)
+def migrations_head(migrations_dir: Path) -> str | None:
+    # alembic нужен только здесь, поэтому импортируется при первой проверке, а не при старте
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory(str(migrations_dir)).get_current_head()
+
+
+async def check(engine, version_table: str, migrations_dir: Path) -> tuple[bool, dict]:
+    try:
+        async with engine.connect() as conn:
+            current = await conn.scalar(text(f"SELECT version_num FROM {version_table}"))
+    except Exception as e:
+        return False, {"status": "not ready", "reason": f"Database unavailable: {e}"}
+
+    head = migrations_head(migrations_dir)
+    if current != head:
+        return False, {"status": "not ready", "reason": f"Schema at {current}, expected {head}"}
+    return True, {"status": "ready", "migration": current}
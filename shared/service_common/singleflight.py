@@ -0,0 +1,81 @@
+"""Совмещение одновременных чтений одного ресурса и условные ответы по ETag.
+
+Одновременные запросы одного ключа ждут одну общую загрузку из БД (SingleFlight). Ответ сериализуется
+один раз и хранится вместе с ETag (Representation): кеш ответов отдает готовые байты, а запрос с
+совпадающим If-None-Match получает 304 без тела.
+"""
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, NamedTuple
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from . import metrics
+
+
+class Representation(NamedTuple):
+    """Сериализованный ответ и его сильный ETag"""
+    body: bytes
+    etag: str
+
+
+def from_body(body: bytes) -> Representation:
+    return Representation(body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+
+
+def from_model(model: BaseModel) -> Representation:
+    return from_body(model.model_dump_json().encode())
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Слабое сравнение по RFC 9110: If-None-Match - список тегов через запятую или *"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def respond(request: Request, representation: Representation) -> Response:
+    """200 с готовым телом или 304, если у клиента та же версия"""
+    headers = {"ETag": representation.etag}
+    if etag_matches(request.headers.get("if-none-match"), representation.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(representation.body, media_type="application/json", headers=headers)
+
+
+class SingleFlight:
+    """Не больше одной загрузки на ключ: вызовы, пришедшие во время загрузки, ждут ее результат.
+
+    Загрузка идет отдельной задачей со своей сессией БД: отмена запроса, который ее начал (клиент
+    закрыл соединение), не отменяет ее для остальных ожидающих.
+    """
+
+    def __init__(self, resource: str):
+        self.resource = resource
+        self.calls: dict[object, asyncio.Task] = {}
+
+    async def do(self, key, load: Callable[[], Awaitable]):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.COALESCED_READS.labels(self.resource).inc()
+        return await asyncio.shield(task)
+
+    def forget(self, key):
+        """После записи новые вызовы не присоединяются к загрузке, начатой до нее"""
+        self.calls.pop(key, None)
+
+    def _finish(self, key, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Ошибку получат ожидающие; если все они отменены, она не должна попасть в лог как забытая
+        if not task.cancelled():
+            task.exception()
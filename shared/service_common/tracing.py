@@ -0,0 +1,395 @@
+"""Трассировка через HTTP, базу и очередь: спаны в модели OpenTelemetry без его SDK.
+
+Контекст трассы передается заголовком traceparent (W3C Trace Context) в HTTP-запросе и в
+заголовках сообщения AMQP. Записывать ли трассу, решается один раз в ее корне по trace_id
+(доля TRACING_SAMPLE_RATIO, как TraceIdRatioBased в OpenTelemetry) и наследуется вложенными
+спанами. Незаписываемая трасса - один общий спан без идентификаторов: внутри нее новые спаны не
+создаются, а ее контекст никуда не передается.
+
+Завершенные спаны копятся в ограниченной очереди, поток экспорта выгружает их пачками в формате
+OTLP/JSON: в файл по строке на пачку, как файловый экспортер OpenTelemetry Collector
+(TRACING_EXPORTER=file), или POST в коллектор (otlp). При переполнении очереди спаны отбрасываются.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# none - трассировка выключена; file - OTLP/JSON в TRACING_FILE; otlp - POST в OTLP_ENDPOINT
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.01"))
+TRACING_FILE = os.getenv("TRACING_FILE", "spans.jsonl")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "4096"))
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", "512"))
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "1.0"))
+
+TRACEPARENT = "traceparent"
+MAX_STATEMENT_LENGTH = 2000
+
+# Виды спанов и коды статуса OTLP
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+STATUS_ERROR = 2
+
+
+class SpanContext(NamedTuple):
+    trace_id: int
+    span_id: int
+    sampled: bool
+
+
+def format_traceparent(context: SpanContext) -> str:
+    return f"00-{context.trace_id:032x}-{context.span_id:016x}-{'01' if context.sampled else '00'}"
+
+
+def parse_traceparent(value: str | bytes | None) -> SpanContext | None:
+    """Контекст из заголовка traceparent; None, если заголовка нет или он некорректен"""
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    try:
+        _, trace_id, span_id, flags = value.split("-")
+        if len(trace_id) != 32 or len(span_id) != 16:
+            return None
+        context = SpanContext(int(trace_id, 16), int(span_id, 16), int(flags, 16) & 1 == 1)
+    except (AttributeError, ValueError):
+        return None
+    return context if context.trace_id and context.span_id else None
+
+
+class Span:
+    __slots__ = ("context", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "links", "status")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: int | None, kind: int,
+                 attributes: dict | None, links: list[SpanContext], start_ns: int | None):
+        self.context = context
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.links = links
+        self.status = None
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.context)
+
+    def set_error(self, error: BaseException):
+        self.status = {"code": STATUS_ERROR, "message": f"{type(error).__name__}: {error}"[:500]}
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.context.sampled and _processor is not None:
+            _processor.submit(self)
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+# Текущий спан всех незаписываемых трасс
+_non_recording = Span("non-recording", SpanContext(0, 0, False), None, INTERNAL, None, [], 0)
+_processor: "BatchSpanProcessor | None" = None
+# Порог младших 64 бит trace_id: трасса записывается, если они меньше него
+_sample_bound = int(TRACING_SAMPLE_RATIO * (1 << 64))
+
+
+def start_span(name: str, kind: int = INTERNAL, parent: SpanContext | None = None, attributes: dict | None = None,
+               links: list[SpanContext] = (), start_ns: int | None = None) -> Span | None:
+    """Новый спан, потомок parent или текущего спана; None, если трассировка выключена.
+
+    Корневой спан записывается с долей TRACING_SAMPLE_RATIO или если записывается трасса хотя бы одной
+    из связей: так обработка пачки сообщений попадает в выборку вместе с трассами этих сообщений.
+    Вне выборки возвращается общий незаписываемый спан.
+    """
+    if _processor is None:
+        return None
+    if parent is None:
+        current = _current.get()
+        parent = current.context if current is not None else None
+    if parent is None:
+        trace_id = random.getrandbits(128) or 1
+        if (trace_id & 0xFFFFFFFFFFFFFFFF) >= _sample_bound and not any(link.sampled for link in links):
+            return _non_recording
+        parent_id = None
+    elif not parent.sampled:
+        return _non_recording
+    else:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    context = SpanContext(trace_id, random.getrandbits(64) or 1, True)
+    return Span(name, context, parent_id, kind, attributes, list(links), start_ns)
+
+
+class SpanScope:
+    """Спан текущий внутри блока with и завершается на выходе из него"""
+
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current.reset(self.token)
+        if exc is not None:
+            self.span.set_error(exc)
+        self.span.end()
+        return False
+
+
+class UnchangedScope:
+    """Блок без нового спана: отдает прежний текущий спан и ничего не меняет"""
+
+    __slots__ = ("span",)
+
+    def __init__(self, span: Span | None):
+        self.span = span
+
+    def __enter__(self) -> Span | None:
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_disabled_scope = UnchangedScope(None)
+_non_recording_scope = UnchangedScope(_non_recording)
+
+
+def span(name: str, kind: int = INTERNAL, parent: SpanContext | None = None, attributes: dict | None = None,
+         links: list[SpanContext] = ()) -> SpanScope | UnchangedScope:
+    """Спан вокруг блока with, текущий для вложенных спанов; внутри незаписываемой трассы - прежний текущий"""
+    if _processor is None:
+        return _disabled_scope
+    if parent is None and _current.get() is _non_recording:
+        return _non_recording_scope
+    return SpanScope(start_span(name, kind, parent, attributes, links))
+
+
+def current_traceparent() -> str | None:
+    """traceparent текущего спана, если его трасса записывается: его сохраняют вместе с отложенной работой"""
+    current = _current.get()
+    return current.traceparent if current is not None and current.context.sampled else None
+
+
+def encode_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def encode_span(span: Span) -> dict:
+    encoded = {
+        "traceId": f"{span.context.trace_id:032x}",
+        "spanId": f"{span.context.span_id:016x}",
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": encode_value(value)} for key, value in span.attributes.items()],
+    }
+    if span.parent_id is not None:
+        encoded["parentSpanId"] = f"{span.parent_id:016x}"
+    if span.links:
+        encoded["links"] = [
+            {"traceId": f"{link.trace_id:032x}", "spanId": f"{link.span_id:016x}"} for link in span.links
+        ]
+    if span.status is not None:
+        encoded["status"] = span.status
+    return encoded
+
+
+def otlp_payload(service: str, spans: list[Span]) -> dict:
+    """Пачка спанов в формате запроса OTLP/HTTP JSON"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [encode_span(span) for span in spans]}],
+    }]}
+
+
+class FileExporter:
+    """Пачка - одна строка OTLP/JSON; одна запись в файл, открытый на дозапись, не перемешивается с другими процессами"""
+
+    def __init__(self, path: str, service: str):
+        self.path = path
+        self.service = service
+
+    def __call__(self, spans: list[Span]):
+        line = json.dumps(otlp_payload(self.service, spans), ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+
+class OtlpHttpExporter:
+    def __init__(self, endpoint: str, service: str, timeout: float = 5):
+        self.endpoint = endpoint
+        self.service = service
+        self.timeout = timeout
+
+    def __call__(self, spans: list[Span]):
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(otlp_payload(self.service, spans)).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class BatchSpanProcessor:
+    """Очередь завершенных спанов и поток, выгружающий их пачками до batch_size или раз в interval секунд"""
+
+    def __init__(self, exporter, queue_size: int, batch_size: int, interval: float):
+        self.exporter = exporter
+        self.spans = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name="span-exporter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, span: Span):
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def export(self, batch: list[Span]):
+        try:
+            self.exporter(batch)
+        except Exception as e:
+            logger.warning("Span export failed, %d spans lost: %s", len(batch), e)
+
+    def run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.spans.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if item is None:
+                    if batch:
+                        self.export(batch)
+                    return
+                batch.append(item)
+            if batch:
+                self.export(batch)
+
+    def shutdown(self):
+        """Выгрузка оставшихся спанов при остановке процесса"""
+        self.spans.put(None)
+        self.thread.join(timeout=10)
+
+
+def setup(service: str):
+    """Запуск экспорта спанов процесса по TRACING_EXPORTER; повторный вызов ничего не меняет"""
+    global _processor
+    if _processor is not None or TRACING_EXPORTER == "none":
+        return
+    if TRACING_EXPORTER == "file":
+        exporter = FileExporter(TRACING_FILE, service)
+    elif TRACING_EXPORTER == "otlp":
+        exporter = OtlpHttpExporter(OTLP_ENDPOINT, service)
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+    processor = BatchSpanProcessor(exporter, TRACING_QUEUE_SIZE, TRACING_BATCH_SIZE, TRACING_EXPORT_INTERVAL)
+    processor.start()
+    atexit.register(processor.shutdown)
+    _processor = processor
+
+
+def instrument_engine(engine):
+    """Спан на каждый запрос к базе, но только внутри записываемой трассы"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        current = _current.get()
+        if current is None or not current.context.sampled:
+            return
+        conn.info["span"] = start_span(statement.lstrip().split(None, 1)[0].upper(), CLIENT, attributes={
+            "db.system": "postgresql",
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+        })
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        query_span = conn.info.pop("span", None)
+        if query_span is not None:
+            query_span.end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        query_span = context.connection.info.pop("span", None) if context.connection is not None else None
+        if query_span is not None:
+            query_span.set_error(context.original_exception)
+            query_span.end()
+
+
+def name_server_span(server_span: Span, scope, status: int):
+    """Имя и атрибуты серверного спана: шаблон маршрута известен только после маршрутизации"""
+    route = scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    server_span.name = f"{scope['method']} {route_path}"
+    server_span.attributes.update({
+        "http.request.method": scope["method"],
+        "http.route": route_path,
+        "http.response.status_code": status,
+    })
+    if status >= 500 and server_span.status is None:
+        server_span.status = {"code": STATUS_ERROR}
+
+
+class TracingMiddleware:
+    """ASGI-middleware: серверный спан на запрос с именем по шаблону маршрута, родитель - из traceparent"""
+
+    header = TRACEPARENT.encode("latin-1")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _processor is None:
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for name, value in scope["headers"]:
+            if name == self.header:
+                parent = parse_traceparent(value)
+                break
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with span(scope["method"], SERVER, parent=parent) as server_span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if server_span.context.sampled:
+                    name_server_span(server_span, scope, status)
+
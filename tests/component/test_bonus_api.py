@@ -1,3 +1,5 @@
+import os
+
 import pytest
 import requests
 from uuid import uuid4
@@ -23,6 +25,12 @@ class TestBonusAPI:
         assert response.status_code == 200
         assert "Bonus Service is running" in response.text
 
+    def test_service_ready(self):
+        """Тест готовности: база доступна и схема на последней миграции"""
+        response = requests.get(f"{self.BASE_URL.replace('/api', '')}/ready", timeout=10)
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+
     def test_accrue_points_basic(self):
         """Базовый тест начисления баллов"""
         account_id = str(uuid4())
@@ -50,4 +58,265 @@ class TestBonusAPI:
             assert data["amount"] == 100.0
         else:
             # Пока просто проверяем что не 500
-            assert response.status_code != 500
\ No newline at end of file
+            assert response.status_code != 500
+
+    def test_oversized_amount_rejected(self):
+        """Тест: сумма, которая не помещается в NUMERIC(18, 2), отклоняется валидацией, а не падает в БД"""
+        account_id = str(uuid4())
+        for path in ("accrue", "write-off"):
+            for amount in (1e30, 1e17, 12345678901234567):
+                response = requests.post(
+                    f"{self.BASE_URL}/accounts/{account_id}/{path}",
+                    json={"order_id": str(uuid4()), "amount": amount, "reason": "Слишком большая сумма"},
+                    timeout=10
+                )
+                assert response.status_code == 422, (path, amount, response.text)
+
+    def test_balance_reflects_accrual_after_read(self):
+        """Тест: закешированный баланс сбрасывается после начисления"""
+        account_id = str(uuid4())
+
+        empty_balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert empty_balance.status_code == 200
+        assert empty_balance.json()["current_balance"] == 0.0
+
+        accrue_response = requests.post(
+            f"{self.BASE_URL}/accounts/{account_id}/accrue",
+            json={"order_id": str(uuid4()), "amount": 100.0, "reason": "Тест кеша баланса"},
+            timeout=10
+        )
+        assert accrue_response.status_code == 200
+
+        balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert balance.status_code == 200
+        assert balance.json()["current_balance"] == 100.0
+
+    def test_balance_etag(self):
+        """Тест: баланс без изменений отдается как 304, после начисления - с новым ETag"""
+        account_id = str(uuid4())
+        requests.post(
+            f"{self.BASE_URL}/accounts/{account_id}/accrue",
+            json={"order_id": str(uuid4()), "amount": 10.0, "reason": "Тест ETag"},
+            timeout=10
+        )
+
+        first = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        etag = first.headers["ETag"]
+        not_modified = requests.get(
+            f"{self.BASE_URL}/accounts/{account_id}/balance", headers={"If-None-Match": etag}, timeout=10
+        )
+        assert not_modified.status_code == 304
+
+        requests.post(
+            f"{self.BASE_URL}/accounts/{account_id}/accrue",
+            json={"order_id": str(uuid4()), "amount": 10.0, "reason": "Тест ETag"},
+            timeout=10
+        )
+        changed = requests.get(
+            f"{self.BASE_URL}/accounts/{account_id}/balance", headers={"If-None-Match": etag}, timeout=10
+        )
+        assert changed.status_code == 200
+        assert changed.json()["current_balance"] == 20.0
+
+    def test_accrue_idempotency_key(self):
+        """Тест: повтор начисления с тем же Idempotency-Key возвращает тот же ответ без второй транзакции"""
+        account_id = str(uuid4())
+        payload = {"order_id": str(uuid4()), "amount": 100.0, "reason": "Тест идемпотентности"}
+        headers = {"Idempotency-Key": str(uuid4())}
+
+        first = requests.post(f"{self.BASE_URL}/accounts/{account_id}/accrue", json=payload, headers=headers, timeout=10)
+        replay = requests.post(f"{self.BASE_URL}/accounts/{account_id}/accrue", json=payload, headers=headers, timeout=10)
+        assert first.status_code == 200
+        assert replay.status_code == 200
+        assert replay.json() == first.json()
+
+        balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert balance.json()["current_balance"] == 100.0
+
+        other = requests.post(
+            f"{self.BASE_URL}/accounts/{account_id}/accrue",
+            json={**payload, "amount": 50.0}, headers=headers, timeout=10
+        )
+        assert other.status_code == 422
+
+    def test_bonus_multiplier_rounds_to_cents(self):
+        """Тест: начисление с множителем хранится с точностью до копеек без накопления ошибки"""
+        account_id = str(uuid4())
+
+        for _ in range(3):
+            response = requests.post(
+                f"{self.BASE_URL}/accounts/{account_id}/accrue",
+                json={"order_id": str(uuid4()), "amount": 600.01, "reason": "Тест округления"},
+                timeout=10
+            )
+            assert response.status_code == 200
+            assert response.json()["amount"] == 630.01
+
+        balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert balance.json()["current_balance"] == 1890.03
+
+    def test_missing_account_etag_stable(self):
+        """Тест: ETag пустого счета не меняется между загрузками, опрос получает 304"""
+        account_id = str(uuid4())
+        first = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert first.json()["current_balance"] == 0.0
+        etag = first.headers["ETag"]
+
+        # Другой процесс загружает счет заново, как и этот после истечения BALANCE_CACHE_TTL
+        replica_url = os.getenv("BONUS_REPLICA_URL", "http://localhost:8003/api")
+        for url in (self.BASE_URL, replica_url):
+            try:
+                response = requests.get(
+                    f"{url}/accounts/{account_id}/balance", headers={"If-None-Match": etag}, timeout=10
+                )
+            except requests.exceptions.ConnectionError:
+                continue
+            assert response.status_code == 304
+
+    def test_balance_written_by_another_process(self):
+        """Тест: запись в одном процессе сервиса сразу видна при чтении через другой, где баланс уже в кеше"""
+        replica_url = os.getenv("BONUS_REPLICA_URL", "http://localhost:8003/api")
+        try:
+            requests.get(f"{replica_url.replace('/api', '')}/", timeout=5)
+        except requests.exceptions.ConnectionError:
+            pytest.skip("Второй процесс Bonus Service не запущен (BONUS_REPLICA_URL)")
+
+        account_id = str(uuid4())
+        urls = [self.BASE_URL, replica_url]
+        balance = 0.0
+        for step, (amount, kind) in enumerate([(100.0, "accrue"), (50.0, "accrue"), (30.0, "write-off")]):
+            writer, reader = urls[step % 2], urls[(step + 1) % 2]
+            # Читающий процесс кеширует текущий баланс до записи
+            for _ in range(2):
+                cached = requests.get(f"{reader}/accounts/{account_id}/balance", timeout=10)
+                assert cached.json()["current_balance"] == balance
+
+            response = requests.post(
+                f"{writer}/accounts/{account_id}/{kind}",
+                json={"order_id": str(uuid4()), "amount": amount, "reason": "Запись в другом процессе"},
+                timeout=10
+            )
+            assert response.status_code == 200
+            balance += amount if kind == "accrue" else -amount
+
+            fresh = requests.get(
+                f"{reader}/accounts/{account_id}/balance",
+                headers={"If-None-Match": cached.headers["ETag"]}, timeout=10
+            )
+            assert fresh.status_code == 200
+            assert fresh.json()["current_balance"] == balance
+
+    def test_transactions_batch_modes(self):
+        """Тест пакетных операций в режимах atomic и best_effort"""
+        account_id = str(uuid4())
+        operations = [
+            {"account_id": account_id, "type": "ACCRUAL", "order_id": str(uuid4()),
+             "amount": 100.0, "reason": "Пакетное начисление"},
+            {"account_id": account_id, "type": "WRITE_OFF", "order_id": str(uuid4()),
+             "amount": 30.0, "reason": "Пакетное списание"},
+            {"account_id": account_id, "type": "WRITE_OFF", "order_id": str(uuid4()),
+             "amount": 1000.0, "reason": "Списание сверх баланса"},
+        ]
+
+        atomic_response = requests.post(
+            f"{self.BASE_URL}/transactions:batch",
+            json={"mode": "atomic", "operations": operations},
+            timeout=10
+        )
+        assert atomic_response.status_code == 400
+        assert atomic_response.json()["applied"] == 0
+
+        best_effort_response = requests.post(
+            f"{self.BASE_URL}/transactions:batch",
+            json={"mode": "best_effort", "operations": operations},
+            timeout=10
+        )
+        assert best_effort_response.status_code == 200
+        data = best_effort_response.json()
+        assert data["applied"] == 2
+        assert [result["success"] for result in data["results"]] == [True, True, False]
+        assert "insufficient" in data["results"][2]["error"].lower()
+
+        balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert balance.json()["current_balance"] == 70.0
+
+    def test_transactions_batch_write_off_with_delivery_rejected(self):
+        """Тест: delivery_id у списания в пачке - ошибка запроса, а не молча отброшенное поле"""
+        account_id = str(uuid4())
+        operations = [
+            {"account_id": account_id, "type": "ACCRUAL", "order_id": str(uuid4()),
+             "amount": 100.0, "reason": "Пакетное начисление"},
+            {"account_id": account_id, "type": "WRITE_OFF", "order_id": str(uuid4()), "delivery_id": str(uuid4()),
+             "amount": 30.0, "reason": "Списание с доставкой"},
+        ]
+
+        response = requests.post(
+            f"{self.BASE_URL}/transactions:batch",
+            json={"mode": "best_effort", "operations": operations},
+            timeout=10
+        )
+        assert response.status_code == 422
+        assert "delivery_id" in response.text
+
+        balance = requests.get(f"{self.BASE_URL}/accounts/{account_id}/balance", timeout=10)
+        assert balance.json()["current_balance"] == 0.0
+
+    def test_transactions_batch_bonus_tiers(self):
+        """Тест: начисления пачки получают множитель своей ступени, списания - без бонуса"""
+        account_id = str(uuid4())
+        operations = [
+            {"account_id": account_id, "type": "ACCRUAL", "order_id": str(uuid4()),
+             "amount": amount, "reason": "Ступени бонуса"}
+            for amount in (500.0, 600.0, 1200.0)
+        ]
+        operations.insert(1, {"account_id": account_id, "type": "WRITE_OFF", "order_id": str(uuid4()),
+                              "amount": 100.0, "reason": "Списание"})
+
+        response = requests.post(
+            f"{self.BASE_URL}/transactions:batch",
+            json={"mode": "atomic", "operations": operations},
+            timeout=10
+        )
+        assert response.status_code == 200
+        amounts = [result["transaction"]["amount"] for result in response.json()["results"]]
+        assert amounts == [500.0, 100.0, 630.0, 1320.0]
+
+    def test_transaction_history_pagination(self):
+        """Тест истории операций: keyset-пагинация и фильтр по типу"""
+        account_id = str(uuid4())
+        for amount in (10.0, 20.0, 30.0):
+            requests.post(
+                f"{self.BASE_URL}/accounts/{account_id}/accrue",
+                json={"order_id": str(uuid4()), "amount": amount, "reason": "Тест истории"},
+                timeout=10
+            )
+        requests.post(
+            f"{self.BASE_URL}/accounts/{account_id}/write-off",
+            json={"order_id": str(uuid4()), "amount": 5.0, "reason": "Тест истории"},
+            timeout=10
+        )
+
+        first_page = requests.get(
+            f"{self.BASE_URL}/accounts/{account_id}/transactions",
+            params={"type": "ACCRUAL", "limit": 2},
+            timeout=10
+        )
+        assert first_page.status_code == 200
+        data = first_page.json()
+        assert [item["amount"] for item in data["items"]] == [30.0, 20.0]
+
+        second_page = requests.get(
+            f"{self.BASE_URL}/accounts/{account_id}/transactions",
+            params={"type": "ACCRUAL", "limit": 2, "cursor": data["next_cursor"]},
+            timeout=10
+        )
+        assert [item["amount"] for item in second_page.json()["items"]] == [10.0]
+        assert second_page.json()["next_cursor"] is None
+
+        export = requests.get(
+            f"{self.BASE_URL}/accounts/{account_id}/transactions",
+            params={"stream": "true"},
+            timeout=10
+        )
+        assert export.status_code == 200
+        assert len(export.text.strip().splitlines()) == 4
@@ -16,6 +16,19 @@ class TestDeliveryAPI:
         except requests.exceptions.ConnectionError:
             pytest.skip("Delivery Service не запущен")
 
+    def test_service_ready(self):
+        """Тест готовности: база доступна и схема на последней миграции"""
+        response = requests.get(f"{self.BASE_URL.replace('/api', '')}/ready", timeout=10)
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+
+    def test_correlation_id_echoed(self):
+        """Тест идентификатора корреляции: переданный возвращается, без заголовка выдается новый"""
+        base_url = self.BASE_URL.replace('/api', '')
+        response = requests.get(f"{base_url}/", headers={"X-Correlation-ID": "test-correlation"}, timeout=5)
+        assert response.headers["X-Correlation-ID"] == "test-correlation"
+        assert requests.get(f"{base_url}/", timeout=5).headers["X-Correlation-ID"]
+
     def test_create_delivery_basic(self):
         """Базовый тест создания доставки"""
         delivery_data = {
@@ -40,4 +53,196 @@ class TestDeliveryAPI:
             assert data["status"] == "CREATED"
             assert data["order_id"] == delivery_data["order_id"]
         else:
-            assert response.status_code != 500
\ No newline at end of file
+            assert response.status_code != 500
+
+    def test_list_deliveries_pagination(self):
+        """Тест keyset-пагинации и фильтров списка доставок"""
+        order_id = str(uuid4())
+        for i in range(3):
+            requests.post(
+                f"{self.BASE_URL}/deliveries",
+                json={
+                    "order_id": order_id,
+                    "address_from": f"ул. Ленина, {i}",
+                    "address_to": "ул. Пушкина, 10",
+                    "recipient_name": "Иван Иванов",
+                    "recipient_phone": "+79123456789"
+                },
+                timeout=10
+            )
+
+        first_page = requests.get(
+            f"{self.BASE_URL}/deliveries",
+            params={"order_id": order_id, "limit": 2},
+            timeout=10
+        )
+        assert first_page.status_code == 200
+        data = first_page.json()
+        assert len(data["items"]) == 2
+        assert data["next_cursor"] is not None
+
+        second_page = requests.get(
+            f"{self.BASE_URL}/deliveries",
+            params={"order_id": order_id, "limit": 2, "cursor": data["next_cursor"]},
+            timeout=10
+        )
+        assert second_page.status_code == 200
+        second_data = second_page.json()
+        assert len(second_data["items"]) == 1
+        assert second_data["next_cursor"] is None
+
+        first_ids = {item["id"] for item in data["items"]}
+        assert second_data["items"][0]["id"] not in first_ids
+
+    def test_list_deliveries_stream(self):
+        """Тест потоковой выгрузки доставок в NDJSON"""
+        response = requests.get(
+            f"{self.BASE_URL}/deliveries",
+            params={"stream": "true", "status": "CREATED"},
+            timeout=30
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    def test_batch_create_and_assign(self):
+        """Тест пакетного создания доставок и пакетного назначения курьера"""
+        deliveries = [
+            {
+                "order_id": str(uuid4()),
+                "address_from": f"ул. Ленина, {i}",
+                "address_to": "ул. Пушкина, 10",
+                "recipient_name": "Иван Иванов",
+                "recipient_phone": "+79123456789"
+            }
+            for i in range(3)
+        ]
+        create_response = requests.post(
+            f"{self.BASE_URL}/deliveries:batch",
+            json={"deliveries": deliveries},
+            timeout=10
+        )
+        assert create_response.status_code == 200
+        created = create_response.json()
+        assert [item["status"] for item in created] == ["CREATED"] * 3
+
+        courier_id = str(uuid4())
+        updates = [{"id": item["id"], "courier_id": courier_id, "status": "ASSIGNED"} for item in created]
+        updates.append({"id": created[0]["id"], "status": "DELIVERED"})
+        updates.append({"id": str(uuid4()), "status": "ASSIGNED"})
+
+        atomic_response = requests.patch(
+            f"{self.BASE_URL}/deliveries:batch",
+            json={"updates": updates},
+            timeout=10
+        )
+        assert atomic_response.status_code == 400
+        assert atomic_response.json()["applied"] == 0
+
+        best_effort_response = requests.patch(
+            f"{self.BASE_URL}/deliveries:batch",
+            json={"mode": "best_effort", "updates": updates},
+            timeout=10
+        )
+        assert best_effort_response.status_code == 200
+        results = best_effort_response.json()["results"]
+        assert [result["success"] for result in results] == [True, True, True, True, False]
+        assert results[3]["delivery"]["status"] == "DELIVERED"
+        assert results[1]["delivery"]["courier_id"] == courier_id
+
+    def test_courier_workload_and_unassigned(self):
+        """Тест счетчиков по курьеру и очереди ожидающих назначения доставок"""
+        created = requests.post(
+            f"{self.BASE_URL}/deliveries:batch",
+            json={"deliveries": [
+                {
+                    "order_id": str(uuid4()),
+                    "address_from": f"ул. Ленина, {i}",
+                    "address_to": "ул. Пушкина, 10",
+                    "recipient_name": "Иван Иванов",
+                    "recipient_phone": "+79123456789"
+                }
+                for i in range(3)
+            ]},
+            timeout=10
+        ).json()
+
+        unassigned = requests.get(f"{self.BASE_URL}/deliveries:unassigned", params={"limit": 200}, timeout=10)
+        assert unassigned.status_code == 200
+        dates = [item["created_date"] for item in unassigned.json()["items"]]
+        assert all(item["status"] == "CREATED" for item in unassigned.json()["items"])
+        assert dates == sorted(dates)
+
+        courier_id = str(uuid4())
+        updates = [{"id": item["id"], "courier_id": courier_id, "status": "ASSIGNED"} for item in created]
+        updates.append({"id": created[0]["id"], "status": "DELIVERED"})
+        response = requests.patch(f"{self.BASE_URL}/deliveries:batch", json={"updates": updates}, timeout=10)
+        assert response.status_code == 200
+
+        workload = requests.get(
+            f"{self.BASE_URL}/couriers/workload",
+            params={"courier_id": courier_id},
+            timeout=10
+        )
+        assert workload.status_code == 200
+        couriers = workload.json()["couriers"]
+        assert len(couriers) == 1
+        assert couriers[0]["assigned"] == 2
+        assert couriers[0]["delivered_since"] == 1
+        assert couriers[0]["oldest_assigned_date"] is not None
+
+    def test_get_delivery_etag(self):
+        """Тест: неизменившаяся доставка отдается как 304, после изменения - новая версия"""
+        created = requests.post(
+            f"{self.BASE_URL}/deliveries",
+            json={
+                "order_id": str(uuid4()),
+                "address_from": "ул. Ленина, 1",
+                "address_to": "ул. Пушкина, 10",
+                "recipient_name": "Иван Иванов",
+                "recipient_phone": "+79123456789"
+            },
+            timeout=10
+        ).json()
+
+        first = requests.get(f"{self.BASE_URL}/deliveries/{created['id']}", timeout=10)
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+
+        not_modified = requests.get(
+            f"{self.BASE_URL}/deliveries/{created['id']}", headers={"If-None-Match": etag}, timeout=10
+        )
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == etag
+        assert not_modified.content == b""
+
+        requests.patch(
+            f"{self.BASE_URL}/deliveries/{created['id']}",
+            json={"courier_id": str(uuid4()), "status": "ASSIGNED"},
+            timeout=10
+        )
+        changed = requests.get(
+            f"{self.BASE_URL}/deliveries/{created['id']}", headers={"If-None-Match": etag}, timeout=10
+        )
+        assert changed.status_code == 200
+        assert changed.json()["status"] == "ASSIGNED"
+        assert changed.headers["ETag"] != etag
+
+    def test_create_delivery_idempotency_key(self):
+        """Тест: повтор создания с тем же Idempotency-Key возвращает ту же доставку"""
+        payload = {
+            "order_id": str(uuid4()),
+            "address_from": "ул. Ленина, 1",
+            "address_to": "ул. Пушкина, 10",
+            "recipient_name": "Иван Иванов",
+            "recipient_phone": "+79123456789"
+        }
+        headers = {"Idempotency-Key": str(uuid4())}
+
+        first = requests.post(f"{self.BASE_URL}/deliveries", json=payload, headers=headers, timeout=10)
+        replay = requests.post(f"{self.BASE_URL}/deliveries", json=payload, headers=headers, timeout=10)
+        assert first.status_code == 200
+        assert replay.status_code == 200
+        assert replay.json()["id"] == first.json()["id"]
+
+        without_key = requests.post(f"{self.BASE_URL}/deliveries", json=payload, timeout=10)
+        assert without_key.json()["id"] != first.json()["id"]
@@ -0,0 +1,72 @@
+import pytest
+import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+
+class TestConcurrentBalance:
+    """Нагрузочные тесты конкурентных операций с одним счетом"""
+
+    BONUS_URL = "http://localhost:8002/api"
+    WORKERS = 50
+
+    def setup_method(self):
+        """Проверяем доступность Bonus сервиса"""
+        try:
+            response = requests.get(self.BONUS_URL.replace('/api', ''), timeout=5)
+            assert response.status_code == 200
+        except requests.exceptions.ConnectionError:
+            pytest.fail("Bonus Service не запущен")
+
+    def accrue(self, account_id, amount):
+        return requests.post(
+            f"{self.BONUS_URL}/accounts/{account_id}/accrue",
+            json={"order_id": str(uuid4()), "amount": amount, "reason": "Нагрузочный тест начисления"},
+            timeout=60
+        )
+
+    def write_off(self, account_id, amount):
+        return requests.post(
+            f"{self.BONUS_URL}/accounts/{account_id}/write-off",
+            json={"order_id": str(uuid4()), "amount": amount, "reason": "Нагрузочный тест списания"},
+            timeout=60
+        )
+
+    def get_balance(self, account_id):
+        response = requests.get(f"{self.BONUS_URL}/accounts/{account_id}/balance", timeout=10)
+        assert response.status_code == 200
+        return response.json()["current_balance"]
+
+    def test_concurrent_accruals_are_not_lost(self):
+        """Тест: параллельные начисления на один счет суммируются без потерь"""
+        account_id = str(uuid4())
+        operations = 200
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            responses = list(pool.map(lambda _: self.accrue(account_id, 10.0), range(operations)))
+        elapsed = time.perf_counter() - started
+
+        print(f"{operations} accruals in {elapsed:.2f}s ({operations / elapsed:.1f} ops/s)")
+        assert all(response.status_code == 200 for response in responses)
+        assert self.get_balance(account_id) == operations * 10.0
+
+    def test_concurrent_write_offs_do_not_overdraw(self):
+        """Тест: параллельные списания не уводят баланс в минус и не теряют обновления"""
+        account_id = str(uuid4())
+        assert self.accrue(account_id, 100.0).status_code == 200
+
+        attempts = 100
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            responses = list(pool.map(lambda _: self.write_off(account_id, 10.0), range(attempts)))
+        elapsed = time.perf_counter() - started
+
+        succeeded = sum(1 for response in responses if response.status_code == 200)
+        rejected = sum(1 for response in responses if response.status_code == 400)
+
+        print(f"{attempts} write-offs in {elapsed:.2f}s ({attempts / elapsed:.1f} ops/s), succeeded: {succeeded}")
+        assert succeeded == 10
+        assert rejected == attempts - succeeded
+        assert self.get_balance(account_id) == 0.0
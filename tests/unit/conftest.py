@@ -0,0 +1,24 @@
+import importlib
+import importlib.machinery
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def import_service_module(service: str, module: str):
+    """Модуль пакета app сервиса под именем <service>_app: у обоих сервисов пакет называется app"""
+    package = f"{service}_app"
+    if package not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(package, None, is_package=True)
+        spec.submodule_search_locations = [str(ROOT / f"{service}_service" / "app")]
+        sys.modules[package] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{package}.{module}")
+
+
+@pytest.fixture(scope="session")
+def service_module():
+    return import_service_module
@@ -0,0 +1,195 @@
+import json
+import os
+from decimal import Decimal
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def rules(service_module):
+    return service_module("bonus", "rules")
+
+
+def config(**accrual) -> dict:
+    return {
+        "version": "test",
+        "accrual": {
+            "tiers": [
+                {"above": "500.00", "multiplier": "1.05"},
+                {"above": "1000.00", "multiplier": "1.1"},
+            ],
+            **accrual,
+        },
+        "events": {"delivery_completed": {"amount": "50.00", "reason": "Начисление за доставку"}},
+    }
+
+
+def amounts(*values) -> list[Decimal]:
+    return [Decimal(value) for value in values]
+
+
+class TestCompiledRules:
+    """Ступень действует для сумм строго больше порога; apply (bisect) и apply_many (searchsorted) совпадают"""
+
+    @pytest.mark.parametrize("amount, expected", [
+        ("0.01", "0.01"),
+        ("500.00", "500.00"),
+        ("500.01", "525.01"),
+        ("1000.00", "1050.00"),
+        ("1000.01", "1100.01"),
+        ("123456.78", "135802.46"),
+    ])
+    def test_tier_boundaries(self, rules, amount, expected):
+        ruleset = rules.compile_rules(config())
+        assert ruleset.apply(Decimal(amount)) == Decimal(expected)
+        assert ruleset.apply_many([Decimal(amount)]) == [Decimal(expected)]
+
+    def test_bonus_rounded_half_up(self, rules):
+        # 10.10 * 1.05 = 10.605 -> 10.61
+        ruleset = rules.compile_rules(config(tiers=[{"above": "0", "multiplier": "1.05"}]))
+        assert ruleset.apply(Decimal("10.10")) == Decimal("10.61")
+        assert ruleset.apply_many(amounts("10.10")) == amounts("10.61")
+
+    def test_global_cap(self, rules):
+        ruleset = rules.compile_rules(config(max_bonus="30.00"))
+        # Бонус 25.01 меньше ограничения, 50.00 и 100.00 срезаются до 30.00
+        assert ruleset.apply_many(amounts("500.01", "1000.00", "1000.01")) == amounts("525.01", "1030.00", "1030.01")
+
+    def test_tier_cap_overrides_global(self, rules):
+        ruleset = rules.compile_rules(config(max_bonus="30.00", tiers=[
+            {"above": "500.00", "multiplier": "1.05"},
+            {"above": "1000.00", "multiplier": "1.1", "max_bonus": "75.00"},
+        ]))
+        assert ruleset.apply_many(amounts("999.99", "1000.01", "5000.00")) == amounts("1029.99", "1075.01", "5075.00")
+
+    def test_zero_cap_disables_bonus(self, rules):
+        ruleset = rules.compile_rules(config(max_bonus="0"))
+        assert ruleset.apply_many(amounts("500.01", "2000.00")) == amounts("500.01", "2000.00")
+
+    def test_base_multiplier_below_first_tier(self, rules):
+        ruleset = rules.compile_rules(config(base_multiplier="1.01"))
+        assert ruleset.apply(Decimal("100.00")) == Decimal("101.00")
+
+    def test_bisect_and_searchsorted_agree(self, rules):
+        ruleset = rules.compile_rules(config(max_bonus="60.00", tiers=[
+            {"above": "100.00", "multiplier": "1.0001"},
+            {"above": "500.00", "multiplier": "1.05", "max_bonus": "20.00"},
+            {"above": "1000.00", "multiplier": "1.1"},
+            {"above": "5000.00", "multiplier": "1.5", "max_bonus": "1000.00"},
+        ]))
+        values = []
+        for threshold in ("100.00", "500.00", "1000.00", "5000.00"):
+            for delta in ("-0.01", "0", "0.01"):
+                values.append(Decimal(threshold) + Decimal(delta))
+        values += amounts("0.01", "0.99", "399.99", "1200.00", "1600.00", "9999999.99", "9999999999999.99",
+                          "9999999999999999.99")
+        assert ruleset.apply_many(values) == [ruleset.apply(value) for value in values]
+        # Суммы до batch_limit идут векторным путем
+        assert ruleset.apply_many(values[:-2]) == [ruleset.apply(value) for value in values[:-2]]
+
+    def test_empty_batch(self, rules):
+        assert rules.compile_rules(config()).apply_many([]) == []
+
+    def test_event_bonus(self, rules):
+        bonus = rules.compile_rules(config()).event("delivery_completed")
+        assert bonus.amount == Decimal("50.00")
+
+
+class TestInvalidRules:
+    """Ошибочная конфигурация отклоняется с указанием поля"""
+
+    @pytest.mark.parametrize("tiers, field", [
+        ([{"above": "1000.00", "multiplier": "1.1"}, {"above": "500.00", "multiplier": "1.05"}], "accrual.tiers[1].above"),
+        ([{"above": "500.00", "multiplier": "1.05"}, {"above": "500", "multiplier": "1.1"}], "accrual.tiers[1].above"),
+        ([{"above": "500.00", "multiplier": "0.9"}], "accrual.tiers[0].multiplier"),
+        ([{"above": "500.00", "multiplier": "1.00001"}], "accrual.tiers[0].multiplier"),
+        ([{"above": "500.00", "multiplier": "many"}], "accrual.tiers[0].multiplier"),
+        ([{"above": "500.00"}], "accrual.tiers[0]"),
+        ([{"above": "500.00", "multiplier": "1.05", "max_bonus": "-1"}], "accrual.tiers[0].max_bonus"),
+    ])
+    def test_invalid_tiers(self, rules, tiers, field):
+        with pytest.raises(ValueError, match=field.replace("[", r"\[").replace("]", r"\]")):
+            rules.compile_rules(config(tiers=tiers))
+
+    def test_negative_global_cap(self, rules):
+        with pytest.raises(ValueError, match="accrual.max_bonus"):
+            rules.compile_rules(config(max_bonus="-0.01"))
+
+    def test_missing_required_event(self, rules):
+        broken = config()
+        broken["events"] = {}
+        with pytest.raises(ValueError, match="delivery_completed"):
+            rules.compile_rules(broken)
+
+    @pytest.mark.parametrize("event, field", [
+        ({"amount": "0", "reason": "x"}, "events.delivery_completed.amount"),
+        ({"amount": "50.00"}, "events.delivery_completed.reason"),
+    ])
+    def test_invalid_event(self, rules, event, field):
+        broken = config()
+        broken["events"]["delivery_completed"] = event
+        with pytest.raises(ValueError, match=field):
+            rules.compile_rules(broken)
+
+
+class TestReload:
+    """Файл правил: загрузка при старте и перечитывание при изменении"""
+
+    @pytest.fixture
+    def rules_file(self, rules, tmp_path, monkeypatch):
+        path = tmp_path / "bonus_rules.json"
+        monkeypatch.setattr(rules, "BONUS_RULES_FILE", path)
+        monkeypatch.setattr(rules, "_current", None)
+        monkeypatch.setattr(rules, "_loaded_mtime", None)
+        return path
+
+    @staticmethod
+    def write(path, content: str, mtime: int):
+        path.write_text(content, encoding="utf-8")
+        # Явное время изменения: запись в ту же секунду не должна зависеть от точности часов ФС
+        os.utime(path, (mtime, mtime))
+
+    def test_current_loads_lazily(self, rules, rules_file):
+        self.write(rules_file, json.dumps({**config(), "version": "v1"}), 1_000)
+        assert rules.current().version == "v1"
+
+    def test_bad_file_fails_first_load(self, rules, rules_file):
+        self.write(rules_file, json.dumps({**config(), "events": {}}), 1_000)
+        with pytest.raises(ValueError, match="delivery_completed"):
+            rules.load_current()
+
+    def test_unchanged_file_not_reloaded(self, rules, rules_file):
+        self.write(rules_file, json.dumps({**config(), "version": "v1"}), 1_000)
+        rules.load_current()
+        assert rules.reload() is False
+
+    def test_changed_file_applied(self, rules, rules_file):
+        self.write(rules_file, json.dumps({**config(), "version": "v1"}), 1_000)
+        rules.load_current()
+        self.write(rules_file, json.dumps({**config(), "version": "v2"}), 2_000)
+        assert rules.reload() is True
+        assert rules.current().version == "v2"
+
+    @pytest.mark.parametrize("content", [
+        "{not json",
+        json.dumps({**config(), "events": {}}),
+        json.dumps(config(tiers=[{"above": "1000.00", "multiplier": "1.1"}, {"above": "500.00", "multiplier": "1.05"}])),
+    ])
+    def test_bad_reload_keeps_previous_rules(self, rules, rules_file, content):
+        self.write(rules_file, json.dumps({**config(), "version": "v1"}), 1_000)
+        loaded = rules.load_current()
+        self.write(rules_file, content, 2_000)
+        assert rules.reload() is False
+        assert rules.current() is loaded
+        # Ошибочный файл не перечитывается, пока не изменится снова
+        assert rules.reload() is False
+        self.write(rules_file, json.dumps({**config(), "version": "v3"}), 3_000)
+        assert rules.reload() is True
+        assert rules.current().version == "v3"
+
+    def test_missing_file_keeps_previous_rules(self, rules, rules_file):
+        self.write(rules_file, json.dumps({**config(), "version": "v1"}), 1_000)
+        loaded = rules.load_current()
+        rules_file.unlink()
+        assert rules.reload() is False
+        assert rules.current() is loaded
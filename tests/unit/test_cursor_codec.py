@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def pagination(service_module):
+    return service_module("delivery", "pagination")
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+class TestCursorCodec:
+    """Непрозрачный курсор keyset-пагинации: ключ (created_date, id) последней строки страницы"""
+
+    @pytest.mark.parametrize("created_date", [
+        datetime(2026, 10, 18, 2, 3, 4, 567891),
+        datetime(2026, 1, 1),
+        datetime(1999, 12, 31, 23, 59, 59),
+    ])
+    def test_round_trip(self, pagination, created_date):
+        item_id = uuid4()
+        cursor = pagination.encode_cursor(created_date, item_id)
+        assert pagination.decode_cursor(cursor) == (created_date, item_id)
+
+    def test_cursor_is_url_safe_without_padding(self, pagination):
+        for _ in range(50):
+            cursor = pagination.encode_cursor(datetime.utcnow(), uuid4())
+            assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+    def test_truncated_cursor_rejected(self, pagination):
+        cursor = pagination.encode_cursor(datetime(2026, 10, 18, 12, 0), uuid4())
+        for length in (1, 5, len(cursor) // 2, len(cursor) - 3):
+            with pytest.raises(ValueError):
+                pagination.decode_cursor(cursor[:length])
+
+    @pytest.mark.parametrize("cursor", [
+        "",
+        "not a cursor!",
+        "%%%%",
+        base64.urlsafe_b64encode(b"\xff\xfe\x00garbage").decode(),
+        raw_cursor({"created_date": "2026-10-18T00:00:00", "id": str(uuid4())}),
+        raw_cursor(["2026-10-18T00:00:00"]),
+        raw_cursor(["2026-10-18T00:00:00", str(uuid4()), "extra"]),
+        raw_cursor(["yesterday", str(uuid4())]),
+        raw_cursor(["2026-10-18T00:00:00", "not-a-uuid"]),
+        raw_cursor([None, None]),
+    ])
+    def test_tampered_cursor_rejected(self, pagination, cursor):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            pagination.decode_cursor(cursor)
@@ -0,0 +1,71 @@
+import importlib
+import json
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def codec():
+    return importlib.import_module("service_common.codec")
+
+
+def event() -> dict:
+    return {
+        "delivery_id": str(uuid4()),
+        "order_id": str(uuid4()),
+        "account_id": str(uuid4()),
+        "completed_at": "2026-10-18T02:03:04.567891",
+    }
+
+
+class TestEventCodec:
+    """Форматы события delivery_completed: JSON и бинарный с версией"""
+
+    @pytest.mark.parametrize("content_type", ["application/json", "application/x-delivery-completed"])
+    def test_round_trip(self, codec, content_type):
+        source = event()
+        decoded = codec.decode(codec.encode(source, content_type), content_type)
+        assert {key: str(value) for key, value in decoded.items() if key != "completed_at"} == {
+            key: source[key] for key in ("delivery_id", "order_id", "account_id")
+        }
+        assert decoded["completed_at"] == datetime(2026, 10, 18, 2, 3, 4, 567891)
+
+    def test_binary_completed_at_normalized_to_utc(self, codec):
+        source = {**event(), "completed_at": datetime(2026, 10, 18, 5, 0, tzinfo=timezone(timedelta(hours=3)))}
+        decoded = codec.decode_binary(codec.encode_binary(source))
+        assert decoded["completed_at"] == datetime(2026, 10, 18, 2, 0)
+
+    def test_json_without_account_id_falls_back_to_order_id(self, codec):
+        source = event()
+        del source["account_id"]
+        decoded = codec.decode(json.dumps(source).encode(), None)
+        assert str(decoded["account_id"]) == source["order_id"]
+
+    def test_binary_truncated_or_padded_rejected(self, codec):
+        body = codec.encode_binary(event())
+        for tampered in (body[:-1], body[:10], body + b"\x00", b""):
+            with pytest.raises(ValueError):
+                codec.decode_binary(tampered)
+
+    def test_binary_unknown_version_rejected(self, codec):
+        body = codec.encode_binary(event())
+        with pytest.raises(ValueError, match="version"):
+            codec.decode_binary(bytes([codec.BINARY_VERSION + 1]) + body[1:])
+
+    def test_missing_field_rejected(self, codec):
+        source = event()
+        del source["delivery_id"]
+        with pytest.raises(ValueError, match="delivery_id"):
+            codec.encode_binary(source)
+        with pytest.raises(ValueError, match="delivery_id"):
+            codec.decode(json.dumps(source).encode(), "application/json")
+
+    def test_invalid_uuid_rejected(self, codec):
+        with pytest.raises(ValueError):
+            codec.encode_binary({**event(), "account_id": "abcd"})
+
+    def test_unknown_content_type_rejected(self, codec):
+        with pytest.raises(ValueError, match="content type"):
+            codec.decode(b"{}", "text/plain")
@@ -0,0 +1,56 @@
+import importlib
+import logging
+import queue
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def logs():
+    return importlib.import_module("service_common.logs")
+
+
+def record(level: int, msg: str = "Processed batch of %d messages") -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, (1,), None)
+
+
+class TestRateLimit:
+    """Ограничение частоты записей по шаблону: только для уровней ниже rate_limit_level"""
+
+    def test_info_limited_per_template(self, logs):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(), rate_limit=3)
+        allowed = [handler.allow(record(logging.INFO)) for _ in range(10)]
+        assert allowed == [True] * 3 + [False] * 7
+        # Другой шаблон считается отдельно
+        assert handler.allow(record(logging.INFO, "Another message %d"))
+
+    @pytest.mark.parametrize("level", [logging.WARNING, logging.ERROR, logging.CRITICAL])
+    def test_warnings_and_errors_never_dropped(self, logs, level):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(), rate_limit=3)
+        assert all(handler.allow(record(level)) for _ in range(100))
+
+    def test_level_configurable(self, logs):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(), rate_limit=1, rate_limit_level=logging.ERROR)
+        assert [handler.allow(record(logging.WARNING)) for _ in range(3)] == [True, False, False]
+        assert all(handler.allow(record(logging.ERROR)) for _ in range(3))
+
+    def test_suppressed_count_reported(self, logs, monkeypatch):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(), rate_limit=1)
+        clock = [100.0]
+        monkeypatch.setattr(logs.time, "monotonic", lambda: clock[0])
+        for _ in range(5):
+            handler.allow(record(logging.INFO))
+        clock[0] += 1.0
+        next_window = record(logging.INFO)
+        assert handler.allow(next_window)
+        assert next_window.suppressed == 4
+
+    def test_emit_keeps_errors_under_flood(self, logs):
+        records = queue.Queue()
+        handler = logs.NonBlockingQueueHandler(records, rate_limit=2)
+        for _ in range(50):
+            handler.emit(record(logging.INFO))
+            handler.emit(record(logging.ERROR, "Message sent to DLQ: %d"))
+        levels = [records.get_nowait().levelno for _ in range(records.qsize())]
+        assert levels.count(logging.INFO) == 2
+        assert levels.count(logging.ERROR) == 50
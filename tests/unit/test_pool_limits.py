@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def pool_limits(service_module):
+    return service_module("delivery", "database").pool_limits
+
+
+class TestPoolLimits:
+    """Размер пула одного процесса при общем бюджете соединений сервиса"""
+
+    def test_no_budget_keeps_configured_sizes(self, pool_limits):
+        assert pool_limits(10, 20, 4, 0) == (10, 20)
+
+    def test_budget_split_across_processes(self, pool_limits):
+        # 40 соединений на 3 процесса - по 13, из них 10 постоянных
+        pool_size, max_overflow = pool_limits(10, 20, 3, 40)
+        assert (pool_size, max_overflow) == (10, 3)
+        assert 3 * (pool_size + max_overflow) <= 40
+
+    def test_small_share_caps_pool_size_and_drops_overflow(self, pool_limits):
+        assert pool_limits(10, 20, 3, 12) == (4, 0)
+
+    def test_share_never_below_one_connection(self, pool_limits):
+        assert pool_limits(10, 20, 8, 4) == (1, 0)
+
+    def test_zero_processes_treated_as_one(self, pool_limits):
+        assert pool_limits(10, 20, 0, 15) == (10, 5)
+
+    @pytest.mark.parametrize("processes, budget", [(1, 40), (2, 40), (3, 40), (5, 37), (16, 100)])
+    def test_processes_stay_within_budget(self, pool_limits, processes, budget):
+        pool_size, max_overflow = pool_limits(10, 20, processes, budget)
+        assert pool_size >= 1 and max_overflow >= 0
+        assert processes * (pool_size + max_overflow) <= budget